@@ -25,18 +25,29 @@
 # Generate time varying constellation satellite positions based on configuration
 ##########################################################################################
 
+# Argument:
+#   $1: number of cores assigned to the routine (optional, default 1)
+# Example: ./01_get_time_varying_sat_positions.sh 7
+
 NUM_ORBITS=40 # options: 40 (for 40_40_53deg), 34 (kuiper_p1), 24 (starlink_p1)
 NUM_SATS_PER_ORBIT=40 # options: 40 (for 40_40_53deg), 34 (kuiper_p1), 66 (starlink_p1)
 INCLINATION=53 # options: 53 (for 40_40_53deg), 51.9 (kuiper_p1), 53 (starlink_p1)
 ECCENTRICITY=0.001 # Circular orbits
 ARG_OF_PERIGEE=0.0 # Circular orbits
-MEAN_MOTION=15.19 # 15.19 taken from Tintin A anb B TLEs
+MEAN_MOTION=15.19 # 15.19 taken from Tintin A anb B TLEs (14.80 for kuiper_p1)
 PHASE_DIFF="Y" # Neighboring satellites in adjacent orbits has a phase difference
 
+PHASE_DIFF_ARG=""
+if [[ $PHASE_DIFF != "Y" ]]
+then
+	PHASE_DIFF_ARG="--no-phase-diff"
+fi
+
 rm ../output_data_generated/sat_positions/*
 
-#Get satellite positions for 120 minutes starting from epoch
-for (( i=0; i<120; i++ ))
-do
-	./02_get_sat_positions_at_time.sh $i $NUM_ORBITS $NUM_SATS_PER_ORBIT $INCLINATION $ECCENTRICITY $ARG_OF_PERIGEE $MEAN_MOTION $PHASE_DIFF
-done
+#Get satellite positions for 120 minutes starting from epoch, all time steps in a single process
+#(02_get_sat_positions_at_time.sh still generates a single time step one satellite at a time)
+python3 generate_sat_positions.py --num-orbits $NUM_ORBITS --num-sats-per-orbit $NUM_SATS_PER_ORBIT \
+	--inclination $INCLINATION --eccentricity $ECCENTRICITY --arg-of-perigee $ARG_OF_PERIGEE \
+	--mean-motion $MEAN_MOTION $PHASE_DIFF_ARG --num-steps 120 --cores ${1:-1} \
+	--output-dir ../output_data_generated/sat_positions
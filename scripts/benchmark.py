@@ -0,0 +1,423 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Benchmarks the hot paths of the motif pipeline on the shipped constellations and stores the results as JSON for
+# regression comparison. For every constellation and every ISL length variant found in ../input_data it times:
+#   read_inputs: satellite positions, valid ISLs, cities, city coverage and city pairs (records/s)
+#   motif_enumeration: candidate motifs of the zones of find_multi_motifs.py (motifs/s)
+#   add_motif_links_to_graph: motif ISLs added to a networkx graph as in find_multi_motifs.py (motifs/s)
+#   build_motif_graph: CSR graph of a motif (motifs/s)
+#   compute_metric_avoid_city: metric of motif graphs over all city pairs (pairs/s)
+#   compute_metric_avoid_city_matrix: the same with the two-stage satellite distance matrix evaluation (pairs/s)
+#   compute_metric_avoid_city_astar: the same with one A* search per city pair (pairs/s)
+#   build_contraction_hierarchy: contraction hierarchy index of motif graphs (motifs/s)
+#   compute_metric_avoid_city_ch: the metric over all city pairs from the indexes (pairs/s)
+#   regenerate_baseline: baseline +Grid graph and metric (pairs/s)
+# Every stage runs --repeat times and the fastest run is reported. One more run under tracemalloc gives the peak
+# memory allocated by the stage; the peak resident memory of the process is reported as well.
+#
+# Examples:
+#   python3 benchmark.py
+#   python3 benchmark.py --constellations 40_40_53deg --compare ../output_data_generated/benchmarks/before.json
+
+import argparse
+import datetime
+import glob
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import networkx as nx
+import numpy as np
+
+try:
+    from . import util
+    from . import metric
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+    from . import contraction_hierarchy
+except (ImportError, SystemError):
+    import util
+    import metric
+    import csr_graph
+    import geometry
+    import loader
+    import contraction_hierarchy
+
+CONSTELLATIONS = {
+    "40_40_53deg": {"num_orbits": 40, "num_sats_per_orbit": 40},
+    "kuiper_p1": {"num_orbits": 34, "num_sats_per_orbit": 34},
+    "starlink_p1": {"num_orbits": 24, "num_sats_per_orbit": 66}
+}
+LEVELS = [0.0, 18.0, 36.0, 90.0]  # Zones of find_multi_motifs.py
+
+
+def get_isl_length_variants(config):
+    """
+    Lists the maximum ISL lengths with valid ISLs available for a constellation
+    :param config: Constellation name
+    :return: Maximum ISL lengths as strings, in increasing order
+    """
+    pattern = os.path.join("../input_data/constellation_" + config, "data_validISLs_*")
+    variants = [os.path.basename(path)[len("data_validISLs_"):] for path in glob.glob(pattern)]
+    return sorted(variants, key=float)
+
+
+def read_inputs(config, max_isl_length):
+    """
+    Reads every input of a constellation snapshot the way find_multi_motifs.py does
+    :param config: Constellation name
+    :param max_isl_length: Maximum ISL length of the valid ISL variant
+    :return: Collection of the inputs and the number of records read
+    """
+    num_orbits = CONSTELLATIONS[config]["num_orbits"]
+    num_sats_per_orbit = CONSTELLATIONS[config]["num_sats_per_orbit"]
+    constellation_dir = "../input_data/constellation_" + config
+    positions = loader.load_sat_positions(os.path.join(constellation_dir, "data_sat_position", "sat_positions_0.txt"))
+    sat_positions = {}
+    orb_0_sat_positions = {}
+    for sat_id, orb_id, orb_sat_id, lat_deg, long_deg, alt_km in positions.tolist():
+        sat_positions[sat_id] = {
+            "orb_id": orb_id,
+            "orb_sat_id": orb_sat_id,
+            "lat_deg": lat_deg,
+            "lat_rad": math.radians(lat_deg),
+            "long_deg": long_deg,
+            "long_rad": math.radians(long_deg),
+            "alt_km": alt_km
+        }
+        if len(orb_0_sat_positions) < num_sats_per_orbit / 4 and orb_id == 0:
+            orb_0_sat_positions[sat_id] = sat_positions[sat_id]
+    valid_isls = util.read_valid_isls(os.path.join(constellation_dir, "data_validISLs_" + max_isl_length,
+                                                   "valid_ISLs_0.txt"))
+    city_positions, _ = util.read_city_positions("../input_data/data_cities/cities.txt", None)
+    city_coverage = util.read_city_coverage(os.path.join(constellation_dir, "data_coverage", "city_coverage_0.txt"))
+    city_pairs = util.read_city_pair_file("../input_data/data_cities/city_pairs_rand_5K.txt")
+    inputs = {
+        "num_orbits": num_orbits,
+        "num_sats_per_orbit": num_sats_per_orbit,
+        "sat_positions": sat_positions,
+        "orb_0_sat_positions": orb_0_sat_positions,
+        "orbit_slot_index": util.build_orbit_slot_index(sat_positions, num_orbits, num_sats_per_orbit),
+        "sat_cartesian": geometry.get_sat_cartesian(positions),
+        "sat_abs_lat_deg": np.abs(positions["lat_deg"]),
+        "valid_isls": valid_isls,
+        "city_positions": city_positions,
+        "city_coverage_index": util.build_city_coverage_index(city_coverage),
+        "city_pairs": city_pairs,
+        "city_pair_groups": metric.group_city_pairs_by_source(city_pairs)
+    }
+    records = len(sat_positions) + len(valid_isls) + len(city_positions) + len(city_coverage) + len(city_pairs)
+    return inputs, records
+
+
+def enumerate_motifs(inputs):
+    """
+    Enumerates the candidate motifs of every zone
+    :param inputs: Output of read_inputs
+    :return: List of the motif collections of the zones
+    """
+    return [util.find_zone_motif_possibilities(inputs["valid_isls"], inputs["sat_positions"],
+                                               inputs["orb_0_sat_positions"], inputs["num_orbits"],
+                                               inputs["num_sats_per_orbit"], LEVELS[l], LEVELS[l + 1])
+            for l in range(len(LEVELS) - 1)]
+
+
+def add_motif_links_to_graph(inputs, motif, lat_level):
+    """
+    Adds the ISLs of a motif to a networkx graph of the satellites and cities, as find_multi_motifs.py does
+    :param inputs: Output of read_inputs
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :param lat_level: The zone for which the motif is added
+    :return: Graph
+    """
+    grph = nx.Graph()
+    grph.add_nodes_from(inputs["sat_positions"])
+    grph.add_nodes_from(inputs["city_positions"])
+    candidates = util.get_zone_candidates(inputs["orbit_slot_index"], motif, inputs["sat_abs_lat_deg"], lat_level)
+    lengths = geometry.get_pair_distances(inputs["sat_cartesian"], [c[0] for c in candidates],
+                                          [c[1] for c in candidates])
+    for (i, sel_sat_id), dist in zip(candidates, lengths.tolist()):
+        if util.check_edge_availability(grph, i, sel_sat_id):
+            grph.add_edge(i, sel_sat_id, length=dist, level=lat_level)
+    return grph
+
+
+def build_motif_graph(inputs, motif, lat_level):
+    """
+    Builds the CSR graph of a motif
+    :param inputs: Output of read_inputs
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :param lat_level: The zone for which the motif is added
+    :return: CSR graph
+    """
+    zone = {"lat_bottom": lat_level, "lat_top": None, "motif": motif}
+    isls = csr_graph.build_zone_isls(inputs["orbit_slot_index"], [zone], inputs["sat_cartesian"],
+                                     inputs["sat_abs_lat_deg"])
+    return csr_graph.build_csr_graph(len(inputs["sat_positions"]), isls)
+
+
+def compute_metric(inputs, graph, mode="search"):
+    """
+    Computes the metric of a graph over all city pairs
+    :param inputs: Output of read_inputs
+    :param graph: CSR graph
+    :param mode: search (metric.compute_metric_avoid_city), matrix (metric.compute_metric_avoid_city_matrix) or astar
+                 (metric.compute_metric_avoid_city_astar)
+    :return: Computed aggregated metric
+    """
+    if mode == "astar":
+        return metric.compute_metric_avoid_city_astar(graph, inputs["city_pairs"], inputs["city_positions"],
+                                                      inputs["city_coverage_index"], inputs["sat_cartesian"])
+    compute = metric.compute_metric_avoid_city_matrix if mode == "matrix" else metric.compute_metric_avoid_city
+    return compute(graph, inputs["city_pairs"], inputs["city_positions"], inputs["city_coverage_index"],
+                   inputs["city_pair_groups"])
+
+
+def read_baseline_motif(baseline_config_file):
+    """
+    Reads the baseline configuration
+    :param baseline_config_file: Input file containing baseline configuration
+    :return: Latitude above which the motif applies and the motif
+    """
+    val = open(baseline_config_file).readline().rstrip('\n').split(",")
+    return float(val[0]), {
+        "sat_1_orb_offset": int(val[2]),
+        "sat_1_sat_offset": int(val[3]),
+        "sat_2_orb_offset": int(val[4]),
+        "sat_2_sat_offset": int(val[5])
+    }
+
+
+def get_peak_rss_mb():
+    """
+    Gets the peak resident memory of the process so far
+    :return: Peak resident memory in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run_stage(name, func, unit, repeat, trace_memory):
+    """
+    Times a benchmark stage
+    :param name: Stage name
+    :param func: Function running the stage once and returning the number of items it processed
+    :param unit: Unit of the items, e.g. motifs
+    :param repeat: Number of timed runs; the fastest one is reported
+    :param trace_memory: Whether to run the stage once more under tracemalloc to get its peak allocation
+    :return: Stage result
+    """
+    seconds = []
+    items = 0
+    for _ in range(repeat):
+        a = time.perf_counter()
+        items = func()
+        seconds.append(time.perf_counter() - a)
+    peak_traced_mb = None
+    if trace_memory:
+        tracemalloc.start()
+        func()
+        peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    best = min(seconds)
+    result = {
+        "stage": name,
+        "seconds": best,
+        "items": items,
+        "unit": unit,
+        "throughput": items / best if best > 0 else None,
+        "peak_traced_mb": peak_traced_mb,
+        "peak_rss_mb": get_peak_rss_mb()
+    }
+    print("  " + name + ": " + "%.4f" % best + " s, " + str(items) + " " + unit + ", "
+          + ("%.1f" % result["throughput"] if result["throughput"] else "-") + " " + unit + "/s"
+          + (", peak " + "%.1f" % peak_traced_mb + " MB" if peak_traced_mb is not None else ""))
+    return result
+
+
+def benchmark_variant(config, max_isl_length, num_motifs, repeat, trace_memory):
+    """
+    Runs every stage on one constellation and ISL length variant
+    :param config: Constellation name
+    :param max_isl_length: Maximum ISL length of the valid ISL variant
+    :param num_motifs: Number of zone 0 motifs used for graph construction and metric stages
+    :param repeat: Number of timed runs per stage
+    :param trace_memory: Whether to measure the peak allocation of every stage
+    :return: List of stage results
+    """
+    print(config, max_isl_length)
+    state = {}
+
+    def read_stage():
+        state["inputs"], records = read_inputs(config, max_isl_length)
+        return records
+
+    def enumeration_stage():
+        state["zone_motifs"] = enumerate_motifs(state["inputs"])
+        return sum(len(motifs) for motifs in state["zone_motifs"])
+
+    def networkx_stage():
+        for motif in state["motifs"]:
+            add_motif_links_to_graph(state["inputs"], motif, LEVELS[0])
+        return len(state["motifs"])
+
+    def csr_stage():
+        state["graphs"] = [build_motif_graph(state["inputs"], motif, LEVELS[0]) for motif in state["motifs"]]
+        return len(state["motifs"])
+
+    def metric_stage():
+        for graph in state["graphs"]:
+            compute_metric(state["inputs"], graph)
+        return len(state["graphs"]) * len(state["inputs"]["city_pairs"])
+
+    def matrix_stage():
+        for graph in state["graphs"]:
+            compute_metric(state["inputs"], graph, "matrix")
+        return len(state["graphs"]) * len(state["inputs"]["city_pairs"])
+
+    def astar_stage():
+        state["astar_counts"] = [0, 0]
+        for graph in state["graphs"]:
+            return_val = compute_metric(state["inputs"], graph, "astar")
+            state["astar_counts"][0] += return_val["expandedSatellites"]
+            state["astar_counts"][1] += return_val["searchSettledSatellites"]
+        return len(state["graphs"]) * len(state["inputs"]["city_pairs"])
+
+    def ch_build_stage():
+        state["indexes"] = [contraction_hierarchy.build_contraction_hierarchy(graph) for graph in state["graphs"]]
+        return len(state["graphs"])
+
+    def ch_metric_stage():
+        for index in state["indexes"]:
+            contraction_hierarchy.compute_metric_avoid_city_ch(index, state["inputs"]["city_pairs"],
+                                                               state["inputs"]["city_positions"],
+                                                               state["inputs"]["city_coverage_index"])
+        return len(state["indexes"]) * len(state["inputs"]["city_pairs"])
+
+    def baseline_stage():
+        lat_level, motif = read_baseline_motif("../input_data/baseline_config.txt")
+        compute_metric(state["inputs"], build_motif_graph(state["inputs"], motif, lat_level))
+        return len(state["inputs"]["city_pairs"])
+
+    results = [run_stage("read_inputs", read_stage, "records", repeat, trace_memory),
+               run_stage("motif_enumeration", enumeration_stage, "motifs", repeat, trace_memory)]
+    state["motifs"] = [state["zone_motifs"][0][cnt] for cnt in range(min(num_motifs, len(state["zone_motifs"][0])))]
+    results.append(run_stage("add_motif_links_to_graph", networkx_stage, "motifs", repeat, trace_memory))
+    results.append(run_stage("build_motif_graph", csr_stage, "motifs", repeat, trace_memory))
+    results.append(run_stage("compute_metric_avoid_city", metric_stage, "pairs", repeat, trace_memory))
+    results.append(run_stage("compute_metric_avoid_city_matrix", matrix_stage, "pairs", repeat, trace_memory))
+    results.append(run_stage("compute_metric_avoid_city_astar", astar_stage, "pairs", repeat, trace_memory))
+    expanded, settled = state["astar_counts"]
+    results[-1]["expanded_satellites"] = expanded
+    results[-1]["search_settled_satellites"] = settled
+    print("    satellites expanded by A*: " + str(expanded) + ", settled by the per-source search: " + str(settled)
+          + " (" + "%.1f" % (100.0 * expanded / settled if settled else 0.0) + "%)")
+    results.append(run_stage("build_contraction_hierarchy", ch_build_stage, "motifs", repeat, trace_memory))
+    results.append(run_stage("compute_metric_avoid_city_ch", ch_metric_stage, "pairs", repeat, trace_memory))
+    results.append(run_stage("regenerate_baseline", baseline_stage, "pairs", repeat, trace_memory))
+    for result in results:
+        result["constellation"] = config
+        result["max_isl_length"] = max_isl_length
+    return results
+
+
+def get_environment():
+    """
+    Describes the machine and code version the benchmark ran on
+    :return: Collection of environment properties
+    """
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "networkx": nx.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def compare_results(results, reference_file):
+    """
+    Prints the throughput speedup of every stage over a previous benchmark
+    :param results: Stage results of this run
+    :param reference_file: JSON output of a previous run
+    """
+    with open(reference_file) as reader:
+        reference = json.load(reader)
+    previous = {(r["constellation"], r["max_isl_length"], r["stage"]): r for r in reference["results"]}
+    print("comparison with", reference_file, "(" + str(reference["environment"].get("git_commit")) + ")")
+    for result in results:
+        key = (result["constellation"], result["max_isl_length"], result["stage"])
+        if key not in previous or not result["throughput"] or not previous[key]["throughput"]:
+            continue
+        # Throughput rather than time, so runs with a different --motifs remain comparable
+        print("  " + " ".join(key) + ": " + "%.1f" % previous[key]["throughput"] + " -> "
+              + "%.1f" % result["throughput"] + " " + result["unit"] + "/s, speedup "
+              + "%.2f" % (result["throughput"] / previous[key]["throughput"]) + "x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark motif construction and metric evaluation")
+    parser.add_argument("--constellations", nargs="+", choices=sorted(CONSTELLATIONS.keys()),
+                        default=sorted(CONSTELLATIONS.keys()))
+    parser.add_argument("--motifs", type=int, default=2,
+                        help="Number of zone 0 motifs for the graph construction and metric stages")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per stage; the fastest one is reported")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the extra tracemalloc run of every stage")
+    parser.add_argument("--output", help="JSON output (default ../output_data_generated/benchmarks/"
+                                         "benchmark_<timestamp>.json)")
+    parser.add_argument("--compare", help="JSON output of a previous run to compare with")
+    args = parser.parse_args()
+
+    all_results = []
+    for constellation in args.constellations:
+        variants = get_isl_length_variants(constellation)
+        if not variants:
+            print(constellation, ": no valid ISLs found, skipped")
+        for variant in variants:
+            all_results.extend(benchmark_variant(constellation, variant, args.motifs, args.repeat,
+                                                 not args.no_memory))
+
+    output = args.output
+    if output is None:
+        output = os.path.join("../output_data_generated/benchmarks",
+                              "benchmark_" + datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    if os.path.dirname(output) and not os.path.isdir(os.path.dirname(output)):
+        os.makedirs(os.path.dirname(output))
+    with open(output, "w") as writer:
+        json.dump({"environment": get_environment(), "results": all_results}, writer, indent=2)
+    print("results written to", output)
+    if args.compare:
+        compare_results(all_results, args.compare)
@@ -0,0 +1,413 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Contraction hierarchy of a fixed satellite graph, for answering many city pair queries on one topology, e.g. the
+# best_motif_overall.txt graph of find_multi_motifs.py evaluated on other city pair files or on all city pairs.
+# Satellites are contracted one by one, adding a shortcut between two neighbors of the contracted satellite
+# whenever no other path is as short. Every edge then leads from a lower to a higher ranked satellite, and the
+# shortest path between two cities is found by meeting two upward searches, one from the up-links of each city.
+# Cities stay out of the hierarchy and attach through their up/down-links at query time, so no path transits
+# through a city, as in metric.compute_metric_avoid_city. Paths are compared by distance, then by hop count.
+#
+# The index holds the rank of every satellite and the upward edges (ISLs and shortcuts with their length and hop
+# count) as CSR arrays, and is saved as a compressed NPZ file together with the digest of the ISL set it was built
+# from. A snapshot with other ISL lengths needs its own index.
+#
+# Example (index of the best overall topology, then the metric of all 5K city pairs from the index):
+#   python3 contraction_hierarchy.py 40_40_53deg ../output_data_generated/multi_motif/best_motif_overall.txt \
+#       --index ../output_data_generated/multi_motif/best_motif_overall_ch.npz
+
+import argparse
+import heapq
+import json
+import os
+import time
+import numpy as np
+
+try:
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+    from . import metric
+    from . import profiling
+    from . import result_cache
+    from . import util
+except (ImportError, SystemError):
+    import csr_graph
+    import geometry
+    import loader
+    import metric
+    import profiling
+    import result_cache
+    import util
+
+INDEX_VERSION = 1
+WITNESS_SETTLE_LIMIT = 200  # Satellites settled by a witness search before a shortcut is added without proof
+NO_PATH = (float("inf"), None)
+
+
+def witness_search(edges, source, avoid, max_dist, settle_limit):
+    """
+    Runs a bounded Dijkstra over the satellites not contracted yet, looking for paths that make shortcuts through
+    the satellite being contracted unnecessary
+    :param edges: Current edges of the remaining graph, mapping neighbor to (length, hops) per satellite
+    :param source: Start of the search
+    :param avoid: Satellite being contracted
+    :param max_dist: Distance beyond which no witness is needed
+    :param settle_limit: Maximum number of settled satellites
+    :return: Mapping from reached satellite to the (distance, hops) of the best path found
+    """
+    best = {source: (0.0, 0)}
+    heap = [(0.0, 0, source)]
+    settled = 0
+    while heap and settled < settle_limit:
+        d, h, u = heapq.heappop(heap)
+        if d > max_dist:
+            break
+        if (d, h) > best[u]:
+            continue
+        settled += 1
+        for v, (w, hw) in edges[u].items():
+            if v == avoid:
+                continue
+            cost = (d + w, h + hw)
+            if v not in best or cost < best[v]:
+                best[v] = cost
+                heapq.heappush(heap, (cost[0], cost[1], v))
+    return best
+
+
+def get_shortcuts(edges, node, settle_limit):
+    """
+    Finds the shortcuts needed to contract a satellite: one for each pair of its remaining neighbors whose path
+    through it has no witness at least as good (shorter, or as short with no more hops)
+    :param edges: Current edges of the remaining graph
+    :param node: Satellite to contract
+    :param settle_limit: Maximum number of satellites settled by a witness search
+    :return: List of (neighbor 1, neighbor 2, (length, hops)) shortcuts
+    """
+    neighbors = sorted(edges[node].items())
+    shortcuts = []
+    for i in range(len(neighbors) - 1):
+        u, (length_u, hops_u) = neighbors[i]
+        candidates = [(v, (length_u + length_v, hops_u + hops_v)) for v, (length_v, hops_v) in neighbors[i + 1:]]
+        witnesses = witness_search(edges, u, node, max(cost[0] for v, cost in candidates), settle_limit)
+        for v, cost in candidates:
+            if v not in witnesses or witnesses[v] > cost:
+                shortcuts.append((u, v, cost))
+    return shortcuts
+
+
+def build_contraction_hierarchy(graph, settle_limit=WITNESS_SETTLE_LIMIT):
+    """
+    Contracts the satellites in the order of their edge difference (shortcuts added minus edges removed) plus their
+    number of contracted neighbors, which spreads contractions evenly over the constellation. Priorities are
+    recomputed lazily when a satellite comes up for contraction.
+    :param graph: CSR graph of the satellite network (see csr_graph.build_csr_graph)
+    :param settle_limit: Maximum number of satellites settled by a witness search
+    :return: Index with the rank of every satellite and the upward edges as CSR arrays (offsets, neighbors, length,
+             hops)
+    """
+    num_nodes = graph["num_nodes"]
+    edges = [{} for _ in range(num_nodes)]
+    for u, neighbors in enumerate(csr_graph.get_adjacency_lists(graph)):
+        for v, w in neighbors:
+            if (w, 1) < edges[u].get(v, NO_PATH):
+                edges[u][v] = (w, 1)
+    contracted_neighbors = [0] * num_nodes
+    heap = [(len(get_shortcuts(edges, u, settle_limit)) - len(edges[u]), u) for u in range(num_nodes)]
+    heapq.heapify(heap)
+    rank = np.zeros(num_nodes, dtype=np.int32)
+    upward = [None] * num_nodes
+    num_shortcuts = 0
+    next_rank = 0
+    while heap:
+        priority, u = heapq.heappop(heap)
+        shortcuts = get_shortcuts(edges, u, settle_limit)
+        priority = len(shortcuts) - len(edges[u]) + contracted_neighbors[u]
+        if heap and priority > heap[0][0]:
+            heapq.heappush(heap, (priority, u))
+            continue
+        rank[u] = next_rank
+        next_rank += 1
+        upward[u] = sorted(edges[u].items())
+        for v in edges[u]:
+            del edges[v][u]
+            contracted_neighbors[v] += 1
+        for v_1, v_2, cost in shortcuts:
+            if cost < edges[v_1].get(v_2, NO_PATH):
+                num_shortcuts += v_2 not in edges[v_1]
+                edges[v_1][v_2] = cost
+                edges[v_2][v_1] = cost
+        edges[u] = {}
+    offsets = np.zeros(num_nodes + 1, dtype=np.int32)
+    np.cumsum([len(upward[u]) for u in range(num_nodes)], out=offsets[1:])
+    flat = [edge for u in range(num_nodes) for edge in upward[u]]
+    return {
+        "num_nodes": num_nodes,
+        "num_shortcuts": num_shortcuts,
+        "rank": rank,
+        "offsets": offsets,
+        "neighbors": np.array([v for v, cost in flat], dtype=np.int32),
+        "length": np.array([cost[0] for v, cost in flat], dtype=np.float64),
+        "hops": np.array([cost[1] for v, cost in flat], dtype=np.int32)
+    }
+
+
+def get_upward_lists(index):
+    """
+    Unpacks the upward CSR arrays into per-satellite Python lists for the searches
+    :param index: Output of build_contraction_hierarchy or load_index
+    :return: List of (neighbor, length, hops) lists indexed by satellite
+    """
+    offsets = index["offsets"].tolist()
+    neighbors = index["neighbors"].tolist()
+    length = index["length"].tolist()
+    hops = index["hops"].tolist()
+    return [list(zip(neighbors[offsets[u]:offsets[u + 1]], length[offsets[u]:offsets[u + 1]],
+                     hops[offsets[u]:offsets[u + 1]]))
+            for u in range(index["num_nodes"])]
+
+
+def upward_search(upward, seeds):
+    """
+    Runs Dijkstra over upward edges only, from a virtual source attached to the seed satellites. The result is the
+    search space of a city, valid as either end of a query since the graph is undirected. A satellite that a higher
+    ranked satellite already reached reaches more cheaply is stalled: it cannot be the top of a shortest path, so
+    it is neither expanded nor kept, which shrinks search spaces about threefold.
+    :param upward: Output of get_upward_lists
+    :param seeds: List of (node, distance) tuples, e.g. the up-links of a city (one hop each)
+    :return: Mapping from reached satellite to (distance, hops)
+    """
+    best = {}
+    heap = []
+    for node, d in seeds:
+        if (d, 1) < best.get(node, NO_PATH):
+            best[node] = (d, 1)
+            heap.append((d, 1, node))
+    heapq.heapify(heap)
+    stalled = []
+    while heap:
+        d, h, u = heapq.heappop(heap)
+        if (d, h) > best[u]:
+            continue
+        # Costs are compared field by field rather than as tuples, which is markedly faster in this loop
+        stall = False
+        for v, w, hw in upward[u]:
+            other = best.get(v)
+            if other is not None and (other[0] + w < d or other[0] + w == d and other[1] + hw < h):
+                stall = True
+                break
+        if stall:
+            stalled.append(u)
+            continue
+        for v, w, hw in upward[u]:
+            vd = d + w
+            other = best.get(v)
+            if other is None or vd < other[0] or vd == other[0] and h + hw < other[1]:
+                best[v] = (vd, h + hw)
+                heapq.heappush(heap, (vd, h + hw, v))
+    for u in stalled:
+        del best[u]
+    return best
+
+
+def query_dist_hops(space_1, space_2):
+    """
+    Meets the search spaces of two cities at their best common satellite
+    :param space_1: Output of upward_search for the source city
+    :param space_2: Output of upward_search for the destination city
+    :return: Distance (infinity if unreachable) and hop count (None if unreachable) of the shortest path
+    """
+    if len(space_1) > len(space_2):
+        space_1, space_2 = space_2, space_1
+    best = NO_PATH
+    for node, (d, h) in space_1.items():
+        other = space_2.get(node)
+        if other is not None and (d + other[0], h + other[1]) < best:
+            best = (d + other[0], h + other[1])
+    return best
+
+
+def get_city_search_spaces(upward, coverage_index, cities):
+    """
+    Runs the upward search of every city once, to be shared by all queries involving it
+    :param upward: Output of get_upward_lists
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param cities: Cities to search from
+    :return: Mapping from city to its search space (cities without coverage are left out)
+    """
+    spaces = {}
+    for city in cities:
+        if city in coverage_index and city not in spaces:
+            uplinks = list(zip(coverage_index[city]["sat"].tolist(), coverage_index[city]["dist"].tolist()))
+            spaces[city] = upward_search(upward, uplinks)
+    return spaces
+
+
+def get_city_pair_results_ch(index, city_pairs, coverage_index, stage_times=None):
+    """
+    Computes the distance and hop count for every city pair from the index, searching upwards once per distinct
+    city and meeting the search spaces of the two cities of every pair
+    :param index: Output of build_contraction_hierarchy or load_index
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Lists of per-pair distances and hop counts (None where the destination is unreachable)
+    """
+    t = time.perf_counter()
+    upward = get_upward_lists(index)
+    t = profiling.add_stage_time(stage_times, "graph_build", t)
+    cities = [city_pairs[i][end] for i in range(len(city_pairs)) for end in ("city_1", "city_2")]
+    spaces = get_city_search_spaces(upward, coverage_index, cities)
+    t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    for i in range(len(city_pairs)):
+        city_1 = city_pairs[i]["city_1"]
+        city_2 = city_pairs[i]["city_2"]
+        if city_1 in spaces and city_2 in spaces:
+            d, h = query_dist_hops(spaces[city_1], spaces[city_2])
+            if h is not None:
+                distances[i] = d
+                hop_counts[i] = h
+    profiling.add_stage_time(stage_times, "path_search", t)
+    return distances, hop_counts
+
+
+def compute_metric_avoid_city_ch(index, city_pairs, city_positions, coverage_index, stage_times=None):
+    """
+    Same as metric.compute_metric_avoid_city, with the shortest paths taken from the index. Distances can differ
+    from those of the searches on the satellite graph in the last bits, as shortcut lengths are summed in another
+    order.
+    :param index: Output of build_contraction_hierarchy or load_index
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric
+    """
+    distances, hop_counts = get_city_pair_results_ch(index, city_pairs, coverage_index, stage_times)
+    t = time.perf_counter()
+    return_val = metric.aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+    profiling.add_stage_time(stage_times, "aggregation", t)
+    return return_val
+
+
+def save_index(index, file_name, isls_digest):
+    """
+    Saves an index with the digest of the ISL set it was built from
+    :param index: Output of build_contraction_hierarchy
+    :param file_name: Index file (.npz)
+    :param isls_digest: Output of result_cache.get_isls_digest
+    """
+    index_dir = os.path.dirname(file_name)
+    if index_dir and not os.path.isdir(index_dir):
+        os.makedirs(index_dir)
+    metadata = {
+        "version": INDEX_VERSION,
+        "isls_digest": isls_digest,
+        "num_nodes": index["num_nodes"],
+        "num_shortcuts": index["num_shortcuts"]
+    }
+    tmp_file = file_name + ".tmp" + str(os.getpid())
+    with open(tmp_file, "wb") as writer:
+        np.savez_compressed(writer, metadata=np.array(json.dumps(metadata)), rank=index["rank"],
+                            offsets=index["offsets"], neighbors=index["neighbors"], length=index["length"],
+                            hops=index["hops"])
+    os.replace(tmp_file, file_name)
+
+
+def load_index(file_name, isls_digest=None):
+    """
+    Loads an index
+    :param file_name: Index file (.npz)
+    :param isls_digest: Digest of the ISL set the index must have been built from (optional)
+    :return: Index as returned by build_contraction_hierarchy, or None if the file is missing, of another version
+             or built from other ISLs
+    """
+    if not os.path.exists(file_name):
+        return None
+    with np.load(file_name) as data:
+        metadata = json.loads(str(data["metadata"]))
+        if metadata["version"] != INDEX_VERSION or isls_digest is not None and metadata["isls_digest"] != isls_digest:
+            return None
+        index = {name: data[name] for name in ("rank", "offsets", "neighbors", "length", "hops")}
+    index["num_nodes"] = metadata["num_nodes"]
+    index["num_shortcuts"] = metadata["num_shortcuts"]
+    return index
+
+
+def read_topology(edge_file, sat_cartesian):
+    """
+    Reads the ISLs of a topology written as sat_1,sat_2 lines, e.g. best_motif_overall.txt, and computes their
+    lengths from the satellite positions
+    :param edge_file: Edge file
+    :param sat_cartesian: Satellite coordinates indexed by satellite id (see geometry.get_sat_cartesian)
+    :return: ISL set (see csr_graph.empty_isls)
+    """
+    pairs = np.loadtxt(edge_file, delimiter=",", dtype=np.int32, ndmin=2)
+    return {
+        "sat_1": pairs[:, 0],
+        "sat_2": pairs[:, 1],
+        "length": geometry.get_pair_distances(sat_cartesian, pairs[:, 0], pairs[:, 1])
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or load the contraction hierarchy of a topology and "
+                                                 "compute the metric of a city pair file from it")
+    parser.add_argument("config", help="40_40_53deg, kuiper_p1, starlink_p1")
+    parser.add_argument("edge_file", help="Topology as sat_1,sat_2 lines, e.g. best_motif_overall.txt")
+    parser.add_argument("--index", help="Index file; reused if built from the same ISLs, (re)built otherwise")
+    parser.add_argument("--time", type=int, default=0, help="Time step of the snapshot")
+    parser.add_argument("--cities", default="../input_data/data_cities/cities.txt")
+    parser.add_argument("--city-pairs", default="../input_data/data_cities/city_pairs_rand_5K.txt")
+    parser.add_argument("--settle-limit", type=int, default=WITNESS_SETTLE_LIMIT,
+                        help="Satellites settled by a witness search before a shortcut is added without proof")
+    args = parser.parse_args()
+
+    constellation_dir = "../input_data/constellation_" + args.config
+    sat_positions = loader.load_sat_positions(
+        os.path.join(constellation_dir, "data_sat_position", "sat_positions_" + str(args.time) + ".txt"))
+    topology = read_topology(args.edge_file, geometry.get_sat_cartesian(sat_positions))
+    digest = result_cache.get_isls_digest(topology)
+
+    start = time.perf_counter()
+    ch_index = load_index(args.index, digest) if args.index else None
+    if ch_index is None:
+        ch_index = build_contraction_hierarchy(csr_graph.build_csr_graph(len(sat_positions), topology),
+                                               args.settle_limit)
+        if args.index:
+            save_index(ch_index, args.index, digest)
+        print("built index:", len(topology["sat_1"]), "ISLs,", ch_index["num_shortcuts"], "shortcuts,",
+              round(time.perf_counter() - start, 3), "s")
+    else:
+        print("loaded index:", args.index, ",", round(time.perf_counter() - start, 3), "s")
+
+    city_positions, _ = util.read_city_positions(args.cities, None)
+    city_pairs = util.read_city_pair_file(args.city_pairs)
+    coverage_index = util.build_city_coverage_index(util.read_city_coverage(
+        os.path.join(constellation_dir, "data_coverage", "city_coverage_" + str(args.time) + ".txt")))
+    return_val = compute_metric_avoid_city_ch(ch_index, city_pairs, city_positions, coverage_index)
+    print("pairs:", len(city_pairs), ", wStretch:", return_val["avgWeightedStretch"], ", wHop:",
+          return_val["avgWeightedHopCount"], ", wMetric:", return_val["wMetric"])
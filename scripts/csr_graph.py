@@ -0,0 +1,421 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import heapq
+import numpy as np
+
+try:
+    from . import geometry
+    from . import util
+except (ImportError, SystemError):
+    import geometry
+    import util
+
+MAX_ISL_DEGREE = 4  # Each satellite can have at most 4 ISLs
+TREE_ROOT = -1  # Predecessor of nodes reached directly from the virtual source of a search
+TREE_UNREACHABLE = -2  # Predecessor of nodes a search did not reach
+
+
+def empty_isls():
+    """
+    Creates an empty ISL set
+    :return: ISL set with satellite 1, satellite 2 and ISL length arrays
+    """
+    return {
+        "sat_1": np.zeros(0, dtype=np.int32),
+        "sat_2": np.zeros(0, dtype=np.int32),
+        "length": np.zeros(0, dtype=np.float64)
+    }
+
+
+def isls_from_graph(grph, num_sats):
+    """
+    Extracts the satellite-satellite edges of a networkx graph as an ISL set
+    :param grph: The graph under consideration with nodes being the satellites and/or cities
+    :param num_sats: Number of satellites; nodes with larger ids are cities and are skipped
+    :return: ISL set
+    """
+    edges = [(u, v, attr["length"]) for u, v, attr in grph.edges(data=True) if u < num_sats and v < num_sats]
+    return {
+        "sat_1": np.array([e[0] for e in edges], dtype=np.int32),
+        "sat_2": np.array([e[1] for e in edges], dtype=np.int32),
+        "length": np.array([e[2] for e in edges], dtype=np.float64)
+    }
+
+
+def extend_isls(isls, candidates, sat_cartesian, num_sats, max_degree=MAX_ISL_DEGREE):
+    """
+    Adds candidate ISLs in the given order, skipping links already present and links that would exceed the
+    ISL budget of either satellite (same rule as util.check_edge_availability). Lengths of the accepted links
+    are computed in one batch.
+    :param isls: ISL set to extend; it is not modified
+    :param candidates: Iterable of (satellite 1, satellite 2) pairs
+    :param sat_cartesian: Satellite coordinates indexed by satellite id (geometry.get_sat_cartesian)
+    :param num_sats: Number of satellites
+    :param max_degree: Maximum number of ISLs per satellite
+    :return: Extended ISL set
+    """
+    degree = np.bincount(np.concatenate((isls["sat_1"], isls["sat_2"])), minlength=num_sats).tolist()
+    existing = set(zip(isls["sat_1"].tolist(), isls["sat_2"].tolist()))
+    sat_1 = []
+    sat_2 = []
+    for s1, s2 in candidates:
+        if s2 < 0 or (s1, s2) in existing or (s2, s1) in existing:
+            continue
+        if degree[s1] >= max_degree or degree[s2] >= max_degree:
+            continue
+        existing.add((s1, s2))
+        degree[s1] += 1
+        degree[s2] += 1
+        sat_1.append(s1)
+        sat_2.append(s2)
+    sat_1 = np.array(sat_1, dtype=np.int32)
+    sat_2 = np.array(sat_2, dtype=np.int32)
+    return {
+        "sat_1": np.concatenate((isls["sat_1"], sat_1)),
+        "sat_2": np.concatenate((isls["sat_2"], sat_2)),
+        "length": np.concatenate((isls["length"], geometry.get_pair_distances(sat_cartesian, sat_1, sat_2)))
+    }
+
+
+def build_zone_isls(orbit_slot_index, zone_list, sat_cartesian, sat_abs_lat_deg, isls=None):
+    """
+    Builds the ISL set of a snapshot by adding the motif of every zone in order
+    :param orbit_slot_index: Output of util.build_orbit_slot_index
+    :param zone_list: Zones with latitude bounds and motif; bounds may be None for a motif applied everywhere
+    :param sat_cartesian: Satellite coordinates indexed by satellite id
+    :param sat_abs_lat_deg: Absolute satellite latitudes indexed by satellite id
+    :param isls: ISL set of the zones added before (optional); it is not modified
+    :return: ISL set
+    """
+    if isls is None:
+        isls = empty_isls()
+    for zone in zone_list:
+        candidates = util.get_zone_candidates(orbit_slot_index, zone["motif"], sat_abs_lat_deg, zone["lat_bottom"],
+                                              zone["lat_top"])
+        isls = extend_isls(isls, candidates, sat_cartesian, len(sat_cartesian))
+    return isls
+
+
+def get_canonical_isls(isls):
+    """
+    Canonical form of the topology of an ISL set: every link with the smaller satellite id first, sorted. Motifs
+    inducing the same canonical ISLs give the same graph, whatever their offsets and the order links were added in.
+    :param isls: ISL set
+    :return: Arrays of lower and higher satellite ids
+    """
+    low = np.minimum(isls["sat_1"], isls["sat_2"])
+    high = np.maximum(isls["sat_1"], isls["sat_2"])
+    order = np.lexsort((high, low))
+    return low[order], high[order]
+
+
+def build_csr_graph(num_sats, isls):
+    """
+    Builds the compressed sparse row adjacency of the satellite network. Cities are not part of the graph;
+    they attach through their up/down-links at query time.
+    :param num_sats: Number of satellites
+    :param isls: ISL set
+    :return: Graph with offsets, neighbors and length arrays (neighbors of node u are
+             neighbors[offsets[u]:offsets[u + 1]])
+    """
+    src = np.concatenate((isls["sat_1"], isls["sat_2"]))
+    dst = np.concatenate((isls["sat_2"], isls["sat_1"]))
+    length = np.concatenate((isls["length"], isls["length"]))
+    order = np.argsort(src, kind="stable")
+    offsets = np.zeros(num_sats + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=num_sats), out=offsets[1:])
+    return {
+        "num_nodes": num_sats,
+        "offsets": offsets,
+        "neighbors": dst[order].astype(np.int32),
+        "length": length[order]
+    }
+
+
+def get_adjacency_lists(graph):
+    """
+    Unpacks the CSR arrays into per-node Python lists, which is the fastest form for heap-based searches
+    :param graph: CSR graph
+    :return: List of (neighbor, length) lists indexed by node
+    """
+    offsets = graph["offsets"].tolist()
+    neighbors = graph["neighbors"].tolist()
+    length = graph["length"].tolist()
+    return [list(zip(neighbors[offsets[u]:offsets[u + 1]], length[offsets[u]:offsets[u + 1]]))
+            for u in range(graph["num_nodes"])]
+
+
+def shortest_path_tree(adjacency, seeds):
+    """
+    Runs Dijkstra from a virtual source attached to the seed nodes and keeps the hop count and the predecessor of
+    the chosen path alongside the distance
+    :param adjacency: Output of get_adjacency_lists
+    :param seeds: List of (node, distance) tuples, e.g. the up-links of the source city (one hop each)
+    :return: Lists of distances (infinity if unreachable), hop counts and predecessors indexed by node
+             (TREE_ROOT for nodes reached directly from the virtual source, TREE_UNREACHABLE if not reached)
+    """
+    num_nodes = len(adjacency)
+    done = [False] * num_nodes
+    best = [float("inf")] * num_nodes
+    hops = [0] * num_nodes
+    parent = [TREE_UNREACHABLE] * num_nodes
+    heap = []
+    for node, d in seeds:
+        if d < best[node]:
+            best[node] = d
+            hops[node] = 1
+            parent[node] = TREE_ROOT
+            heap.append((d, node))
+    heapq.heapify(heap)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if done[u]:
+            continue
+        done[u] = True
+        hu = hops[u] + 1
+        for v, w in adjacency[u]:
+            vd = d + w
+            if vd < best[v]:
+                best[v] = vd
+                hops[v] = hu
+                parent[v] = u
+                heapq.heappush(heap, (vd, v))
+    return best, hops, parent
+
+
+def single_source_dist_hops(adjacency, seeds):
+    """
+    Runs Dijkstra from a virtual source attached to the seed nodes and keeps the hop count of the chosen path
+    alongside the distance
+    :param adjacency: Output of get_adjacency_lists
+    :param seeds: List of (node, distance) tuples, e.g. the up-links of the source city (one hop each)
+    :return: Lists of distances (infinity if unreachable) and hop counts indexed by node
+    """
+    best, hops, parent = shortest_path_tree(adjacency, seeds)
+    return best, hops
+
+
+def astar_dist_hops(adjacency, seeds, targets, heuristic):
+    """
+    Runs A* from a virtual source attached to the seed nodes to a virtual target attached to the target nodes.
+    Nodes are ordered by distance plus heuristic, and the search stops once no queued node can lead to a shorter
+    path than the best one found. Entries made stale by a shorter path are skipped rather than closing nodes, so a
+    node is expanded again if its distance improves and the distance stays exact for a heuristic that is only
+    admissible, e.g. consistent up to rounding.
+    :param adjacency: Output of get_adjacency_lists
+    :param seeds: List of (node, distance) tuples, e.g. the up-links of the source city (one hop each)
+    :param targets: List of (node, distance) tuples, e.g. the down-links of the destination city (one hop each);
+                    among equally short paths the one through the earliest target is kept
+    :param heuristic: Lower bound of the remaining distance to the virtual target, indexed by node
+    :return: Distance to the virtual target (infinity if unreachable), its hop count (None if unreachable) and the
+             number of expanded nodes
+    """
+    num_nodes = len(adjacency)
+    best = [float("inf")] * num_nodes
+    hops = [0] * num_nodes
+    target_links = {}
+    for position in range(len(targets)):
+        node, d = targets[position]
+        target_links.setdefault(node, (position, d))
+    heap = []
+    for node, d in seeds:
+        if d < best[node]:
+            best[node] = d
+            hops[node] = 1
+            heap.append((d + heuristic[node], d, node))
+    heapq.heapify(heap)
+    target_dist = float("inf")
+    target_position = len(targets)
+    target_hops = None
+    expanded = 0
+    while heap:
+        f, d, u = heapq.heappop(heap)
+        if f > target_dist:
+            break
+        if d > best[u]:
+            continue
+        expanded += 1
+        if u in target_links:
+            position, link = target_links[u]
+            total = d + link
+            if total < target_dist or total == target_dist and position < target_position:
+                target_dist = total
+                target_position = position
+                target_hops = hops[u] + 1
+        hu = hops[u] + 1
+        for v, w in adjacency[u]:
+            vd = d + w
+            if vd < best[v]:
+                best[v] = vd
+                hops[v] = hu
+                heapq.heappush(heap, (vd + heuristic[v], vd, v))
+    return target_dist, target_hops, expanded
+
+
+def get_component_labels(graph):
+    """
+    Labels the connected components of a CSR graph by propagating the smallest node id over the edges
+    :param graph: CSR graph
+    :return: Array holding for every node the smallest node id of its component
+    """
+    src = np.repeat(np.arange(graph["num_nodes"]), np.diff(graph["offsets"]))
+    labels = np.arange(graph["num_nodes"])
+    while True:
+        propagated = labels.copy()
+        np.minimum.at(propagated, src, labels[graph["neighbors"]])
+        if np.array_equal(propagated, labels):
+            return labels
+        labels = propagated
+
+
+def get_edge_index(graph):
+    """
+    Sorts the directed edges of a CSR graph by (node, neighbor) key so lengths can be looked up for arrays of
+    node pairs
+    :param graph: CSR graph
+    :return: Sorted edge keys (node * num_nodes + neighbor) and the matching lengths
+    """
+    src = np.repeat(np.arange(graph["num_nodes"], dtype=np.int64), np.diff(graph["offsets"]))
+    keys = src * graph["num_nodes"] + graph["neighbors"]
+    order = np.argsort(keys)
+    return keys[order], graph["length"][order]
+
+
+def get_undirected_edges(graph):
+    """
+    Lists every edge of a CSR graph once, smaller node first, so per-ISL values can be kept in one array
+    :param graph: CSR graph
+    :return: Sorted edge keys (node_1 * num_nodes + node_2), first and second end points
+    """
+    src = np.repeat(np.arange(graph["num_nodes"], dtype=np.int64), np.diff(graph["offsets"]))
+    forward = src < graph["neighbors"]
+    keys = np.unique(src[forward] * graph["num_nodes"] + graph["neighbors"][forward])
+    return keys, keys // graph["num_nodes"], keys % graph["num_nodes"]
+
+
+def get_edge_lengths(edge_index, num_nodes, node_1, node_2):
+    """
+    Looks up the lengths of edges given as arrays of end points
+    :param edge_index: Output of get_edge_index
+    :param num_nodes: Number of nodes of the graph
+    :param node_1: First end points
+    :param node_2: Second end points
+    :return: Lengths, infinity where there is no such edge
+    """
+    keys, length = edge_index
+    if len(keys) == 0:
+        return np.full(len(node_1), np.inf)
+    query = node_1.astype(np.int64) * num_nodes + node_2
+    pos = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    return np.where(keys[pos] == query, length[pos], np.inf)
+
+
+def get_tree_levels(parent, hops):
+    """
+    Groups the nodes of a shortest path tree by depth
+    :param parent: Predecessor array as returned by shortest_path_tree
+    :param hops: Hop count array of the same tree, one more than the depth of every reached node
+    :return: List of node arrays; level 0 holds the nodes attached to the virtual source
+    """
+    reached = np.nonzero(parent != TREE_UNREACHABLE)[0]
+    depth = hops[reached]
+    order = np.argsort(depth, kind="stable")
+    reached = reached[order]
+    bounds = np.searchsorted(depth[order], np.arange(1, int(depth.max()) + 2) if len(reached) > 0 else [])
+    return [reached[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+
+def repair_shortest_path_tree(graph, adjacency, edge_index, seeds, parent, hops):
+    """
+    Updates a shortest path tree computed on a previous snapshot to the current graph and seeds. The old tree is
+    re-evaluated with the current lengths, which gives the length of a real path for every node still connected
+    through it. Roots that are no longer seeds get an infinite distance, which invalidates their subtrees. Then only
+    the nodes that can be improved over an edge or a seed are searched again. The result has
+    the same distances as shortest_path_tree; on exactly equal alternatives the hop count may come from another
+    shortest path.
+    :param graph: CSR graph of the current snapshot
+    :param adjacency: Output of get_adjacency_lists for graph
+    :param edge_index: Output of get_edge_index for graph
+    :param seeds: List of (node, distance) tuples of the current snapshot
+    :param parent: Predecessor array of the previous tree
+    :param hops: Hop count array of the previous tree
+    :return: Arrays of distances, hop counts and predecessors, and the number of distance improvements the repair made
+    """
+    num_nodes = graph["num_nodes"]
+    seed_dist = np.full(num_nodes, np.inf)
+    for node, d in seeds:
+        seed_dist[node] = min(seed_dist[node], d)
+    best = np.full(num_nodes, np.inf)
+    parent = np.array(parent, dtype=np.int64)
+    levels = get_tree_levels(parent, np.asarray(hops))
+    hops = np.zeros(num_nodes, dtype=np.int64)
+    # Parent edges are looked up at once, then lengths are summed from the roots down as the search does
+    parent_length = np.full(num_nodes, np.inf)
+    linked = np.nonzero(parent >= 0)[0]
+    parent_length[linked] = get_edge_lengths(edge_index, num_nodes, parent[linked], linked)
+    for depth, level in enumerate(levels):
+        if depth == 0:
+            best[level] = seed_dist[level]
+        else:
+            best[level] = best[parent[level]] + parent_length[level]
+        hops[level] = depth + 1
+
+    # Seeds and edges that now offer a shorter path start the search. The nodes they improve are queued directly,
+    # the shortest offer per node applied last so it wins.
+    improved = np.nonzero(seed_dist < best)[0]
+    best[improved] = seed_dist[improved]
+    hops[improved] = 1
+    parent[improved] = TREE_ROOT
+    src = np.repeat(np.arange(num_nodes), np.diff(graph["offsets"]))
+    offer = best[src] + graph["length"]
+    better = np.nonzero(offer < best[graph["neighbors"]])[0]
+    better = better[np.argsort(-offer[better], kind="stable")]
+    offer_src = src[better]
+    offer_dst = graph["neighbors"][better]
+    best[offer_dst] = offer[better]
+    hops[offer_dst] = hops[offer_src] + 1
+    parent[offer_dst] = offer_src
+    starts = np.unique(np.concatenate((improved, offer_dst)))
+    best = best.tolist()
+    hops = hops.tolist()
+    parent = parent.tolist()
+    heap = [(best[u], u) for u in starts.tolist()]
+    heapq.heapify(heap)
+    changed = len(starts)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if d > best[u]:
+            continue
+        hu = hops[u] + 1
+        for v, w in adjacency[u]:
+            vd = d + w
+            if vd < best[v]:
+                best[v] = vd
+                hops[v] = hu
+                parent[v] = u
+                changed += 1
+                heapq.heappush(heap, (vd, v))
+    best = np.array(best)
+    parent = np.array(parent, dtype=np.int64)
+    parent[best == np.inf] = TREE_UNREACHABLE
+    return best, np.array(hops, dtype=np.int64), parent, changed
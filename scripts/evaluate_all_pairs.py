@@ -0,0 +1,168 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Evaluates a topology on every pair of cities in cities.txt (~500K pairs for 1000 cities) instead of a sampled
+# city pair file. Pairs and their geodesic distances are generated per source city and folded into running weighted
+# stretch/hop sums (metric.get_source_city_sums), so memory stays proportional to the number of cities. Source
+# cities are spread over the workers and their sums are added in city order, so the result does not depend on the
+# number of cores. With --city-pairs the sampled metric of the same topology is reported alongside.
+# The shipped 5K sample has no pair closer than about 1550 km; --min-geo-dist 1550 restricts all pairs likewise.
+# Outputs in --output-dir:
+#   all_pairs_metric.txt: pair set, number of pairs, wStretch, wHop, wMetric
+#
+# Examples:
+#   python3 evaluate_all_pairs.py 40_40_53deg \
+#       --motif-file ../output_data/multi_motif_40_40_53deg_1467/level_wise_best_motif.txt --cores 4
+#   python3 evaluate_all_pairs.py 40_40_53deg --motif 1 0 0 1 --min-geo-dist 1550
+#   python3 evaluate_all_pairs.py 40_40_53deg --edge-file ../output_data_generated/multi_motif/best_motif_overall.txt
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import numpy as np
+
+try:
+    from . import util
+    from . import metric
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+    from . import evaluate_over_time
+    from . import contraction_hierarchy
+except (ImportError, SystemError):
+    import util
+    import metric
+    import csr_graph
+    import geometry
+    import loader
+    import evaluate_over_time
+    import contraction_hierarchy
+
+SOURCES_PER_TASK = 16  # Source cities sent to a worker at once
+
+# Inputs shared by every source city; set once before the workers are forked
+adjacency = []
+all_pairs = {}
+coverage_index = {}
+
+
+def evaluate_source_city(row):
+    """
+    Evaluates the pairs of one source city (pool worker)
+    :param row: Position of the source city in all_pairs["cities"]
+    :return: Sums as in metric.new_metric_sums
+    """
+    return metric.get_source_city_sums(adjacency, all_pairs, row, coverage_index)
+
+
+def build_graph(args, sat_positions):
+    """
+    Builds the satellite graph of the topology given on the command line
+    :param args: Parsed arguments
+    :param sat_positions: Structured array of loader.SAT_POSITION_DTYPE
+    :return: CSR graph
+    """
+    sat_cartesian = geometry.get_sat_cartesian(sat_positions)
+    if args.edge_file:
+        return csr_graph.build_csr_graph(len(sat_positions),
+                                         contraction_hierarchy.read_topology(args.edge_file, sat_cartesian))
+    if args.motif_file:
+        zones = evaluate_over_time.read_motif_file(args.motif_file)
+    else:
+        zones = [{
+            "lat_bottom": None,
+            "lat_top": None,
+            "motif": {
+                "sat_1_orb_offset": args.motif[0],
+                "sat_1_sat_offset": args.motif[1],
+                "sat_2_orb_offset": args.motif[2],
+                "sat_2_sat_offset": args.motif[3]
+            }
+        }]
+    sat_abs_lat_deg = np.zeros(len(sat_cartesian))
+    sat_abs_lat_deg[sat_positions["sat_id"]] = np.abs(sat_positions["lat_deg"])
+    orbit_slot_index = evaluate_over_time.build_orbit_slot_index(args.sat_positions)
+    isls = csr_graph.build_zone_isls(orbit_slot_index, zones, sat_cartesian, sat_abs_lat_deg)
+    return csr_graph.build_csr_graph(len(sat_cartesian), isls)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate a topology on all pairs of cities")
+    parser.add_argument("config", help="40_40_53deg, kuiper_p1, starlink_p1")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--motif-file", help="level_wise_best_motif.txt or baseline configuration file")
+    group.add_argument("--motif", type=int, nargs=4, metavar=("ORB_1", "SAT_1", "ORB_2", "SAT_2"),
+                       help="Single motif applied to every satellite, as in find_single_motif.py")
+    group.add_argument("--edge-file", help="Topology as sat_1,sat_2 lines, e.g. best_motif_overall.txt")
+    parser.add_argument("--min-geo-dist", type=float, default=0.0,
+                        help="Leave out pairs of cities at most this far apart (km)")
+    parser.add_argument("--cities", default="../input_data/data_cities/cities.txt")
+    parser.add_argument("--city-pairs", help="Sampled city pair file to compare with, e.g. "
+                                             "../input_data/data_cities/city_pairs_rand_5K.txt")
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--output-dir", default="../output_data_generated/all_pairs")
+    args = parser.parse_args()
+
+    constellation_dir = "../input_data/constellation_" + args.config
+    args.sat_positions = os.path.join(constellation_dir, "data_sat_position", "sat_positions_0.txt")
+    positions = loader.load_sat_positions(args.sat_positions)
+    graph = build_graph(args, positions)
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    city_positions, _ = util.read_city_positions(args.cities, None)
+    coverage_index = util.build_city_coverage_index(util.read_city_coverage(
+        os.path.join(constellation_dir, "data_coverage", "city_coverage_0.txt")))
+    all_pairs = metric.get_all_pairs_inputs(city_positions, coverage_index, args.min_geo_dist)
+
+    a = datetime.datetime.now()
+    sources = range(len(all_pairs["cities"]) - 1)
+    sums = metric.new_metric_sums()
+    if args.cores <= 1:
+        for source_sums in map(evaluate_source_city, sources):
+            metric.add_metric_sums(sums, source_sums)
+    else:
+        pool = multiprocessing.get_context("fork").Pool(args.cores)
+        for source_sums in pool.imap(evaluate_source_city, sources, SOURCES_PER_TASK):
+            metric.add_metric_sums(sums, source_sums)
+        pool.close()
+        pool.join()
+    results = [("all_pairs", sums["pairs"], metric.get_metric_from_sums(sums))]
+    print("all pairs:", sums["pairs"], "pairs (" + str(sums["unreachable"]) + " unreachable), time:",
+          (datetime.datetime.now() - a).total_seconds(), "s")
+
+    if args.city_pairs:
+        city_pairs = util.read_city_pair_file(args.city_pairs)
+        results.append(("sampled", len(city_pairs),
+                        metric.compute_metric_avoid_city(graph, city_pairs, city_positions, coverage_index)))
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    with open(os.path.join(args.output_dir, "all_pairs_metric.txt"), "w") as writer:
+        for name, num_pairs, return_val in results:
+            writer.write(name + "," + str(num_pairs) + "," + str(return_val["avgWeightedStretch"]) + ","
+                         + str(return_val["avgWeightedHopCount"]) + "," + str(return_val["wMetric"]) + "\n")
+    for name, num_pairs, return_val in results:
+        print(name, ": wStretch", return_val["avgWeightedStretch"], ", wHop", return_val["avgWeightedHopCount"],
+              ", wMetric", return_val["wMetric"])
+    if args.city_pairs:
+        difference = (results[1][2]["wMetric"] - results[0][2]["wMetric"]) * 100 / results[0][2]["wMetric"]
+        print("sampled wMetric differs from all pairs by", difference, "%")
@@ -0,0 +1,312 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Evaluates a motif, or the zone-wise motifs chosen by find_multi_motifs.py, over a sequence of snapshots and
+# reports the weighted stretch/hop metrics per time step along with their time average and worst case.
+# Snapshots are read from <constellation_dir>/data_sat_position/sat_positions_<t>.txt and
+# <constellation_dir>/data_coverage/city_coverage_<t>.txt (see generate_sat_positions.py and generate_links.py).
+# Zones are re-evaluated at every time step from the satellite latitudes of that snapshot, the same way
+# find_multi_motifs.py builds the final graph.
+# Outputs in --output-dir:
+#   time_step_metrics.txt: time step, wStretch, wHop, wMetric
+#   summary.txt: metric, time average, worst value, time step of the worst value, number of failed snapshots
+# With --link-loads, the population weighted traffic of the chosen paths is accumulated on every link
+# (metric.compute_metric_with_link_loads), adding:
+#   link_loads.txt: time step, max/p50/p90/p99 ISL load, max/p50/p90/p99 city-satellite link load
+#   isl_loads_<t>.txt: satellite 1, satellite 2, load of every ISL of the snapshot
+#
+# Examples:
+#   python3 evaluate_over_time.py ../input_data/constellation_40_40_53deg \
+#       --motif-file ../output_data/multi_motif_40_40_53deg_1467/level_wise_best_motif.txt --times 0 1 2 --cores 3
+#   python3 evaluate_over_time.py ../input_data/constellation_40_40_53deg --motif 1 0 0 1 --times 0
+#   python3 evaluate_over_time.py ../input_data/constellation_40_40_53deg --motif 1 0 0 1 --times 0 --link-loads
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import numpy as np
+
+try:
+    from . import util
+    from . import metric
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+except (ImportError, SystemError):
+    import util
+    import metric
+    import csr_graph
+    import geometry
+    import loader
+
+# Inputs shared by every time step; set once before the workers are forked
+constellation_dir = None
+zones = []
+city_positions = {}
+city_pairs = {}
+city_pair_groups = {}
+orbit_slot_index = {}
+link_loads = False
+output_dir = None
+
+
+def read_motif_file(motif_file):
+    """
+    Reads zone-wise motifs either from a level_wise_best_motif.txt file (bottom latitude, top latitude, wStretch,
+    wHop, wMetric, motif offsets) or from a baseline configuration file (bottom latitude, top latitude, motif offsets)
+    :param motif_file: Input file
+    :return: List of zones with latitude bounds and motif, ordered as in the file
+    """
+    zone_list = []
+    for line in open(motif_file):
+        val = line.rstrip('\n').split(",")
+        if len(val) < 6:
+            continue
+        offsets = val[5:9] if len(val) >= 9 else val[2:6]
+        zone_list.append({
+            "lat_bottom": float(val[0]),
+            "lat_top": float(val[1]),
+            "motif": {
+                "sat_1_orb_offset": int(offsets[0]),
+                "sat_1_sat_offset": int(offsets[1]),
+                "sat_2_orb_offset": int(offsets[2]),
+                "sat_2_sat_offset": int(offsets[3])
+            }
+        })
+    return zone_list
+
+
+def get_snapshot_files(t):
+    """
+    Gets the input files of a snapshot
+    :param t: Time step
+    :return: Satellite position file and city coverage file
+    """
+    return (os.path.join(constellation_dir, "data_sat_position", "sat_positions_" + str(t) + ".txt"),
+            os.path.join(constellation_dir, "data_coverage", "city_coverage_" + str(t) + ".txt"))
+
+
+def build_orbit_slot_index(sat_pos_file):
+    """
+    Builds the orbit/slot structure of the constellation, which does not change between snapshots
+    :param sat_pos_file: Any satellite position file of the constellation
+    :return: Output of util.build_orbit_slot_index
+    """
+    positions = loader.load_sat_positions(sat_pos_file)
+    sat_slots = {}
+    for sat_id, orb_id, orb_sat_id in zip(positions["sat_id"].tolist(), positions["orb_id"].tolist(),
+                                          positions["orb_sat_id"].tolist()):
+        sat_slots[sat_id] = {
+            "orb_id": orb_id,
+            "orb_sat_id": orb_sat_id
+        }
+    return util.build_orbit_slot_index(sat_slots, int(np.max(positions["orb_id"])) + 1,
+                                       int(np.max(positions["orb_sat_id"])) + 1)
+
+
+def load_snapshot(t):
+    """
+    Loads the time-varying inputs of a snapshot
+    :param t: Time step
+    :return: Satellite coordinates and absolute latitudes indexed by satellite id, and the city coverage index
+    """
+    sat_pos_file, coverage_file = get_snapshot_files(t)
+    positions = loader.load_sat_positions(sat_pos_file)
+    sat_abs_lat_deg = np.zeros(int(np.max(positions["sat_id"])) + 1)
+    sat_abs_lat_deg[positions["sat_id"]] = np.abs(positions["lat_deg"])
+    coverage_index = util.build_city_coverage_index(util.read_city_coverage(coverage_file))
+    return geometry.get_sat_cartesian(positions), sat_abs_lat_deg, coverage_index
+
+
+def evaluate_time_step(t):
+    """
+    Builds the motif graph of a snapshot and computes its metric (pool worker)
+    :param t: Time step
+    :return: Tuple of time step, wMetric, wStretch and wHop, followed by the ISL and city-satellite link load
+             summaries with --link-loads
+    """
+    a = datetime.datetime.now()
+    sat_cartesian, sat_abs_lat_deg, coverage_index = load_snapshot(t)
+    isls = csr_graph.build_zone_isls(orbit_slot_index, zones, sat_cartesian, sat_abs_lat_deg)
+    graph = csr_graph.build_csr_graph(len(sat_cartesian), isls)
+    if not link_loads:
+        return_val = metric.compute_metric_avoid_city(graph, city_pairs, city_positions, coverage_index,
+                                                      city_pair_groups)
+        b = datetime.datetime.now() - a
+        print("time", t, ": time to compute metric:", b.seconds, ", wMetric:", return_val["wMetric"])
+        return t, return_val["wMetric"], return_val["avgWeightedStretch"], return_val["avgWeightedHopCount"]
+    return_val = metric.compute_metric_with_link_loads(graph, city_pairs, city_positions, coverage_index,
+                                                       city_pair_groups)
+    write_isl_loads(graph, return_val["islLoads"], os.path.join(output_dir, "isl_loads_" + str(t) + ".txt"))
+    b = datetime.datetime.now() - a
+    print("time", t, ": time to compute metric:", b.seconds, ", wMetric:", return_val["wMetric"], ", max ISL load:",
+          return_val["islLoad"]["max"])
+    return (t, return_val["wMetric"], return_val["avgWeightedStretch"], return_val["avgWeightedHopCount"],
+            return_val["islLoad"], return_val["groundLinkLoad"])
+
+
+def write_isl_loads(graph, isl_loads, file_name):
+    """
+    Writes the load of every ISL
+    :param graph: CSR graph of the snapshot
+    :param isl_loads: ISL loads aligned with csr_graph.get_undirected_edges
+    :param file_name: Output file
+    """
+    keys, sat_1, sat_2 = csr_graph.get_undirected_edges(graph)
+    with open(file_name, "w") as writer:
+        for node_1, node_2, load in zip(sat_1.tolist(), sat_2.tolist(), isl_loads.tolist()):
+            writer.write(str(node_1) + "," + str(node_2) + "," + str(load) + "\n")
+
+
+def evaluate_time_steps_incremental(times):
+    """
+    Evaluates consecutive snapshots, carrying the shortest path trees of every source city from one snapshot to the
+    next and repairing them instead of searching from scratch (pool worker)
+    :param times: Consecutive time steps, evaluated in order
+    :return: List of (time step, wMetric, wStretch, wHop) tuples
+    """
+    trees = {}
+    results = []
+    for t in times:
+        a = datetime.datetime.now()
+        sat_cartesian, sat_abs_lat_deg, coverage_index = load_snapshot(t)
+        isls = csr_graph.build_zone_isls(orbit_slot_index, zones, sat_cartesian, sat_abs_lat_deg)
+        graph = csr_graph.build_csr_graph(len(sat_cartesian), isls)
+        distances, hop_counts, repaired, improvements = metric.update_city_pair_results(graph, city_pairs,
+                                                                                        coverage_index, trees,
+                                                                                        city_pair_groups)
+        return_val = metric.aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+        b = datetime.datetime.now() - a
+        print("time", t, ": time to compute metric:", b.seconds, ", repaired trees:", repaired, "of",
+              len(city_pair_groups), ", distance improvements:", improvements, ", wMetric:", return_val["wMetric"])
+        results.append((t, return_val["wMetric"], return_val["avgWeightedStretch"],
+                        return_val["avgWeightedHopCount"]))
+    return results
+
+
+def summarize(results):
+    """
+    Aggregates per time step metrics. Snapshots where some city pair is unreachable carry the failure value
+    (metric.FAILED_METRIC); they count towards the worst case but are left out of the average.
+    :param results: List of (time step, wMetric, wStretch, wHop) ordered by time step
+    :return: Time-averaged metric values, the worst (maximum) value of each metric with its time step and the
+             number of failed snapshots
+    """
+    summary = {}
+    for name, column in (("wMetric", 1), ("wStretch", 2), ("wHop", 3)):
+        values = [result[column] for result in results]
+        valid = [value for value in values if value != metric.FAILED_METRIC["wMetric"]]
+        worst = int(np.argmax(values))
+        summary[name] = {
+            "mean": sum(valid) / len(valid) if valid else metric.FAILED_METRIC["wMetric"],
+            "worst": values[worst],
+            "worst_time": results[worst][0],
+            "failed": len(values) - len(valid)
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate motifs over a sequence of constellation snapshots")
+    parser.add_argument("constellation_dir", help="e.g. ../input_data/constellation_40_40_53deg")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--motif-file", help="level_wise_best_motif.txt or baseline configuration file")
+    group.add_argument("--motif", type=int, nargs=4, metavar=("ORB_1", "SAT_1", "ORB_2", "SAT_2"),
+                       help="Single motif applied to every satellite, as in find_single_motif.py")
+    parser.add_argument("--times", type=int, nargs="+", default=[0], help="Time steps of the snapshots")
+    parser.add_argument("--cities", default="../input_data/data_cities/cities.txt")
+    parser.add_argument("--city-pairs", default="../input_data/data_cities/city_pairs_rand_5K.txt")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Repair the shortest path trees of the previous snapshot instead of searching again; "
+                             "time steps are split into one contiguous run per core")
+    parser.add_argument("--link-loads", action="store_true",
+                        help="Accumulate the population weighted traffic of the chosen paths on every ISL and "
+                             "city-satellite link and report the link loads")
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--output-dir", default="../output_data_generated/time_series")
+    args = parser.parse_args()
+    if args.link_loads and args.incremental:
+        parser.error("--link-loads evaluates every snapshot from scratch, it cannot be combined with --incremental")
+
+    constellation_dir = args.constellation_dir
+    link_loads = args.link_loads
+    output_dir = args.output_dir
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    if args.motif_file:
+        zones = read_motif_file(args.motif_file)
+    else:
+        zones = [{
+            "lat_bottom": None,
+            "lat_top": None,
+            "motif": {
+                "sat_1_orb_offset": args.motif[0],
+                "sat_1_sat_offset": args.motif[1],
+                "sat_2_orb_offset": args.motif[2],
+                "sat_2_sat_offset": args.motif[3]
+            }
+        }]
+    city_positions, _ = util.read_city_positions(args.cities, None)
+    city_pairs = util.read_city_pair_file(args.city_pairs)
+    city_pair_groups = metric.group_city_pairs_by_source(city_pairs)
+    orbit_slot_index = build_orbit_slot_index(get_snapshot_files(args.times[0])[0])
+
+    if args.incremental:
+        # Each worker takes a contiguous run of time steps and only searches from scratch at its first one
+        chunk = -(-len(args.times) // max(args.cores, 1))
+        tasks = [args.times[i:i + chunk] for i in range(0, len(args.times), chunk)]
+        worker = evaluate_time_steps_incremental
+    else:
+        tasks = args.times
+        worker = evaluate_time_step
+    if args.cores <= 1:
+        results = [worker(task) for task in tasks]
+    else:
+        pool = multiprocessing.get_context("fork").Pool(args.cores)
+        results = pool.map(worker, tasks)
+        pool.close()
+        pool.join()
+    if args.incremental:
+        results = [result for chunk_results in results for result in chunk_results]
+    results.sort(key=lambda result: result[0])
+    summary = summarize(results)
+
+    with open(os.path.join(args.output_dir, "time_step_metrics.txt"), "w") as writer:
+        for t, wMetric, wStretch, wHop in [result[:4] for result in results]:
+            writer.write(str(t) + "," + str(wStretch) + "," + str(wHop) + "," + str(wMetric) + "\n")
+    with open(os.path.join(args.output_dir, "summary.txt"), "w") as writer:
+        for name in ("wStretch", "wHop", "wMetric"):
+            writer.write(name + "," + str(summary[name]["mean"]) + "," + str(summary[name]["worst"]) + ","
+                         + str(summary[name]["worst_time"]) + "," + str(summary[name]["failed"]) + "\n")
+    for name in ("wStretch", "wHop", "wMetric"):
+        print(name, ": mean", summary[name]["mean"], ", worst", summary[name]["worst"], "at time",
+              summary[name]["worst_time"], ", failed snapshots", summary[name]["failed"])
+    if link_loads:
+        keys = ["max"] + ["p" + str(percentile) for percentile in metric.LINK_LOAD_PERCENTILES]
+        with open(os.path.join(args.output_dir, "link_loads.txt"), "w") as writer:
+            for result in results:
+                writer.write(",".join([str(result[0])] + [str(result[4][key]) for key in keys]
+                                      + [str(result[5][key]) for key in keys]) + "\n")
+        worst = max(results, key=lambda result: result[4]["max"])
+        print("max ISL load", worst[4]["max"], "at time", worst[0], ", max city-satellite link load",
+              max(result[5]["max"] for result in results))
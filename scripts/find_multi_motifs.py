@@ -20,28 +20,59 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
+import itertools
 import math
+import os
 import networkx as nx
-from multiprocessing import Process
+import numpy as np
 import multiprocessing
 import datetime
-import sys
+import time
 
 try:
     from . import util
+    from . import metric
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+    from . import result_cache
+    from . import profiling
+    from . import result_store
 except (ImportError, SystemError):
     import util
+    import metric
+    import csr_graph
+    import geometry
+    import loader
+    import result_cache
+    import profiling
+    import result_store
 
 EARTH_RADIUS = 6371  # km
 
 G = nx.Graph()
-G_baseline = nx.Graph()
 sat_positions = {}
 city_positions = {}
 city_coverage = {}
 city_pairs = {}
+city_pair_groups = {}
+city_coverage_index = {}
 orb_0_sat_positions = {}
 valid_isls = {}
+orbit_slot_index = {}
+sat_cartesian = None
+prune_motifs = False
+matrix_metric = False
+astar_metric = False
+pair_bounds = None
+best_metric_bound = None
+pair_sample = None
+best_upper_bound = None
+bound_slots = [0]
+sat_abs_lat_deg = None
+profile_writer = None
+results_dataset = None
 
 
 def read_sat_positions(sat_pos_file):
@@ -51,155 +82,51 @@ def read_sat_positions(sat_pos_file):
     """
     global G
     global sat_positions
+    global orbit_slot_index
+    global sat_cartesian
+    global sat_abs_lat_deg
     global orb_0_sat_positions
     sat_positions = {}
     orb_0_sat_positions = {}
     cnt = 0
-    lines = [line.rstrip('\n') for line in open(sat_pos_file)]
-    for i in range(len(lines)):
-        val = lines[i].split(",")
-        sat_positions[int(val[0])] = {
-            "orb_id": int(val[1]),
-            "orb_sat_id": int(val[2]),
-            "lat_deg": float(val[3]),
-            "lat_rad": math.radians(float(val[3])),
-            "long_deg": float(val[4]),
-            "long_rad": math.radians(float(val[4])),
-            "alt_km": float(val[5])
+    positions = loader.load_sat_positions(sat_pos_file)
+    for sat_id, orb_id, orb_sat_id, lat_deg, long_deg, alt_km in positions.tolist():
+        sat_positions[sat_id] = {
+            "orb_id": orb_id,
+            "orb_sat_id": orb_sat_id,
+            "lat_deg": lat_deg,
+            "lat_rad": math.radians(lat_deg),
+            "long_deg": long_deg,
+            "long_rad": math.radians(long_deg),
+            "alt_km": alt_km
         }
-        G.add_node(int(val[0]))
-        if cnt < NUM_SATS_PER_ORBIT / 4 and int(val[1]) == 0:  # we need first quadrant of satellites
-            orb_0_sat_positions[int(val[0])] = {
-                "orb_id": int(val[1]),
-                "orb_sat_id": int(val[2]),
-                "lat_deg": float(val[3]),
-                "lat_rad": math.radians(float(val[3])),
-                "long_deg": float(val[4]),
-                "long_rad": math.radians(float(val[4])),
-                "alt_km": float(val[5])
+        G.add_node(sat_id)
+        if cnt < NUM_SATS_PER_ORBIT / 4 and orb_id == 0:  # we need first quadrant of satellites
+            orb_0_sat_positions[sat_id] = {
+                "orb_id": orb_id,
+                "orb_sat_id": orb_sat_id,
+                "lat_deg": lat_deg,
+                "lat_rad": math.radians(lat_deg),
+                "long_deg": long_deg,
+                "long_rad": math.radians(long_deg),
+                "alt_km": alt_km
             }
             cnt += 1
+    orbit_slot_index = util.build_orbit_slot_index(sat_positions, NUM_ORBITS, NUM_SATS_PER_ORBIT)
+    sat_cartesian = geometry.get_sat_cartesian(positions)
+    sat_abs_lat_deg = np.abs(np.array([sat_positions[i]["lat_deg"] for i in sat_positions]))
 
 
-def find_sat_with_min_motifs(lat, next_lat):
-    """
-    Gets the satellite with the minimum number of motifs for a specific latitude ring
-    :param lat: The lower latitude
-    :param next_lat: The upper latitude
-    :return: Satellite id for the satellite with the minimum number of motifs
-    """
-    sat_id = -1
-    min_motifs = 9999999
-    for index in range(len(orb_0_sat_positions)):
-        if lat < orb_0_sat_positions[index]["lat_deg"] < next_lat:
-            num_motifs = len(find_motifs_for_lat(index))
-            if num_motifs < min_motifs:
-                min_motifs = num_motifs
-                sat_id = index
-    return sat_id
-
-
-def find_motifs_for_lat(sat_id):
-    """
-    Get all feasible north and right links for a specific satellite
-    :param sat_id: Satellite id
-    :return: Collection of motif possibilities for the satellite
-    """
-    ORB_OFFSET = NUM_ORBITS / 4
-    valid_motif_links = {}
-    valid_link_cnt = 0
-    for i in range(len(valid_isls)):
-        if valid_isls[i]["sat_1"] == sat_id and valid_isls[i]["sat_2"] > sat_id and \
-                sat_positions[valid_isls[i]["sat_2"]]["orb_id"] < ORB_OFFSET:
-            orb_id = math.floor(valid_isls[i]["sat_2"] / NUM_SATS_PER_ORBIT)
-            sat_rel_id = valid_isls[i]["sat_2"] - sat_id - orb_id * NUM_SATS_PER_ORBIT
-            if sat_rel_id - sat_id > NUM_SATS_PER_ORBIT / 4:
-                sat_rel_id = sat_rel_id - NUM_SATS_PER_ORBIT
-            if not (orb_id == 0 and sat_rel_id < 0):
-                # print(valid_isls[i]["sat_2"], orb_id, sat_rel_id)
-                valid_motif_links[valid_link_cnt] = {
-                    "sat_id": valid_isls[i]["sat_2"],
-                    "orb_id": orb_id,
-                    "sat_rel_id": sat_rel_id
-                }
-                valid_link_cnt += 1
-    # Combined motif possibilities
-    # For same orbit, select the other link from different orbit
-    motif_possibilities = {}
-    motif_cnt = 0
-    for i in range(len(valid_motif_links) - 1):
-        for j in range(i + 1, len(valid_motif_links)):
-            if not (valid_motif_links[i]["orb_id"] == 0 and valid_motif_links[j]["orb_id"] == 0) and not (
-                    valid_motif_links[i]["sat_id"] == valid_motif_links[j]["sat_id"]):
-                # print(valid_motif_links[i]["sat_id"], valid_motif_links[j]["sat_id"])
-                motif_possibilities[motif_cnt] = {
-                    "sat_1_id": valid_motif_links[i]["sat_id"],
-                    "sat_1_orb_offset": valid_motif_links[i]["orb_id"],
-                    "sat_1_sat_offset": valid_motif_links[i]["sat_rel_id"],
-                    "sat_2_id": valid_motif_links[j]["sat_id"],
-                    "sat_2_orb_offset": valid_motif_links[j]["orb_id"],
-                    "sat_2_sat_offset": valid_motif_links[j]["sat_rel_id"],
-                    "wStretch": -1.0,
-                    "wHop": -1.0,
-                    "wMetric": -1.0,
-                    "future": None
-                }
-                motif_cnt += 1
-    return motif_possibilities
-
-
-def find_motif_possibilities(lat, next_lat):
-    """
-    Get all feasible north and right links for a specific latitude range
-    :param lat: The lower latitude
-    :param next_lat: The upper latitude
-    :return: Collection of motif possibilities for the latitude ring
-    """
-    lat_buffered = lat - 2
-    sat_id = find_sat_with_min_motifs(lat_buffered, next_lat)
-    print("sat id with min motifs", lat, ":", sat_id)
-    orbit_offset = NUM_ORBITS / 4
-    valid_motif_links = {}
-    valid_link_cnt = 0
-    for i in range(len(valid_isls)):
-        if valid_isls[i]["sat_1"] == sat_id and valid_isls[i]["sat_2"] > sat_id and \
-                sat_positions[valid_isls[i]["sat_2"]]["orb_id"] < orbit_offset:
-            orb_id = math.floor(valid_isls[i]["sat_2"] / NUM_SATS_PER_ORBIT)
-            sat_rel_id = valid_isls[i]["sat_2"] - sat_id - orb_id * NUM_SATS_PER_ORBIT
-            if sat_rel_id - sat_id > NUM_SATS_PER_ORBIT / 4:
-                sat_rel_id = sat_rel_id - NUM_SATS_PER_ORBIT
-            if not (orb_id == 0 and sat_rel_id < 0):
-                valid_motif_links[valid_link_cnt] = {
-                    "sat_id": valid_isls[i]["sat_2"],
-                    "orb_id": orb_id,
-                    "sat_rel_id": sat_rel_id
-                }
-                valid_link_cnt += 1
-    # Combined motif possibilities
-    # For same orbit, select the other link from different orbit
-    motif_possibilities = {}
-    motif_cnt = 0
-    for i in range(len(valid_motif_links) - 1):
-        for j in range(i + 1, len(valid_motif_links)):
-            if not (valid_motif_links[i]["orb_id"] == 0 and valid_motif_links[j]["orb_id"] == 0) and not (
-                    valid_motif_links[i]["sat_id"] == valid_motif_links[j]["sat_id"]):
-                # print(valid_motif_links[i]["sat_id"], valid_motif_links[j]["sat_id"])
-                motif_possibilities[motif_cnt] = {
-                    "motif_cnt": motif_cnt,
-                    "sat_1_id": valid_motif_links[i]["sat_id"],
-                    "sat_1_orb_offset": valid_motif_links[i]["orb_id"],
-                    "sat_1_sat_offset": valid_motif_links[i]["sat_rel_id"],
-                    "sat_2_id": valid_motif_links[j]["sat_id"],
-                    "sat_2_orb_offset": valid_motif_links[j]["orb_id"],
-                    "sat_2_sat_offset": valid_motif_links[j]["sat_rel_id"],
-                    "wStretch": -1.0,
-                    "wHop": -1.0,
-                    "M1": -1.0,
-                    "M2": -1.0,
-                    "future": None
-                }
-                motif_cnt += 1
-    return motif_possibilities
+def get_motif_candidates(motif, lat_level):
+    """
+    Lists the ISLs induced by a motif between satellites above a latitude, in the order they are added to the graph
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :param lat_level: The zone for which the motif is added
+    :return: List of (satellite, neighbor satellite) pairs
+    """
+    sat_1, sat_2 = util.get_motif_neighbor_pairs(orbit_slot_index, motif)
+    in_zone = (sat_abs_lat_deg[sat_1] > lat_level) & (sat_abs_lat_deg[sat_2] > lat_level)
+    return list(zip(sat_1[in_zone].tolist(), sat_2[in_zone].tolist()))
 
 
 def add_motif_links_to_graph(grph, motif, lat_level, lat_color):
@@ -211,56 +138,47 @@ def add_motif_links_to_graph(grph, motif, lat_level, lat_color):
     :param lat_color:  The assigned color for this zone
     :return: Updated graph
     """
-    for i in sat_positions:
-        sel_sat_id = util.get_neighbor_satellite(sat_positions[i]["orb_id"], sat_positions[i]["orb_sat_id"],
-                                                 motif["sat_1_orb_offset"], motif["sat_1_sat_offset"], sat_positions,
-                                                 NUM_ORBITS, NUM_SATS_PER_ORBIT)
-        is_possible = util.check_edge_availability(grph, i, sel_sat_id)
-        if is_possible and math.fabs(sat_positions[i]["lat_deg"]) > lat_level and math.fabs(
-                sat_positions[sel_sat_id]["lat_deg"]) > lat_level:
-            dist = util.compute_isl_length(i, sel_sat_id, sat_positions)
-            grph.add_edge(i, sel_sat_id, length=dist, color=lat_color, level=lat_level)
-        sel_sat_id = util.get_neighbor_satellite(sat_positions[i]["orb_id"], sat_positions[i]["orb_sat_id"],
-                                                 motif["sat_2_orb_offset"], motif["sat_2_sat_offset"], sat_positions,
-                                                 NUM_ORBITS, NUM_SATS_PER_ORBIT)
+    candidates = get_motif_candidates(motif, lat_level)
+    lengths = geometry.get_pair_distances(sat_cartesian, [c[0] for c in candidates], [c[1] for c in candidates])
+    for (i, sel_sat_id), dist in zip(candidates, lengths.tolist()):
         is_possible = util.check_edge_availability(grph, i, sel_sat_id)
-        if is_possible and math.fabs(sat_positions[i]["lat_deg"]) > lat_level and math.fabs(
-                sat_positions[sel_sat_id]["lat_deg"]) > lat_level:
-            dist = util.compute_isl_length(i, sel_sat_id, sat_positions)
+        if is_possible:
             grph.add_edge(i, sel_sat_id, length=dist, color=lat_color, level=lat_level)
     print("total edges", grph.number_of_edges())
     return grph
 
 
-def add_motif_links_to_graph_in_range(motif, lat_level_bottom, lat_level_top, lat_color):
+def build_motif_graph(base_isls, motif, lat_level):
+    """
+    Builds the CSR satellite graph for a motif on top of the ISLs already fixed for the lower zones
+    :param base_isls: ISL set of the graph before adding the motif
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :param lat_level: The zone for which the motif is added
+    :return: CSR graph
+    """
+    isls = csr_graph.extend_isls(base_isls, get_motif_candidates(motif, lat_level), sat_cartesian,
+                                 len(sat_positions))
+    print("total edges", len(isls["length"]))
+    return csr_graph.build_csr_graph(len(sat_positions), isls)
+
+
+def add_motif_links_to_graph_in_range(grph, motif, lat_level_bottom, lat_level_top, lat_color):
     """
-    Add ISLs to the master graph only within the zone specified by the upper and lower latitudes
+    Add ISLs to the graph only within the zone specified by the upper and lower latitudes
+    :param grph: The graph of a zone configuration, updated in place
     :param motif: The selected optimal motif
     :param lat_level_bottom: The lower latitude
     :param lat_level_top: The upper latitude
     :param lat_color: The assigned color for this zone
     """
-    global G
     print("adding edges to final graph")
-    for i in sat_positions:
-        sel_sat_id = util.get_neighbor_satellite(sat_positions[i]["orb_id"], sat_positions[i]["orb_sat_id"],
-                                                 motif["sat_1_orb_offset"], motif["sat_1_sat_offset"], sat_positions,
-                                                 NUM_ORBITS, NUM_SATS_PER_ORBIT)
-        is_possible = util.check_edge_availability(G, i, sel_sat_id)
-        is_in_range = check_edge_range(i, sel_sat_id, lat_level_bottom, lat_level_top)
-        if is_possible and is_in_range and math.fabs(sat_positions[i]["lat_deg"]) > lat_level_bottom and math.fabs(
-                sat_positions[sel_sat_id]["lat_deg"]) > lat_level_bottom:
-            dist = util.compute_isl_length(i, sel_sat_id, sat_positions)
-            G.add_edge(i, sel_sat_id, length=dist, color=lat_color, level=lat_level_bottom)
-        sel_sat_id = util.get_neighbor_satellite(sat_positions[i]["orb_id"], sat_positions[i]["orb_sat_id"],
-                                                 motif["sat_2_orb_offset"], motif["sat_2_sat_offset"], sat_positions,
-                                                 NUM_ORBITS, NUM_SATS_PER_ORBIT)
-        is_possible = util.check_edge_availability(G, i, sel_sat_id)
+    candidates = get_motif_candidates(motif, lat_level_bottom)
+    lengths = geometry.get_pair_distances(sat_cartesian, [c[0] for c in candidates], [c[1] for c in candidates])
+    for (i, sel_sat_id), dist in zip(candidates, lengths.tolist()):
+        is_possible = util.check_edge_availability(grph, i, sel_sat_id)
         is_in_range = check_edge_range(i, sel_sat_id, lat_level_bottom, lat_level_top)
-        if is_possible and is_in_range and math.fabs(sat_positions[i]["lat_deg"]) > lat_level_bottom and math.fabs(
-                sat_positions[sel_sat_id]["lat_deg"]) > lat_level_bottom:
-            dist = util.compute_isl_length(i, sel_sat_id, sat_positions)
-            G.add_edge(i, sel_sat_id, length=dist, color=lat_color, level=lat_level_bottom)
+        if is_possible and is_in_range:
+            grph.add_edge(i, sel_sat_id, length=dist, color=lat_color, level=lat_level_bottom)
 
 
 def check_edge_range(sat1, sat2, lat_level_bottom, thresh_lat):
@@ -282,89 +200,170 @@ def check_edge_range(sat1, sat2, lat_level_bottom, thresh_lat):
     return is_in_range
 
 
-def compute_metric_avoid_city(grph):
+def get_best_metric():
+    """
+    Gets the best wMetric found so far for the zone nodes of the current task, shared by all workers. A motif shared
+    by several nodes is only abandoned once it loses in all of them.
+    :return: Best wMetric (infinity if none yet)
+    """
+    return max(best_metric_bound[slot] for slot in bound_slots)
+
+
+def update_best_metric(wMetric):
+    """
+    Lowers the shared best wMetric of the zone nodes of the current task
+    :param wMetric: Metric of a fully evaluated motif
+    """
+    with best_metric_bound.get_lock():
+        for slot in bound_slots:
+            if wMetric < best_metric_bound[slot]:
+                best_metric_bound[slot] = wMetric
+
+
+def get_best_upper_bound():
+    """
+    Gets the lowest upper confidence bound of the wMetric found so far while screening the zone nodes of the current
+    task (the highest one over the nodes, as for get_best_metric)
+    :return: Lowest upper bound (infinity if none yet)
+    """
+    return max(best_upper_bound[slot] for slot in bound_slots)
+
+
+def update_best_upper_bound(upper_bound):
+    """
+    Lowers the shared upper confidence bound of the zone nodes of the current task
+    :param upper_bound: Upper confidence bound of a fully sampled motif
+    """
+    with best_upper_bound.get_lock():
+        for slot in bound_slots:
+            if upper_bound < best_upper_bound[slot]:
+                best_upper_bound[slot] = upper_bound
+
+
+def print_sample_estimate(estimate):
+    """
+    Prints the running estimate of a sampled motif
+    :param estimate: Output of metric.get_sample_estimate
+    """
+    print("draws:", estimate["numDraws"], ", wStretch:", estimate["avgWeightedStretch"], "+-",
+          estimate["avgWeightedStretchCI"], ", wHop:", estimate["avgWeightedHopCount"], "+-",
+          estimate["avgWeightedHopCountCI"], ", wMetric:", estimate["wMetric"], "+-", estimate["wMetricCI"])
+
+
+def get_engine():
+    """
+    Names the engine computing the metric, which is part of the cache keys (see result_cache.get_engine_description)
+    :return: "matrix", "astar" or "search" (also used by --prune)
+    """
+    if matrix_metric:
+        return "matrix"
+    if astar_metric:
+        return "astar"
+    return result_cache.REFERENCE_ENGINE
+
+
+def compute_metric_avoid_city(graph, prune=False, stage_times=None):
     """
     Computes city-pair wise stretch and hop count and the aggregate metric values
-    :param grph: The graph with satellites and cities as nodes
-    :return: Computed aggregated metric
+    :param graph: CSR graph of the satellite network
+    :param prune: Whether to abandon the evaluation once the metric provably exceeds the best one at this level
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric ("pruned" set if abandoned)
     """
-    weightSum = 0
-    weightedStretchSum = 0
-    weightedHopCountSum = 0
     a = datetime.datetime.now()
-    for i in range(len(city_pairs)):
-        city1 = city_pairs[i]["city_1"]
-        city2 = city_pairs[i]["city_2"]
-        geoDist = city_pairs[i]["geo_dist"]
-        try:
-            util.add_coverage_for_city(grph, city1, city_coverage)
-            util.add_coverage_for_city(grph, city2, city_coverage)
-            distance = nx.shortest_path_length(grph, source=city1, target=city2, weight='length')
-            path = nx.shortest_path(grph, source=city1, target=city2, weight='length')
-
-            hops = path.__len__() - 1
-            stretch = distance / geoDist
-
-            weight = city_positions[city1]["pop"] * city_positions[city2]["pop"] / 10000000
-            weightSum += weight
-            weightedStretchSum += stretch * weight
-            weightedHopCountSum += hops * weight
-
-            util.remove_coverage_for_city(grph, city1, city_coverage)
-            util.remove_coverage_for_city(grph, city2, city_coverage)
-        except Exception as e:
-            util.remove_coverage_for_city(grph, city1, city_coverage)
-            util.remove_coverage_for_city(grph, city2, city_coverage)
-            return_val = {
-                "avgWeightedStretch": 99999.0,
-                "avgWeightedHopCount": 99999.0,
-                "wMetric": 99999.0
-            }
-            return return_val
-    # print("path_through_city_cnt", path_through_city_cnt)
-
-    avgWeightedStretch = weightedStretchSum / weightSum
-    avgWeightedHopCount = weightedHopCountSum / weightSum
-    wMetric = avgWeightedStretch + avgWeightedHopCount
+    if prune:
+        return_val = metric.compute_metric_avoid_city_bounded(graph, city_pairs, city_positions, city_coverage_index,
+                                                              city_pair_groups, pair_bounds, get_best_metric,
+                                                              stage_times)
+    elif matrix_metric:
+        return_val = metric.compute_metric_avoid_city_matrix(graph, city_pairs, city_positions, city_coverage_index,
+                                                             city_pair_groups, stage_times)
+    elif astar_metric:
+        return_val = metric.compute_metric_avoid_city_astar(graph, city_pairs, city_positions, city_coverage_index,
+                                                            sat_cartesian, stage_times)
+    else:
+        return_val = metric.compute_metric_avoid_city(graph, city_pairs, city_positions, city_coverage_index,
+                                                      city_pair_groups, stage_times)
+    wMetric = return_val["wMetric"]
 
     b = datetime.datetime.now() - a
-    print("time to compute metric:", b.seconds, ", wMetric:", wMetric)
+    if "expandedSatellites" in return_val:
+        print("satellites expanded by A*:", return_val["expandedSatellites"], ", settled by the per-source search:",
+              return_val["searchSettledSatellites"])
+    if return_val.get("pruned"):
+        print("time to compute metric:", b.seconds, ", pruned with wMetric lower bound:", wMetric)
+    else:
+        print("time to compute metric:", b.seconds, ", wMetric:", wMetric)
 
-    return_val = {
-        "avgWeightedStretch": avgWeightedStretch,
-        "avgWeightedHopCount": avgWeightedHopCount,
-        "wMetric": wMetric
-    }
     return return_val
 
 
-def write_edges_to_file(graph, writer):
+def start_motif_record(submitted, motif, level):
     """
-        Writes the edges of a graph to a file
-        :param grph: The graph under consideration
-        :param writer: Writer corresponding to output file
+    Starts the profiling record of a motif evaluation inside a pool worker
+    :param submitted: Time the task was handed to the pool
+    :param motif: Motif to evaluate
+    :param level: Latitude zone of the motif
+    :return: Output of profiling.start_record
     """
-    edges = graph.edges(data=True)
-    for edge in edges:
-        writer.write(str(edge[0]) + "," + str(edge[1]) + "\n")
+    return profiling.start_record(submitted, {
+        "level": level,
+        "motif": [motif["sat_1_orb_offset"], motif["sat_1_sat_offset"], motif["sat_2_orb_offset"],
+                  motif["sat_2_sat_offset"]]
+    })
 
 
-def run_motif_analysis(grph, motif_cnt, motif, level, color, return_dict):
+def run_motif_analysis(task):
+    """
+    Runs motif analysis for individual motifs inside a pool worker
+    :param task: Tuple of the ISL set of the graph before adding the motif, bound slots of the zone nodes sharing
+                 the motif, motif group, motif, latitude zone and submission time
+    :return: Tuple of motif group, computed aggregated metric and profiling record
     """
-    Runs motif analysis for individual motifs
-    :param grph: The graph under consideration
-    :param motif_cnt: Motif counter
-    :param motif: Motif
-    :param level: The latitude zone
-    :param color: The assigned color for the zone
-    :param return_dict: The return values
+    global bound_slots
+    base_isls, bound_slots, motif_group, motif, level, submitted = task
+    record = start_motif_record(submitted, motif, level)
+    print("Generating graph for motif:", motif["sat_1_id"], ",", motif["sat_2_id"])
+    t = time.perf_counter()
+    graph = build_motif_graph(base_isls, motif, level)
+    profiling.add_stage_time(record["stages"], "graph_build", t)
+    retVal = compute_metric_avoid_city(graph, prune_motifs, record["stages"])
+    if prune_motifs and not retVal.get("pruned"):
+        update_best_metric(retVal["wMetric"])
+    return motif_group, retVal, profiling.finish_record(record, retVal.get("numPairs", len(city_pairs)), retVal)
+
+
+def run_motif_screening(task):
     """
-    grph = add_motif_links_to_graph(grph, motif, level, color)
-    retVal = compute_metric_avoid_city(grph)
-    motif["wMetric"] = retVal["wMetric"]
-    motif["wStretch"] = retVal["avgWeightedStretch"]
-    motif["wHop"] = retVal["avgWeightedHopCount"]
-    return_dict[motif_cnt] = motif
+    Estimates the metric of individual motifs from the sampled city pairs inside a pool worker
+    :param task: Tuple of the ISL set of the graph before adding the motif, bound slots of the zone nodes sharing
+                 the motif, motif group, motif, latitude zone and submission time
+    :return: Tuple of motif group, estimated aggregated metric and profiling record
+    """
+    global bound_slots
+    base_isls, bound_slots, motif_group, motif, level, submitted = task
+    record = start_motif_record(submitted, motif, level)
+    print("Screening motif:", motif["sat_1_id"], ",", motif["sat_2_id"])
+    t = time.perf_counter()
+    graph = build_motif_graph(base_isls, motif, level)
+    profiling.add_stage_time(record["stages"], "graph_build", t)
+    estimate = metric.estimate_metric_avoid_city_sampled(graph, city_pairs, city_coverage_index, pair_sample,
+                                                         get_best_upper_bound, print_sample_estimate,
+                                                         record["stages"])
+    if not estimate.get("stopped"):
+        update_best_upper_bound(estimate["wMetric"] + estimate["wMetricCI"])
+    return motif_group, estimate, profiling.finish_record(record, estimate["numDraws"], estimate)
+
+
+def set_motif_result(motif, result):
+    """
+    Stores the aggregated metric values of a motif
+    :param motif: Motif to update
+    :param result: Aggregated metric values
+    """
+    motif["wMetric"] = result["wMetric"]
+    motif["wStretch"] = result["avgWeightedStretch"]
+    motif["wHop"] = result["avgWeightedHopCount"]
 
 
 def regenerate_baseline(file):
@@ -373,7 +372,6 @@ def regenerate_baseline(file):
     :param file: Input file containing baseline configuration
     :return: Computed metric
     """
-    global G_baseline
     lines = [line.rstrip('\n') for line in open(file)]
     val = lines[0].split(",")
     lat_bottom = float(val[0])
@@ -384,17 +382,288 @@ def regenerate_baseline(file):
         "sat_2_sat_offset": int(val[5])
     }
     print(best_motif_at_level)
-    G_baseline = add_motif_links_to_graph(G_baseline, best_motif_at_level, lat_bottom, "NONE")
-    return compute_metric_avoid_city(G_baseline)
+    key = result_cache.get_motif_key(input_digest, result_cache.get_isls_digest(csr_graph.empty_isls()), lat_bottom,
+                                     best_motif_at_level, get_engine())
+    if key in cached_results:
+        return cached_results[key]
+    graph = build_motif_graph(csr_graph.empty_isls(), best_motif_at_level, lat_bottom)
+    return_val = compute_metric_avoid_city(graph)
+    result_cache.append_result(cache_writer, key, return_val)
+    return return_val
+
+
+def get_zone_configurations(num_zones, boundaries):
+    """
+    Lists the zone boundary configurations to explore
+    :param num_zones: Number of latitude zones
+    :param boundaries: Candidate boundaries between zones in degrees
+    :return: List of boundary lists, each starting at 0 and ending at 90 degrees
+    """
+    return [[0.0] + list(inner) + [90.0] for inner in itertools.combinations(sorted(set(boundaries)), num_zones - 1)]
+
+
+def get_zone_nodes(configurations, l):
+    """
+    Lists the zone nodes at a depth of the greedy chains of all configurations. The result of zone l only depends
+    on the boundaries up to its upper one, so configurations sharing them share the node and everything below it.
+    :param configurations: Output of get_zone_configurations
+    :param l: Zone index
+    :return: Distinct boundary prefixes in configuration order
+    """
+    prefixes = []
+    for boundaries in configurations:
+        prefix = tuple(boundaries[:l + 2])
+        if prefix not in prefixes:
+            prefixes.append(prefix)
+    return prefixes
+
+
+def group_equivalent_motifs(nodes, members):
+    """
+    Groups motifs of zone nodes that induce the same ISLs (see result_cache.get_topology_digest), e.g. offsets
+    reaching the same neighbors through the modular orbit and slot arithmetic, or links skipped because the
+    satellites already have all their ISLs. Each group is evaluated once.
+    :param nodes: Zone nodes with their motif topologies
+    :param members: List of (bound slot, motif counter) to group
+    :return: List of groups, each a list of (bound slot, motif counter) with the evaluated motif first
+    """
+    groups = {}
+    for slot, cnt in members:
+        groups.setdefault(nodes[slot]["topologies"][cnt], []).append((slot, cnt))
+    return list(groups.values())
+
+
+def get_group_task(nodes, groups, motif_group):
+    """
+    Creates the pool task evaluating a group of equivalent motifs
+    :param nodes: Zone nodes
+    :param groups: Output of group_equivalent_motifs
+    :param motif_group: Index of the group
+    :return: Task of run_motif_analysis and run_motif_screening
+    """
+    slot, cnt = groups[motif_group][0]
+    slots = sorted(set(member[0] for member in groups[motif_group]))
+    return nodes[slot]["base_isls"], slots, motif_group, nodes[slot]["motifs"][cnt], nodes[slot]["level"], time.time()
+
+
+def add_group_record(nodes, group, record):
+    """
+    Attaches the profiling record of a group evaluation to all motifs of the group
+    :param nodes: Zone nodes
+    :param group: List of (bound slot, motif counter), the evaluated motif first
+    :param record: Output of profiling.finish_record
+    """
+    nodes[group[0][0]]["run_motifs"].add(group[0][1])
+    for slot, motif_cnt in group:
+        nodes[slot]["records"].setdefault(motif_cnt, []).append(record)
+
+
+def get_motif_status(node, cnt):
+    """
+    Gets the result status of a motif of a zone node (see result_store.MOTIF_DTYPE)
+    :param node: Zone node completed by evaluate_zone_nodes
+    :param cnt: Motif counter
+    :return: Status
+    """
+    if cnt in node["pruned_motifs"]:
+        return "pruned"
+    if cnt in node["screened_motifs"]:
+        return "screened"
+    if node["sampled_motifs"].get(cnt, {}).get("failed"):
+        return "failed"
+    if cnt in node["topologies"]:
+        return "evaluated"
+    return "cached"
+
+
+def append_node_rows(node):
+    """
+    Streams the motif table rows of a zone node to the result dataset
+    :param node: Zone node completed by evaluate_zone_nodes
+    """
+    motifs = node["motifs"]
+    result_store.append_rows(results_dataset, "motifs", [
+        result_store.get_motif_row(node["name"], node["zone"], node["level"], node["next_level"], motifs[cnt],
+                                   get_motif_status(node, cnt), motifs[cnt] is node["best_motif"],
+                                   cnt in node["records"] and cnt not in node["run_motifs"],
+                                   node["records"].get(cnt), node["sampled_motifs"].get(cnt))
+        for cnt in range(len(motifs))])
+
+
+def evaluate_zone_nodes(nodes):
+    """
+    Finds the best motif of one zone for several zone nodes at once. The motifs of all nodes are evaluated by the
+    same pool, so different boundary configurations are explored in parallel, and equivalent motifs are evaluated
+    once across all nodes.
+    :param nodes: List of zone nodes with base graph, zone index and boundaries; the position of a node in the list
+                  is its bound slot. Every node is completed with its motifs, best motif and resulting graph.
+    """
+    members = []
+    for slot in range(len(nodes)):
+        node = nodes[slot]
+        node["motifs"] = util.find_zone_motif_possibilities(valid_isls, sat_positions, orb_0_sat_positions, NUM_ORBITS,
+                                                            NUM_SATS_PER_ORBIT, node["level"], node["next_level"])
+        node["base_isls"] = csr_graph.isls_from_graph(node["base_graph"], len(sat_positions))
+        base_isls_digest = result_cache.get_isls_digest(node["base_isls"])
+
+        # For each motif compute metrics, persisting every result as soon as it arrives
+        node["keys"] = [result_cache.get_motif_key(input_digest, base_isls_digest, node["level"], node["motifs"][cnt],
+                                                   get_engine())
+                        for cnt in range(len(node["motifs"]))]
+        node["topologies"] = {}
+        node["pruned_motifs"] = {}
+        node["sampled_motifs"] = {}
+        node["screened_motifs"] = set()
+        node["records"] = {}
+        node["run_motifs"] = set()
+        best_metric_bound[slot] = float("inf")
+        for cnt in range(len(node["motifs"])):
+            if node["keys"][cnt] in cached_results:
+                set_motif_result(node["motifs"][cnt], cached_results[node["keys"][cnt]])
+                best_metric_bound[slot] = min(best_metric_bound[slot], node["motifs"][cnt]["wMetric"])
+            else:
+                candidates = get_motif_candidates(node["motifs"][cnt], node["level"])
+                isls = csr_graph.extend_isls(node["base_isls"], candidates, sat_cartesian, len(sat_positions))
+                node["topologies"][cnt] = result_cache.get_topology_digest(isls)
+                members.append((slot, cnt))
+    groups = group_equivalent_motifs(nodes, members)
+    print("motifs taken from cache:", sum(len(node["motifs"]) for node in nodes) - len(members),
+          ", motifs to evaluate:", len(members), ", distinct topologies:", len(groups))
+
+    # Screen the remaining motifs on the sampled pairs and only keep the contenders, whose interval reaches below
+    # the lowest upper bound of their node; cached motifs take part with their exact metric
+    if pair_sample is not None and groups:
+        for slot in range(len(nodes)):
+            best_upper_bound[slot] = best_metric_bound[slot]
+        tasks = [get_group_task(nodes, groups, motif_group) for motif_group in range(len(groups))]
+        progress = profiling.start_progress("zone " + str(nodes[0]["zone"]) + " screening", len(tasks))
+        for motif_group, estimate, record in pool.imap_unordered(run_motif_screening, tasks):
+            profiling.update_progress(progress, record, profile_writer)
+            add_group_record(nodes, groups[motif_group], record)
+            for slot, motif_cnt in groups[motif_group]:
+                node = nodes[slot]
+                node["sampled_motifs"][motif_cnt] = estimate
+                if estimate.get("failed"):
+                    # A drawn pair is unreachable, so the metric over all pairs fails as well
+                    set_motif_result(node["motifs"][motif_cnt], estimate)
+                    result = dict(metric.FAILED_METRIC)
+                    cached_results[node["keys"][motif_cnt]] = result
+                    result_cache.append_result(cache_writer, node["keys"][motif_cnt], result)
+        profiling.print_worker_summary(progress)
+        for slot in range(len(nodes)):
+            node = nodes[slot]
+            lowest_upper_bound = best_metric_bound[slot]
+            for estimate in node["sampled_motifs"].values():
+                lowest_upper_bound = min(lowest_upper_bound, estimate["wMetric"] + estimate["wMetricCI"])
+            for motif_cnt in node["sampled_motifs"]:
+                estimate = node["sampled_motifs"][motif_cnt]
+                if not estimate.get("failed") and estimate["wMetric"] - estimate["wMetricCI"] > lowest_upper_bound:
+                    node["screened_motifs"].add(motif_cnt)
+        members = [(slot, cnt) for slot, cnt in members if cnt not in nodes[slot]["screened_motifs"]
+                   and not nodes[slot]["sampled_motifs"][cnt].get("failed")]
+        groups = group_equivalent_motifs(nodes, members)
+        print("motifs screened out:", sum(len(node["screened_motifs"]) for node in nodes), ", contenders:",
+              len(members))
+
+    tasks = [get_group_task(nodes, groups, motif_group) for motif_group in range(len(groups))]
+    progress = profiling.start_progress("zone " + str(nodes[0]["zone"]), len(tasks))
+    for motif_group, result, record in pool.imap_unordered(run_motif_analysis, tasks):
+        profiling.update_progress(progress, record, profile_writer)
+        add_group_record(nodes, groups[motif_group], record)
+        for slot, motif_cnt in groups[motif_group]:
+            node = nodes[slot]
+            if result.get("pruned"):
+                # Pruned motifs keep their lower bound, which exceeds the best metric, and are not cached
+                node["motifs"][motif_cnt]["wMetric"] = result["wMetric"]
+                node["pruned_motifs"][motif_cnt] = result["wMetric"]
+                continue
+            set_motif_result(node["motifs"][motif_cnt], result)
+            cached_results[node["keys"][motif_cnt]] = result
+            result_cache.append_result(cache_writer, node["keys"][motif_cnt], result)
+    profiling.print_worker_summary(progress)
+
+    for node in nodes:
+        # Get the zone-wise best motif based on the aggregated metric value
+        # (screened out motifs have no wMetric and are never selected)
+        node["best_motif"] = util.get_best_motif_at_level(node["motifs"])
+        color = colors[node["zone"] % len(colors)]
+        node["level_graph"] = add_motif_links_to_graph(node["base_graph"].copy(), node["best_motif"], node["level"],
+                                                       color)
+        node["graph"] = node["base_graph"].copy()
+        add_motif_links_to_graph_in_range(node["graph"], node["best_motif"], node["level"], node["next_level"], color)
+        print("edges in graph", node["graph"].number_of_edges())
+        append_node_rows(node)
+
+
+def append_configuration_edges(boundaries):
+    """
+    Streams the edge table rows of the graphs of one zone configuration to the result dataset: the graph of every
+    zone with its best motif applied above the lower latitude of the zone, and the final graph
+    :param boundaries: Zone boundaries of the configuration
+    """
+    name = result_store.get_node_name(boundaries)
+    for l in range(len(boundaries) - 1):
+        node = zone_nodes[tuple(boundaries[:l + 2])]
+        result_store.append_rows(results_dataset, "edges",
+                                 result_store.get_edge_rows(node["level_graph"], name, "level_" + str(l), boundaries))
+    result_store.append_rows(results_dataset, "edges",
+                             result_store.get_edge_rows(zone_nodes[tuple(boundaries)]["graph"], name, "overall",
+                                                        boundaries))
 
 
 # =====================================================================
 # INPUTS
 # =====================================================================
 
-config = sys.argv[1]  # 40_40_53deg, kuiper_p1, starlink_p1
-max_isl_length = sys.argv[2]  # 5014/1467 (for 40_40_53deg), 5440/1761 (kuiper_p1), 5014/2006 (starlink_p1))
-CORE_CNT = int(sys.argv[3])
+parser = argparse.ArgumentParser(description="Find the best motif of every latitude zone")
+parser.add_argument("config", help="40_40_53deg, kuiper_p1, starlink_p1")
+parser.add_argument("max_isl_length", help="5014/1467 (for 40_40_53deg), 5440/1761 (kuiper_p1), 5014/2006 (starlink_p1)")
+parser.add_argument("cores", type=int, help="Number of cores assigned to the routine")
+parser.add_argument("--prune", action="store_true",
+                    help="Abandon motifs as soon as they provably lose against the best one at their level; "
+                         "they are listed in level_<n>_pruned_motifs.txt instead of level_<n>_motif_metrics.txt")
+parser.add_argument("--sample-size", type=int, default=0,
+                    help="Screen motifs on this many population weighted city pair draws first and evaluate on all "
+                         "pairs only the motifs whose confidence interval overlaps the leader's; estimates are "
+                         "listed in level_<n>_sampled_motifs.txt (default 0: evaluate every motif on all pairs)")
+parser.add_argument("--sample-seed", type=int, default=0, help="Seed of the city pair draws")
+parser.add_argument("--zones", type=int,
+                    help="Search zone boundaries: number of latitude zones, with every combination of --boundaries "
+                         "between them; each configuration is written to multi_motif/zones_<boundaries> and all of "
+                         "them are ranked in multi_motif/zone_search.txt (default: zones 0-18-36-90)")
+parser.add_argument("--boundaries", type=float, nargs="+", help="Candidate zone boundaries in degrees")
+parser.add_argument("--matrix", action="store_true",
+                    help="Evaluate motifs in two stages: shortest paths between the satellites covering the cities, "
+                         "then the best up-link, path and down-link combination of every city pair; faster when "
+                         "there are fewer such satellites than source cities (metric.compute_metric_avoid_city_matrix)")
+parser.add_argument("--astar", action="store_true",
+                    help="Evaluate motifs with one A* search per city pair, guided by the straight line distance to "
+                         "the destination; same results, fewer expanded satellites "
+                         "(metric.compute_metric_avoid_city_astar)")
+parser.add_argument("--profile-log",
+                    help="Append one JSON line per evaluated motif to this file, with its worker, queue wait, time per "
+                         "stage (graph build, coverage attach, path search, aggregation) and pairs/s")
+args = parser.parse_args()
+if args.prune + args.matrix + args.astar > 1:
+    parser.error("--prune, --matrix and --astar are different ways to evaluate a motif, choose one")
+if args.sample_size == 1 or args.sample_size < 0:
+    parser.error("--sample-size must be 0 or at least 2")
+if (args.zones is None) != (args.boundaries is None) and not (args.zones == 1 and args.boundaries is None):
+    parser.error("--zones and --boundaries go together")
+if args.zones is not None and args.zones < 1:
+    parser.error("--zones must be at least 1")
+if args.boundaries is not None:
+    if any(not 0.0 < boundary < 90.0 for boundary in args.boundaries):
+        parser.error("--boundaries must lie strictly between 0 and 90 degrees")
+    if len(set(args.boundaries)) < args.zones - 1:
+        parser.error(str(args.zones) + " zones need at least " + str(args.zones - 1) + " distinct boundaries")
+
+config = args.config
+max_isl_length = args.max_isl_length
+CORE_CNT = args.cores
+prune_motifs = args.prune
+matrix_metric = args.matrix
+astar_metric = args.astar
 
 satPositionsFile = "../input_data/constellation_" + config + "/data_sat_position/sat_positions_0.txt"
 validISLFile = "../input_data/constellation_" + config + "/data_validISLs_" + max_isl_length + "/valid_ISLs_0.txt"
@@ -427,89 +696,94 @@ valid_isls = util.read_valid_isls(validISLFile)
 city_positions, G = util.read_city_positions(cityPositionsFile, G)
 city_coverage = util.read_city_coverage(cityCoverageFile)
 city_pairs = util.read_city_pair_file(cityPairFile)
-G_baseline = G.copy()
+city_pair_groups = metric.group_city_pairs_by_source(city_pairs)
+city_coverage_index = util.build_city_coverage_index(city_coverage)
+
+# Results of motifs evaluated by earlier (possibly interrupted) runs on the same inputs are reused
+input_digest = result_cache.get_input_digest([satPositionsFile, cityCoverageFile, cityPositionsFile, cityPairFile])
+cached_results = result_cache.load_results(result_cache.DEFAULT_CACHE_FILE)
+cache_writer = result_cache.open_results(result_cache.DEFAULT_CACHE_FILE)
+profile_writer = profiling.open_log(args.profile_log)
+
+# Motif independent lower bounds of every pair, used to abandon losing motifs early
+if prune_motifs:
+    pair_bounds = metric.get_pair_lower_bounds(city_pairs, city_coverage_index, sat_cartesian)
+
+# The same draws are used for every motif, so differences between estimates are not blurred by sampling noise
+if args.sample_size > 0:
+    pair_sample = metric.draw_pair_sample(metric.get_pair_weights(city_pairs, city_positions), args.sample_size,
+                                          args.sample_seed)
 
 # =====================================================================
 # MULTI MOTIF ROUTINE STARTS
 # =====================================================================
 
-best_motif_overall = "../output_data_generated/multi_motif/best_motif_overall.txt"
-metric_reduction_file = "../output_data_generated/multi_motif/metric_improvement.txt"
-
+output_dir = "../output_data_generated/multi_motif"
 levels = [0.0, 18.0, 36.0, 90.0]
 colors = ["green", "blue", "red", "green", "blue"]
 
-writer_level_wise_best_motif = open("../output_data_generated/multi_motif/level_wise_best_motif.txt", 'a+')
-
-best_motif_metric = -1.0
-# For each latitude zone, run the motif routine
-for l in range(0, len(levels) - 1):
-    writer_level_motif_metrics = open("../output_data_generated/multi_motif/level_" + str(l) + "_motif_metrics.txt", 'a+')
-    writer_level_best_motif = open("../output_data_generated/multi_motif/level_" + str(l) + "_best_motif.txt", 'a+')
-    level = levels[l]
-    next_level = levels[l + 1]
-
-    # Get all motif possibilities
-    # valid_motif_possibilities = {}
-    valid_motif_possibilities = find_motif_possibilities(level, next_level)
-
-    # For each motif compute metrics
-    for i in range(0, len(valid_motif_possibilities), CORE_CNT):
-        threads = []
-        manager = multiprocessing.Manager()
-        return_dict = manager.dict()
-
-        # Parallelize metric computation based on available cores
-        for j in range(0, CORE_CNT):
-            id = i + j
-            if id < len(valid_motif_possibilities):
-                print("Generating graph for motif:", valid_motif_possibilities[id]["sat_1_id"], ",",
-                      valid_motif_possibilities[id]["sat_2_id"])
-                p = Process(target=run_motif_analysis,
-                            args=(G.copy(), id, valid_motif_possibilities[id], level, colors[l], return_dict))
-                threads.append(p)
-        for x in threads:
-            x.start()
-        for x in threads:
-            x.join()
-
-        for value in return_dict.values():
-            valid_motif_possibilities[value["motif_cnt"]]["wMetric"] = value["wMetric"]
-            valid_motif_possibilities[value["motif_cnt"]]["wStretch"] = value["wStretch"]
-            valid_motif_possibilities[value["motif_cnt"]]["wHop"] = value["wHop"]
-
-    # Get the zone-wise best motif based on the aggregated metric value
-    # and print it to the zone-wise best motif file
-    best_motif = util.get_best_motif_at_level(valid_motif_possibilities)
-    writer_level_wise_best_motif.write(
-        str(level) + "," + str(next_level) + "," + str(best_motif["wStretch"]) + "," + str(
-            best_motif["wHop"]) + "," + str(best_motif["wMetric"]) + "," + str(best_motif["sat_1_orb_offset"]) + "," + str(
-            best_motif["sat_1_sat_offset"]) + "," + str(best_motif["sat_2_orb_offset"]) + "," + str(
-            best_motif["sat_2_sat_offset"]) + "\n")
-
-    # Print zone-wise motif-metric mappings to output file
-    for cnt in range(len(valid_motif_possibilities)):
-        writer_level_motif_metrics.write(str(cnt) + "," + str(valid_motif_possibilities[cnt]["wStretch"]) + "," + str(
-            valid_motif_possibilities[cnt]["wHop"]) + "," + str(valid_motif_possibilities[cnt]["wMetric"]) + "\n")
-    writer_level_motif_metrics.close()
-    graph = add_motif_links_to_graph(G.copy(), best_motif, level, colors[l])
-    write_edges_to_file(graph, writer_level_best_motif)
-    writer_level_best_motif.close()
-
-    add_motif_links_to_graph_in_range(best_motif, level, next_level, colors[l])
-    print("edges in graph", G.number_of_edges())
-    best_motif_metric = best_motif["wMetric"]
-
-# Print ISLs corresponding to the best motif
-writer_best_motif_overall = open(best_motif_overall, 'a+')
-write_edges_to_file(G, writer_best_motif_overall)
-writer_best_motif_overall.close()
-
-# Compute Phi-improvement over baseline
-metric = regenerate_baseline(baseline_config_file)
-reduction = (metric["wMetric"] - best_motif_metric) * 100 / metric["wMetric"]
-print(metric["wMetric"], best_motif_metric, reduction)
-
-writer_imp = open(metric_reduction_file, 'a+')
-writer_imp.write(str(reduction))
-writer_imp.close()
+if args.zones is None:
+    configurations = [levels]
+else:
+    configurations = get_zone_configurations(args.zones, args.boundaries or [])
+num_zones = len(configurations[0]) - 1
+print("zone configurations:", len(configurations))
+
+# Every zone node evaluated at the same depth has its own slot for the best metric and upper bound shared by the
+# workers; they are allocated before the workers are forked
+max_nodes = max(len(get_zone_nodes(configurations, l)) for l in range(num_zones))
+best_metric_bound = multiprocessing.get_context("fork").Array("d", [float("inf")] * max_nodes)
+best_upper_bound = multiprocessing.get_context("fork").Array("d", [float("inf")] * max_nodes)
+
+# Results are streamed to one dataset for the run, from which the text outputs are exported at the end
+results_dataset = result_store.open_dataset(os.path.join(output_dir, "results.npz"), {
+    "script": "find_multi_motifs.py",
+    "config": config,
+    "max_isl_length": max_isl_length,
+    "created": datetime.datetime.now().isoformat(),
+    "input_digest": input_digest,
+    "inputs": [satPositionsFile, validISLFile, cityCoverageFile, cityPositionsFile, cityPairFile],
+    "prune": prune_motifs,
+    "sample_size": args.sample_size,
+    "sample_seed": args.sample_seed,
+    "zone_search": args.zones is not None,
+    "configurations": [{
+        "boundaries": boundaries,
+        "dir": "" if args.zones is None else "zones_" + result_store.get_node_name(boundaries)
+    } for boundaries in configurations]
+})
+
+# Workers are forked once after the inputs are read, so every worker shares them and pulls motifs as it frees up;
+# only the ISLs fixed for the lower zones travel with each task
+pool = multiprocessing.get_context("fork").Pool(CORE_CNT)
+# For each latitude zone, run the motif routine on every distinct prefix of the configurations, building on the
+# graph of the lower zones
+zone_nodes = {}
+for l in range(num_zones):
+    nodes = []
+    for prefix in get_zone_nodes(configurations, l):
+        nodes.append({
+            "zone": l,
+            "level": prefix[l],
+            "next_level": prefix[l + 1],
+            "name": result_store.get_node_name(prefix),
+            "base_graph": G if l == 0 else zone_nodes[prefix[:-1]]["graph"]
+        })
+        zone_nodes[prefix] = nodes[-1]
+    evaluate_zone_nodes(nodes)
+pool.close()
+pool.join()
+
+baseline_metric = regenerate_baseline(baseline_config_file)
+for boundaries in configurations:
+    append_configuration_edges(boundaries)
+dataset = result_store.close_dataset(results_dataset, {"baseline_wMetric": baseline_metric["wMetric"]})
+ranking = result_store.export_multi_motif(dataset, output_dir)
+if args.zones is None:
+    best_motif_metric, name, reduction = ranking[0]
+    print(baseline_metric["wMetric"], best_motif_metric, reduction)
+else:
+    print("best zone configuration:", min(ranking)[1], ",", min(ranking)[0], ", baseline:", baseline_metric["wMetric"])
+cache_writer.close()
+if profile_writer is not None:
+    profile_writer.close()
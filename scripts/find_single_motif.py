@@ -20,17 +20,31 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
 import math
 import networkx as nx
-from multiprocessing import Process
 import multiprocessing
 import datetime
-import sys
+import time
 
 try:
     from . import util
+    from . import metric
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+    from . import result_cache
+    from . import profiling
+    from . import result_store
 except (ImportError, SystemError):
     import util
+    import metric
+    import csr_graph
+    import geometry
+    import loader
+    import result_cache
+    import profiling
+    import result_store
 
 EARTH_RADIUS = 6371  # km
 
@@ -39,7 +53,16 @@ sat_positions = {}
 city_positions = {}
 city_coverage = {}
 city_pairs = {}
+city_pair_groups = {}
+city_coverage_index = {}
 valid_isls = {}
+orbit_slot_index = {}
+sat_cartesian = None
+prune_motifs = False
+matrix_metric = False
+astar_metric = False
+pair_bounds = None
+best_metric_bound = None
 
 
 def read_sat_positions(sat_pos_file):
@@ -49,20 +72,23 @@ def read_sat_positions(sat_pos_file):
     """
     global G
     global sat_positions
+    global orbit_slot_index
+    global sat_cartesian
     sat_positions = {}
-    lines = [line.rstrip('\n') for line in open(sat_pos_file)]
-    for i in range(len(lines)):
-        val = lines[i].split(",")
-        sat_positions[int(val[0])] = {
-            "orb_id": int(val[1]),
-            "orb_sat_id": int(val[2]),
-            "lat_deg": float(val[3]),
-            "lat_rad": math.radians(float(val[3])),
-            "long_deg": float(val[4]),
-            "long_rad": math.radians(float(val[4])),
-            "alt_km": float(val[5])
+    positions = loader.load_sat_positions(sat_pos_file)
+    for sat_id, orb_id, orb_sat_id, lat_deg, long_deg, alt_km in positions.tolist():
+        sat_positions[sat_id] = {
+            "orb_id": orb_id,
+            "orb_sat_id": orb_sat_id,
+            "lat_deg": lat_deg,
+            "lat_rad": math.radians(lat_deg),
+            "long_deg": long_deg,
+            "long_rad": math.radians(long_deg),
+            "alt_km": alt_km
         }
-        G.add_node(int(val[0]))
+        G.add_node(sat_id)
+    orbit_slot_index = util.build_orbit_slot_index(sat_positions, NUM_ORBITS, NUM_SATS_PER_ORBIT)
+    sat_cartesian = geometry.get_sat_cartesian(positions)
 
 
 def find_motif_possibilities():
@@ -114,6 +140,16 @@ def find_motif_possibilities():
     return motif_possibilities
 
 
+def get_motif_candidates(motif):
+    """
+    Lists the ISLs induced by a motif, in the order they are added to the graph
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :return: List of (satellite, neighbor satellite) pairs
+    """
+    sat_1, sat_2 = util.get_motif_neighbor_pairs(orbit_slot_index, motif)
+    return list(zip(sat_1.tolist(), sat_2.tolist()))
+
+
 def add_motif_links_to_graph(grph, motif):
     """
     Adds ISLs to graph based on the current motif
@@ -121,105 +157,126 @@ def add_motif_links_to_graph(grph, motif):
     :param motif: Motif containing the relative positions of the neighboring satellites
     :return: returns the updated graph
     """
-    for i in sat_positions:
-        sel_sat_id = util.get_neighbor_satellite(sat_positions[i]["orb_id"], sat_positions[i]["orb_sat_id"],
-                                                 motif["sat_1_orb_offset"], motif["sat_1_sat_offset"], sat_positions,
-                                                 NUM_ORBITS, NUM_SATS_PER_ORBIT)
+    candidates = get_motif_candidates(motif)
+    lengths = geometry.get_pair_distances(sat_cartesian, [c[0] for c in candidates], [c[1] for c in candidates])
+    for (i, sel_sat_id), dist in zip(candidates, lengths.tolist()):
         is_possible = util.check_edge_availability(grph, i, sel_sat_id)
         if is_possible:
-            dist = util.compute_isl_length(i, sel_sat_id, sat_positions)
-            grph.add_edge(i, sel_sat_id, length=dist)
-        sel_sat_id = util.get_neighbor_satellite(sat_positions[i]["orb_id"], sat_positions[i]["orb_sat_id"],
-                                                 motif["sat_2_orb_offset"], motif["sat_2_sat_offset"], sat_positions,
-                                                 NUM_ORBITS, NUM_SATS_PER_ORBIT)
-        is_possible = util.check_edge_availability(grph, i, sel_sat_id)
-        if is_possible:
-            dist = util.compute_isl_length(i, sel_sat_id, sat_positions)
             grph.add_edge(i, sel_sat_id, length=dist)
     print("total edges", grph.number_of_edges())
     return grph
 
 
-def compute_metric_avoid_city(grph):
+def build_motif_graph(motif):
+    """
+    Builds the CSR satellite graph for a motif
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :return: CSR graph
+    """
+    isls = csr_graph.extend_isls(csr_graph.empty_isls(), get_motif_candidates(motif), sat_cartesian,
+                                 len(sat_positions))
+    print("total edges", len(isls["length"]))
+    return csr_graph.build_csr_graph(len(sat_positions), isls)
+
+
+def get_best_metric():
+    """
+    Gets the best wMetric found so far, shared by all workers
+    :return: Best wMetric (infinity if none yet)
+    """
+    return best_metric_bound.value
+
+
+def update_best_metric(wMetric):
+    """
+    Lowers the shared best wMetric
+    :param wMetric: Metric of a fully evaluated motif
+    """
+    with best_metric_bound.get_lock():
+        if wMetric < best_metric_bound.value:
+            best_metric_bound.value = wMetric
+
+
+def get_engine():
+    """
+    Names the engine computing the metric, which is part of the cache keys (see result_cache.get_engine_description)
+    :return: "matrix", "astar" or "search" (also used by --prune)
+    """
+    if matrix_metric:
+        return "matrix"
+    if astar_metric:
+        return "astar"
+    return result_cache.REFERENCE_ENGINE
+
+
+def compute_metric_avoid_city(graph, prune=False, stage_times=None):
     """
     Computes city-pair wise stretch and hop count and the aggregate metric values
-    :param grph: The graph with satellites and cities as nodes
-    :return: Computed aggregated metric
+    :param graph: CSR graph of the satellite network
+    :param prune: Whether to abandon the evaluation once the metric provably exceeds the best one
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric ("pruned" set if abandoned)
     """
-    weightSum = 0
-    weightedStretchSum = 0
-    weightedHopCountSum = 0
     a = datetime.datetime.now()
-    for i in range(len(city_pairs)):
-        city1 = city_pairs[i]["city_1"]
-        city2 = city_pairs[i]["city_2"]
-        geoDist = city_pairs[i]["geo_dist"]
-        try:
-            util.add_coverage_for_city(grph, city1, city_coverage)
-            util.add_coverage_for_city(grph, city2, city_coverage)
-            distance = nx.shortest_path_length(grph, source=city1, target=city2, weight='length')
-            path = nx.shortest_path(grph, source=city1, target=city2, weight='length')
-
-            hops = path.__len__() - 1
-            stretch = distance / geoDist
-
-            weight = city_positions[city1]["pop"] * city_positions[city2]["pop"] / 10000000
-            weightSum += weight
-            weightedStretchSum += stretch * weight
-            weightedHopCountSum += hops * weight
-
-            util.remove_coverage_for_city(grph, city1, city_coverage)
-            util.remove_coverage_for_city(grph, city2, city_coverage)
-        except Exception as e:
-            util.remove_coverage_for_city(grph, city1, city_coverage)
-            util.remove_coverage_for_city(grph, city2, city_coverage)
-            return_val = {
-                "avgWeightedStretch": 99999.0,
-                "avgWeightedHopCount": 99999.0,
-                "wMetric": 99999.0
-            }
-            return return_val
-    avgWeightedStretch = weightedStretchSum / weightSum
-    avgWeightedHopCount = weightedHopCountSum / weightSum
-    wMetric = avgWeightedStretch + avgWeightedHopCount
+    if prune:
+        return_val = metric.compute_metric_avoid_city_bounded(graph, city_pairs, city_positions, city_coverage_index,
+                                                              city_pair_groups, pair_bounds, get_best_metric,
+                                                              stage_times)
+    elif matrix_metric:
+        return_val = metric.compute_metric_avoid_city_matrix(graph, city_pairs, city_positions, city_coverage_index,
+                                                             city_pair_groups, stage_times)
+    elif astar_metric:
+        return_val = metric.compute_metric_avoid_city_astar(graph, city_pairs, city_positions, city_coverage_index,
+                                                            sat_cartesian, stage_times)
+    else:
+        return_val = metric.compute_metric_avoid_city(graph, city_pairs, city_positions, city_coverage_index,
+                                                      city_pair_groups, stage_times)
+    avgWeightedStretch = return_val["avgWeightedStretch"]
+    avgWeightedHopCount = return_val["avgWeightedHopCount"]
 
     b = datetime.datetime.now() - a
-    print("time to compute metric:", b.seconds, ", avgWeightedStretch:", avgWeightedStretch, ", avgWeightedHopCount:",
-          avgWeightedHopCount)
-
-    return_val = {
-        "avgWeightedStretch": avgWeightedStretch,
-        "avgWeightedHopCount": avgWeightedHopCount,
-        "wMetric": wMetric
-    }
+    if "expandedSatellites" in return_val:
+        print("satellites expanded by A*:", return_val["expandedSatellites"], ", settled by the per-source search:",
+              return_val["searchSettledSatellites"])
+    if return_val.get("pruned"):
+        print("time to compute metric:", b.seconds, ", pruned with wMetric lower bound:", return_val["wMetric"])
+    else:
+        print("time to compute metric:", b.seconds, ", avgWeightedStretch:", avgWeightedStretch,
+              ", avgWeightedHopCount:", avgWeightedHopCount)
+
     return return_val
 
 
-def write_edges_to_file(grph, writer):
+def run_motif_analysis(task):
     """
-    Writes the edges of a graph to a file
-    :param grph: The graph under consideration
-    :param writer: Writer corresponding to output file
+    Runs motif analysis for individual motifs inside a pool worker
+    :param task: Tuple of motif group, motif and submission time
+    :return: Tuple of motif group, computed aggregated metric and profiling record
     """
-    edges = grph.edges(data=True)
-    for edge in edges:
-        writer.write(str(edge[0]) + "," + str(edge[1]) + "\n")
-
-
-def run_motif_analysis(grph, motif_cnt, motif, return_dict):
+    motif_group, motif, submitted = task
+    record = profiling.start_record(submitted, {
+        "motif": [motif["sat_1_orb_offset"], motif["sat_1_sat_offset"], motif["sat_2_orb_offset"],
+                  motif["sat_2_sat_offset"]]
+    })
+    print("Generating graph for motif:", motif["sat_1_id"], ",", motif["sat_2_id"])
+    t = time.perf_counter()
+    graph = build_motif_graph(motif)
+    profiling.add_stage_time(record["stages"], "graph_build", t)
+    retVal = compute_metric_avoid_city(graph, prune_motifs, record["stages"])
+    if prune_motifs and not retVal.get("pruned"):
+        update_best_metric(retVal["wMetric"])
+    return motif_group, retVal, profiling.finish_record(record, retVal.get("numPairs", len(city_pairs)), retVal)
+
+
+def set_motif_result(motif, result):
     """
-    Runs motif analysis for individual motifs
-    :param grph: The graph under consideration
-    :param motif_cnt: Motif counter
-    :param motif: Motif
-    :param return_dict: The return values
+    Stores the aggregated metric values of a motif
+    :param motif: Motif to update
+    :param result: Aggregated metric values
     """
-    grph = add_motif_links_to_graph(grph, motif)
-    retVal = compute_metric_avoid_city(grph)
-    motif["wMetric"] = retVal["wMetric"]
-    motif["wStretch"] = retVal["avgWeightedStretch"]
-    motif["wHop"] = retVal["avgWeightedHopCount"]
-    return_dict[motif_cnt] = motif
+    motif["wMetric"] = result["wMetric"]
+    motif["wStretch"] = result["avgWeightedStretch"]
+    motif["wHop"] = result["avgWeightedHopCount"]
 
 
 # =====================================================================
@@ -235,14 +292,32 @@ cityPairFile = "../input_data/data_cities/city_pairs_rand_5K.txt"
 NUM_ORBITS = 40
 NUM_SATS_PER_ORBIT = 40
 
-CORE_CNT = int(sys.argv[1])
-
-# =====================================================================
-# OUTPUTS
-# =====================================================================
-
-writer_level_motif_metrics = open("../output_data_generated/single_motif/level_0_motif_metrics.txt", 'a+')
-writer_level_best_motif = open("../output_data_generated/single_motif/level_0_best_motif.txt", 'a+')
+parser = argparse.ArgumentParser(description="Evaluate all single motifs of the 40x40 53deg constellation")
+parser.add_argument("cores", type=int, help="Number of cores assigned to the routine")
+parser.add_argument("--prune", action="store_true",
+                    help="Abandon motifs as soon as they provably lose against the best one; they are listed in "
+                         "level_0_pruned_motifs.txt instead of level_0_motif_metrics.txt")
+parser.add_argument("--matrix", action="store_true",
+                    help="Evaluate motifs in two stages: shortest paths between the satellites covering the cities, "
+                         "then the best up-link, path and down-link combination of every city pair; faster when "
+                         "there are fewer such satellites than source cities (metric.compute_metric_avoid_city_matrix)")
+parser.add_argument("--astar", action="store_true",
+                    help="Evaluate motifs with one A* search per city pair, guided by the straight line distance to "
+                         "the destination; same results, fewer expanded satellites "
+                         "(metric.compute_metric_avoid_city_astar)")
+parser.add_argument("--profile-log",
+                    help="Append one JSON line per evaluated motif to this file, with its worker, queue wait, time per "
+                         "stage (graph build, coverage attach, path search, aggregation) and pairs/s")
+args = parser.parse_args()
+if args.prune + args.matrix + args.astar > 1:
+    parser.error("--prune, --matrix and --astar are different ways to evaluate a motif, choose one")
+
+CORE_CNT = args.cores
+prune_motifs = args.prune
+matrix_metric = args.matrix
+astar_metric = args.astar
+
+output_dir = "../output_data_generated/single_motif"
 
 # =====================================================================
 # READING INPUTS
@@ -253,6 +328,30 @@ valid_isls = util.read_valid_isls(validISLFile)
 city_positions, G = util.read_city_positions(cityPositionsFile, G)
 city_coverage = util.read_city_coverage(cityCoverageFile)
 city_pairs = util.read_city_pair_file(cityPairFile)
+city_pair_groups = metric.group_city_pairs_by_source(city_pairs)
+city_coverage_index = util.build_city_coverage_index(city_coverage)
+
+# Results of motifs evaluated by earlier (possibly interrupted) runs on the same inputs are reused
+input_digest = result_cache.get_input_digest([satPositionsFile, cityCoverageFile, cityPositionsFile, cityPairFile])
+cached_results = result_cache.load_results(result_cache.DEFAULT_CACHE_FILE)
+cache_writer = result_cache.open_results(result_cache.DEFAULT_CACHE_FILE)
+profile_writer = profiling.open_log(args.profile_log)
+
+# Motif independent lower bounds of every pair, used to abandon losing motifs early
+if prune_motifs:
+    pair_bounds = metric.get_pair_lower_bounds(city_pairs, city_coverage_index, sat_cartesian)
+best_metric_bound = multiprocessing.get_context("fork").Value("d", float("inf"))
+
+# Results are streamed to one dataset for the run, from which the text outputs are exported at the end
+results_dataset = result_store.open_dataset(output_dir + "/results.npz", {
+    "script": "find_single_motif.py",
+    "config": "40_40_53deg",
+    "max_isl_length": "5014",
+    "created": datetime.datetime.now().isoformat(),
+    "input_digest": input_digest,
+    "inputs": [satPositionsFile, validISLFile, cityCoverageFile, cityPositionsFile, cityPairFile],
+    "prune": prune_motifs
+})
 
 # =====================================================================
 # SINGLE MOTIF ROUTINE STARTS
@@ -262,48 +361,62 @@ city_pairs = util.read_city_pair_file(cityPairFile)
 valid_motif_possibilities = find_motif_possibilities()
 
 # For each motif compute metrics
-for i in range(0, len(valid_motif_possibilities), CORE_CNT):
-    threads = []
-    manager = multiprocessing.Manager()
-    return_dict = manager.dict()
-
-    # Parallelize metric computation based on available cores
-    for j in range(0, CORE_CNT):
-        id = i + j
-        if id < len(valid_motif_possibilities):
-            print("Generating graph for motif:", valid_motif_possibilities[id]["sat_1_id"], ",",
-                  valid_motif_possibilities[id]["sat_2_id"])
-            p = Process(target=run_motif_analysis,
-                        args=(G.copy(), id, valid_motif_possibilities[id], return_dict))
-            threads.append(p)
-    for x in threads:
-        x.start()
-    for x in threads:
-        x.join()
-
-    for value in return_dict.values():
-        valid_motif_possibilities[value["motif_cnt"]]["wMetric"] = value["wMetric"]
-        valid_motif_possibilities[value["motif_cnt"]]["wStretch"] = value["wStretch"]
-        valid_motif_possibilities[value["motif_cnt"]]["wHop"] = value["wHop"]
+# Workers are forked once after the inputs are read, so every worker shares them and pulls motifs as it frees up
+# Every result is persisted as soon as it arrives
+pool = multiprocessing.get_context("fork").Pool(CORE_CNT)
+empty_isls_digest = result_cache.get_isls_digest(csr_graph.empty_isls())
+motif_keys = [result_cache.get_motif_key(input_digest, empty_isls_digest, None, valid_motif_possibilities[cnt],
+                                         get_engine())
+              for cnt in range(len(valid_motif_possibilities))]
+# Motifs inducing the same ISLs are evaluated once and the result is fanned back to all of them
+groups = {}
+for cnt in range(len(valid_motif_possibilities)):
+    if motif_keys[cnt] in cached_results:
+        set_motif_result(valid_motif_possibilities[cnt], cached_results[motif_keys[cnt]])
+        best_metric_bound.value = min(best_metric_bound.value, valid_motif_possibilities[cnt]["wMetric"])
+    else:
+        isls = csr_graph.extend_isls(csr_graph.empty_isls(), get_motif_candidates(valid_motif_possibilities[cnt]),
+                                     sat_cartesian, len(sat_positions))
+        groups.setdefault(result_cache.get_topology_digest(isls), []).append(cnt)
+groups = list(groups.values())
+tasks = [(motif_group, valid_motif_possibilities[groups[motif_group][0]], time.time())
+         for motif_group in range(len(groups))]
+print("motifs taken from cache:", len(valid_motif_possibilities) - sum(len(group) for group in groups),
+      ", distinct topologies to evaluate:", len(groups))
+pruned_motifs = {}
+motif_records = {}
+progress = profiling.start_progress("single motif", len(tasks))
+for motif_group, result, record in pool.imap_unordered(run_motif_analysis, tasks):
+    profiling.update_progress(progress, record, profile_writer)
+    for motif_cnt in groups[motif_group]:
+        motif_records[motif_cnt] = [record]
+        if result.get("pruned"):
+            # Pruned motifs keep their lower bound, which exceeds the best metric, and are not cached
+            valid_motif_possibilities[motif_cnt]["wMetric"] = result["wMetric"]
+            pruned_motifs[motif_cnt] = result["wMetric"]
+            continue
+        set_motif_result(valid_motif_possibilities[motif_cnt], result)
+        result_cache.append_result(cache_writer, motif_keys[motif_cnt], result)
+pool.close()
+pool.join()
+profiling.print_worker_summary(progress)
+cache_writer.close()
+if profile_writer is not None:
+    profile_writer.close()
 
 # Get the best motif based on the aggregated metric value
 best_motif = util.get_best_motif_at_level(valid_motif_possibilities)
-
-# Print motif-metric mappings to output file
-for cnt in range(len(valid_motif_possibilities)):
-    try:
-        writer_level_motif_metrics.write(str(cnt)
-                                         + "," + str(valid_motif_possibilities[cnt]["sat_1_id"])
-                                         + "," + str(valid_motif_possibilities[cnt]["sat_2_id"])
-                                         + "," + str(valid_motif_possibilities[cnt]["wStretch"])
-                                         + "," + str(valid_motif_possibilities[cnt]["wHop"])
-                                         + "\n")
-    except Exception as e:
-        print(valid_motif_possibilities[cnt])
-
-writer_level_motif_metrics.close()
-
-# Print ISLs corresponding to the best motif
+run_motifs = set(group[0] for group in groups)
+result_store.append_rows(results_dataset, "motifs", [
+    result_store.get_motif_row("", 0, None, None, valid_motif_possibilities[cnt],
+                               "pruned" if cnt in pruned_motifs else "evaluated" if cnt in motif_records else "cached",
+                               valid_motif_possibilities[cnt] is best_motif,
+                               cnt in motif_records and cnt not in run_motifs, motif_records.get(cnt))
+    for cnt in range(len(valid_motif_possibilities))])
+
+# ISLs corresponding to the best motif
 G = add_motif_links_to_graph(G, best_motif)
-write_edges_to_file(G, writer_level_best_motif)
-writer_level_best_motif.close()
+result_store.append_rows(results_dataset, "edges", result_store.get_edge_rows(G, "", "level_0"))
+
+dataset = result_store.close_dataset(results_dataset)
+result_store.export_single_motif(dataset, output_dir)
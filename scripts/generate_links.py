@@ -0,0 +1,288 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Generates the valid ISL and city coverage inputs of a constellation from its satellite positions:
+#   <constellation_dir>/data_validISLs_<max_isl_length>/valid_ISLs_<t>.txt
+#   <constellation_dir>/data_coverage/city_coverage_<t>.txt
+# Candidate pairs come from a cell grid over Cartesian coordinates (see geometry.find_pairs_within_distance),
+# so large shells are handled without all-pairs distance matrices.
+#
+# The link models are calibrated on the shipped t=0 files, which they reproduce for all three constellations:
+#   - valid ISLs are all satellite pairs up to the maximum ISL length apart, with satellites placed at EARTH_RADIUS
+#     plus the integer part of their altitude. The shipped files keep ISLs that graze the atmosphere (down to 76 km
+#     for kuiper_p1 at 5440 km), so the line of sight check only runs with --grazing-altitude.
+#   - a city is covered by every satellite whose sub-satellite point is within the coverage radius (great circle on
+#     EARTH_RADIUS), and the link length is the hypotenuse of that ground distance and the satellite altitude. The
+#     shipped links follow no elevation angle, the radii in SHIPPED_COVERAGE_RADIUS are fitted to them.
+# New shells can instead be covered by elevation angle (--min-elevation): a city is covered by every satellite at or
+# above the minimum elevation, and the link length is the straight line between them.
+# --check compares the generated links with the existing files instead of overwriting them.
+#
+# Example (new max ISL length for the 40x40 53deg constellation at t=0):
+#   python3 generate_links.py ../input_data/constellation_40_40_53deg 3000
+# Example (new shell covered above 25 degrees elevation):
+#   python3 generate_links.py ../output_data_generated/constellation_new 2000 --min-elevation 25
+# Example (verify the shipped inputs):
+#   python3 generate_links.py ../input_data/constellation_40_40_53deg 1467 --check
+
+import argparse
+import math
+import multiprocessing
+import os
+import numpy as np
+
+try:
+    from . import geometry
+    from . import loader
+except (ImportError, SystemError):
+    import geometry
+    import loader
+
+# Coverage radius (km) of the shipped city_coverage_0.txt files. Each value lies between the farthest shipped link
+# and the closest sub-satellite point left out (940.565 and 940.703 km for the 53deg shells, 1730.894 and
+# 1730.920 km for kuiper_p1).
+SHIPPED_COVERAGE_RADIUS = {
+    "40_40_53deg": 940.63,
+    "kuiper_p1": 1730.91,
+    "starlink_p1": 940.63
+}
+CHECK_TOLERANCE = 1e-6  # km, largest length difference --check accepts
+
+
+def get_constellation_name(constellation_dir):
+    """
+    Gets the constellation name from an input_data directory
+    :param constellation_dir: e.g. ../input_data/constellation_40_40_53deg
+    :return: e.g. 40_40_53deg
+    """
+    name = os.path.basename(os.path.normpath(constellation_dir))
+    prefix = "constellation_"
+    return name[len(prefix):] if name.startswith(prefix) else name
+
+
+def get_isl_cartesian(sat_positions):
+    """
+    Converts satellite positions to the Cartesian coordinates of the shipped ISL lengths, which place every
+    satellite at the integer part of its altitude
+    :param sat_positions: Structured array of loader.SAT_POSITION_DTYPE
+    :return: Array with one x, y, z row per satellite id
+    """
+    points = np.zeros((int(np.max(sat_positions["sat_id"])) + 1, 3))
+    points[sat_positions["sat_id"]] = geometry.get_cartesian_array(sat_positions["lat_deg"], sat_positions["long_deg"],
+                                                                   np.floor(sat_positions["alt_km"]))
+    return points
+
+
+def compute_valid_isls(sat_positions, max_isl_length, grazing_altitude=None):
+    """
+    Computes all satellite pairs closer than the maximum ISL length
+    :param sat_positions: Structured array of loader.SAT_POSITION_DTYPE
+    :param max_isl_length: Maximum ISL length in km
+    :param grazing_altitude: Lowest altitude an ISL may pass through in km (None to keep all, as the shipped files)
+    :return: Structured array of loader.VALID_ISL_DTYPE sorted by satellite 1 then satellite 2
+    """
+    points = get_isl_cartesian(sat_positions)
+    index_1, index_2, dist = geometry.find_pairs_within_distance(points, None, max_isl_length)
+    if grazing_altitude is not None:
+        visible = geometry.get_pair_line_of_sight(points, index_1, index_2, grazing_altitude)
+        index_1, index_2, dist = index_1[visible], index_2[visible], dist[visible]
+    valid_isls = np.zeros(len(dist), dtype=loader.VALID_ISL_DTYPE)
+    valid_isls["sat_1"] = index_1
+    valid_isls["sat_2"] = index_2
+    valid_isls["dist_km"] = dist
+    return np.sort(valid_isls, order=["sat_1", "sat_2"])
+
+
+def compute_city_coverage(city_positions, sat_positions, coverage_radius):
+    """
+    Computes all city-satellite links with the sub-satellite point within the coverage radius of the city
+    :param city_positions: Structured array of loader.CITY_POSITION_DTYPE
+    :param sat_positions: Structured array of loader.SAT_POSITION_DTYPE
+    :param coverage_radius: Largest great circle distance in km between a city and a sub-satellite point
+    :return: Structured array of loader.CITY_COVERAGE_DTYPE sorted by city then satellite
+    """
+    city_points = geometry.get_city_cartesian(city_positions)
+    ground_points = geometry.get_cartesian_array(sat_positions["lat_deg"], sat_positions["long_deg"], 0.0)
+    # Candidates by chord, with a margin so rounding cannot drop a pair right at the radius
+    max_chord = 2 * geometry.EARTH_RADIUS * math.sin(min(coverage_radius / (2 * geometry.EARTH_RADIUS), math.pi / 2))
+    index_1, index_2, _ = geometry.find_pairs_within_distance(city_points, ground_points, max_chord + 1e-6)
+    ground_dist = geometry.get_great_circle_distances(city_positions["lat_deg"][index_1],
+                                                      city_positions["long_deg"][index_1],
+                                                      sat_positions["lat_deg"][index_2],
+                                                      sat_positions["long_deg"][index_2], geometry.EARTH_RADIUS)
+    covered = ground_dist <= coverage_radius
+    index_1, index_2, ground_dist = index_1[covered], index_2[covered], ground_dist[covered]
+    alt = sat_positions["alt_km"][index_2]
+    city_coverage = np.zeros(len(ground_dist), dtype=loader.CITY_COVERAGE_DTYPE)
+    city_coverage["city"] = city_positions["city"][index_1]
+    city_coverage["sat"] = sat_positions["sat_id"][index_2]
+    city_coverage["dist"] = np.sqrt(ground_dist * ground_dist + alt * alt)
+    return np.sort(city_coverage, order=["city", "sat"])
+
+
+def get_max_slant_range(altitude_km, min_elevation):
+    """
+    Longest ground-to-satellite distance at which a satellite is above the minimum elevation angle
+    :param altitude_km: Satellite altitude in km
+    :param min_elevation: Minimum elevation angle in degrees
+    :return: Slant range in km
+    """
+    elevation = math.radians(min_elevation)
+    radius = geometry.EARTH_RADIUS
+    return math.sqrt((radius + altitude_km) ** 2 - (radius * math.cos(elevation)) ** 2) - radius * math.sin(elevation)
+
+
+def compute_city_coverage_by_elevation(city_positions, sat_positions, min_elevation):
+    """
+    Computes all city-satellite links with the satellite at or above the minimum elevation angle
+    :param city_positions: Structured array of loader.CITY_POSITION_DTYPE
+    :param sat_positions: Structured array of loader.SAT_POSITION_DTYPE
+    :param min_elevation: Minimum elevation angle in degrees
+    :return: Structured array of loader.CITY_COVERAGE_DTYPE sorted by city then satellite
+    """
+    city_points = geometry.get_city_cartesian(city_positions)
+    sat_points = geometry.get_cartesian_array(sat_positions["lat_deg"], sat_positions["long_deg"],
+                                              sat_positions["alt_km"])
+    max_range = get_max_slant_range(float(np.max(sat_positions["alt_km"])), min_elevation)
+    index_1, index_2, dist = geometry.find_pairs_within_distance(city_points, sat_points, max_range)
+    visible = geometry.get_pair_elevation_angles(city_points, index_1, sat_points, index_2) >= min_elevation
+    city_coverage = np.zeros(int(visible.sum()), dtype=loader.CITY_COVERAGE_DTYPE)
+    city_coverage["city"] = city_positions["city"][index_1[visible]]
+    city_coverage["sat"] = sat_positions["sat_id"][index_2[visible]]
+    city_coverage["dist"] = dist[visible]
+    return np.sort(city_coverage, order=["city", "sat"])
+
+
+def compare_links(generated, existing, end_1, end_2, dist_field):
+    """
+    Compares generated links with the links of an existing file
+    :param generated: Structured array of generated links
+    :param existing: Structured array loaded from the file
+    :param end_1: Field of the first end point
+    :param end_2: Field of the second end point
+    :param dist_field: Field of the link length
+    :return: Number of links only generated, number of links only in the file and largest length difference in km
+             between common links
+    """
+    generated_dist = dict(zip(zip(generated[end_1].tolist(), generated[end_2].tolist()),
+                              generated[dist_field].tolist()))
+    existing_dist = dict(zip(zip(existing[end_1].tolist(), existing[end_2].tolist()), existing[dist_field].tolist()))
+    common = generated_dist.keys() & existing_dist.keys()
+    max_diff = max([abs(generated_dist[link] - existing_dist[link]) for link in common], default=0.0)
+    return len(generated_dist) - len(common), len(existing_dist) - len(common), max_diff
+
+
+def write_rows(rows, file_name):
+    """
+    Writes a structured array as comma separated lines in the input_data format
+    :param rows: Structured array
+    :param file_name: Output file
+    """
+    with open(file_name, "w") as writer:
+        for row in rows.tolist():
+            writer.write(",".join(str(value) for value in row) + "\n")
+
+
+def generate_time_step(args):
+    """
+    Generates the valid ISL and city coverage files for one time step (pool worker)
+    :param args: Tuple of constellation directory, time step, max ISL length, coverage radius (None to cover by
+                 elevation), minimum elevation angle, grazing altitude, city file and whether to compare with the
+                 existing files instead of writing them
+    :return: Time step, number of valid ISLs, number of city-satellite links and the differences from the existing
+             files (None unless comparing), see compare_links
+    """
+    constellation_dir, t, max_isl_length, coverage_radius, min_elevation, grazing_altitude, city_file, check = args
+    sat_positions = loader.load_sat_positions(
+        os.path.join(constellation_dir, "data_sat_position", "sat_positions_" + str(t) + ".txt"))
+    isl_dir = os.path.join(constellation_dir, "data_validISLs_" + max_isl_length)
+    coverage_dir = os.path.join(constellation_dir, "data_coverage")
+    isl_file = os.path.join(isl_dir, "valid_ISLs_" + str(t) + ".txt")
+    coverage_file = os.path.join(coverage_dir, "city_coverage_" + str(t) + ".txt")
+    valid_isls = compute_valid_isls(sat_positions, float(max_isl_length), grazing_altitude)
+    city_positions = loader.load_city_positions(city_file)
+    if coverage_radius is None:
+        city_coverage = compute_city_coverage_by_elevation(city_positions, sat_positions, min_elevation)
+    else:
+        city_coverage = compute_city_coverage(city_positions, sat_positions, coverage_radius)
+    if check:
+        differences = (compare_links(valid_isls, loader.load_valid_isls(isl_file), "sat_1", "sat_2", "dist_km"),
+                       compare_links(city_coverage, loader.load_city_coverage(coverage_file), "city", "sat", "dist"))
+        return t, len(valid_isls), len(city_coverage), differences
+    for directory in (isl_dir, coverage_dir):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    write_rows(valid_isls, isl_file)
+    write_rows(city_coverage, coverage_file)
+    return t, len(valid_isls), len(city_coverage), None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate valid ISLs and city coverage from satellite positions")
+    parser.add_argument("constellation_dir", help="e.g. ../input_data/constellation_40_40_53deg")
+    parser.add_argument("max_isl_length", help="Maximum ISL length in km, also used in the output directory name")
+    parser.add_argument("--times", type=int, nargs="+", default=[0], help="Time steps of the snapshots")
+    parser.add_argument("--coverage-radius", type=float,
+                        help="Largest great circle distance in km between a city and the sub-satellite point of a "
+                             "satellite covering it (default for shipped constellations: "
+                             + ", ".join(name + " " + str(radius)
+                                         for name, radius in sorted(SHIPPED_COVERAGE_RADIUS.items())) + ")")
+    parser.add_argument("--min-elevation", type=float,
+                        help="Cover cities by every satellite at or above this elevation angle in degrees instead "
+                             "of by coverage radius")
+    parser.add_argument("--grazing-altitude", type=float,
+                        help="Lowest altitude in km an ISL may pass through (no check by default)")
+    parser.add_argument("--cities", default="../input_data/data_cities/cities.txt")
+    parser.add_argument("--check", action="store_true",
+                        help="Compare with the existing files of the time steps instead of writing them")
+    parser.add_argument("--cores", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.coverage_radius is not None and args.min_elevation is not None:
+        parser.error("--coverage-radius and --min-elevation are alternative coverage models")
+    coverage_radius = args.coverage_radius
+    if coverage_radius is None and args.min_elevation is None:
+        coverage_radius = SHIPPED_COVERAGE_RADIUS.get(get_constellation_name(args.constellation_dir))
+        if coverage_radius is None:
+            parser.error("--coverage-radius or --min-elevation is required for constellations other than "
+                         + ", ".join(sorted(SHIPPED_COVERAGE_RADIUS.keys())))
+
+    tasks = [(args.constellation_dir, t, args.max_isl_length, coverage_radius, args.min_elevation,
+              args.grazing_altitude, args.cities, args.check) for t in args.times]
+    if args.cores <= 1:
+        results = [generate_time_step(task) for task in tasks]
+    else:
+        pool = multiprocessing.get_context("fork").Pool(args.cores)
+        results = pool.map(generate_time_step, tasks)
+        pool.close()
+        pool.join()
+    mismatch = False
+    for t, num_isls, num_links, differences in results:
+        print("time", t, ": valid ISLs", num_isls, ", city-satellite links", num_links)
+        if differences is None:
+            continue
+        for name, (only_generated, only_existing, max_diff) in zip(("valid ISLs", "city coverage"), differences):
+            print("  ", name, ": only generated", only_generated, ", only in file", only_existing,
+                  ", largest length difference (km)", max_diff)
+            mismatch = mismatch or only_generated > 0 or only_existing > 0 or max_diff > CHECK_TOLERANCE
+    if mismatch:
+        raise SystemExit("generated links differ from the existing files")
@@ -0,0 +1,229 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Generates satellite positions for a whole constellation over a list of time steps in a single process.
+# This replaces driving get_sat_location.py once per satellite per time step from 02_get_sat_positions_at_time.sh.
+#
+# Example (40x40 53deg constellation, 2 hours at 1-minute resolution on 7 cores):
+#   python3 generate_sat_positions.py --constellation 40_40_53deg --num-steps 120 --cores 7 \
+#       --output-dir ../output_data_generated/sat_positions
+
+import argparse
+import math
+import multiprocessing
+import os
+import ephem
+import numpy as np
+
+try:
+    from . import loader
+except (ImportError, SystemError):
+    import loader
+
+EARTH_RADIUS = 6371  # km
+EARTH_MU = 398600.4418  # km^3/s^2
+SECONDS_PER_DAY = 86400.0
+
+DEFAULT_EPOCH = "2018/1/1 00:00:01"
+DEFAULT_MEAN_MOTION = 15.19  # 15.19 taken from Tintin A anb B TLEs
+
+# Parameters of the constellations shipped in input_data
+CONSTELLATIONS = {
+    "40_40_53deg": {"num_orbits": 40, "num_sats_per_orbit": 40, "inclination": 53.0,
+                    "mean_motion": DEFAULT_MEAN_MOTION},
+    "kuiper_p1": {"num_orbits": 34, "num_sats_per_orbit": 34, "inclination": 51.9, "mean_motion": 14.80},
+    "starlink_p1": {"num_orbits": 24, "num_sats_per_orbit": 66, "inclination": 53.0,
+                    "mean_motion": DEFAULT_MEAN_MOTION}
+}
+
+
+def truncate(value, decimals=2):
+    """
+    Truncates a value the way bc does with scale=2, so positions match the shell pipeline
+    :param value: Value to truncate
+    :param decimals: Number of decimals kept
+    :return: Truncated value
+    """
+    factor = 10 ** decimals
+    return math.trunc(value * factor) / factor
+
+
+def get_mean_motion(altitude_km):
+    """
+    Computes the mean motion of a circular orbit
+    :param altitude_km: Orbit altitude above the earth surface in km
+    :return: Mean motion in revolutions per day
+    """
+    semi_major_axis = EARTH_RADIUS + altitude_km
+    return math.sqrt(EARTH_MU / semi_major_axis ** 3) * SECONDS_PER_DAY / (2 * math.pi)
+
+
+def build_constellation(num_orbits, num_sats_per_orbit, inclination, mean_motion=DEFAULT_MEAN_MOTION,
+                        eccentricity=0.001, arg_of_perigee=0.0, phase_diff=True, epoch=DEFAULT_EPOCH):
+    """
+    Creates the satellites of a constellation from its orbital elements. Orbits are spread over 360 degrees of
+    right ascension and every alternate orbit is phase shifted by half the in-orbit spacing when phase_diff is set.
+    :param num_orbits: Number of orbits
+    :param num_sats_per_orbit: Number of satellites per orbit
+    :param inclination: Inclination in degrees
+    :param mean_motion: Mean motion in revolutions per day
+    :param eccentricity: Eccentricity (close to 0 for circular orbits)
+    :param arg_of_perigee: Argument of perigee
+    :param phase_diff: Whether neighboring satellites in adjacent orbits have a phase difference
+    :param epoch: Epoch of the orbital elements
+    :return: List of (satellite id, orbit id, slot in orbit, ephem satellite)
+    """
+    satellites = []
+    counter = 0
+    for num_orbit in range(num_orbits):
+        raan = truncate(num_orbit * 360 / num_orbits)
+        orbit_wise_shift = 0
+        if num_orbit % 2 == 1 and phase_diff:
+            orbit_wise_shift = truncate(360 / (num_sats_per_orbit * 2))
+        for num_sat_in_orbit in range(num_sats_per_orbit):
+            mean_anomaly = orbit_wise_shift + truncate(num_sat_in_orbit * 360 / num_sats_per_orbit)
+            sat = ephem.EarthSatellite()
+            sat._epoch = epoch
+            sat._inc = ephem.degrees(inclination)
+            sat._e = eccentricity
+            sat._raan = ephem.degrees(raan)
+            sat._ap = arg_of_perigee
+            sat._M = ephem.degrees(mean_anomaly)
+            sat._n = mean_motion
+            satellites.append((counter, num_orbit, num_sat_in_orbit, sat))
+            counter += 1
+    return satellites
+
+
+def compute_positions(satellites, time_min, epoch=DEFAULT_EPOCH):
+    """
+    Computes the positions of all satellites at a time step
+    :param satellites: Output of build_constellation
+    :param time_min: Minutes since the epoch
+    :param epoch: Epoch of the orbital elements
+    :return: Structured array of loader.SAT_POSITION_DTYPE
+    """
+    when = ephem.Date(ephem.Date(epoch) + time_min * ephem.minute)
+    positions = np.zeros(len(satellites), dtype=loader.SAT_POSITION_DTYPE)
+    for i, (sat_id, orb_id, orb_sat_id, sat) in enumerate(satellites):
+        sat.compute(when)
+        # Altitude is kept at the 6 significant digits the shell pipeline printed with awk
+        positions[i] = (sat_id, orb_id, orb_sat_id, math.degrees(sat.sublat), math.degrees(sat.sublong),
+                        float("%g" % (sat.elevation / 1000)))
+    return positions
+
+
+def write_positions(positions, sat_pos_file):
+    """
+    Writes satellite positions in the input_data format (id, orbit, slot, latitude, longitude, altitude in km)
+    and primes the loader cache with the array form
+    :param positions: Structured array of loader.SAT_POSITION_DTYPE
+    :param sat_pos_file: Output file
+    """
+    with open(sat_pos_file, "w") as writer:
+        for sat_id, orb_id, orb_sat_id, lat_deg, long_deg, alt_km in positions.tolist():
+            writer.write(str(sat_id) + "," + str(orb_id) + "," + str(orb_sat_id) + "," + str(lat_deg) + ","
+                         + str(long_deg) + "," + "%g" % alt_km + "\n")
+    loader.write_cache(sat_pos_file, loader.SAT_POSITION_DTYPE, positions)
+
+
+def generate_time_step(args):
+    """
+    Generates and writes the positions for one time step (pool worker)
+    :param args: Tuple of constellation parameters, time step in minutes and output directory
+    :return: Time step and output file
+    """
+    params, time_min, output_dir = args
+    satellites = build_constellation(**params)
+    positions = compute_positions(satellites, time_min, params["epoch"])
+    sat_pos_file = os.path.join(output_dir, "sat_positions_" + str(time_min) + ".txt")
+    write_positions(positions, sat_pos_file)
+    return time_min, sat_pos_file
+
+
+def generate_sat_positions(params, time_steps, output_dir, cores=1):
+    """
+    Generates sat_positions_<t>.txt for every time step
+    :param params: Keyword arguments of build_constellation
+    :param time_steps: Time steps in minutes since the epoch
+    :param output_dir: Output directory
+    :param cores: Number of worker processes; time steps are distributed across them
+    :return: List of generated files ordered by time step
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    tasks = [(params, time_min, output_dir) for time_min in time_steps]
+    if cores <= 1:
+        results = [generate_time_step(task) for task in tasks]
+    else:
+        pool = multiprocessing.get_context("fork").Pool(cores)
+        results = pool.map(generate_time_step, tasks)
+        pool.close()
+        pool.join()
+    return [sat_pos_file for time_min, sat_pos_file in sorted(results)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate constellation satellite positions over time")
+    parser.add_argument("--constellation", choices=sorted(CONSTELLATIONS.keys()),
+                        help="Shipped constellation to take orbits, satellites per orbit, inclination and mean "
+                             "motion from")
+    parser.add_argument("--num-orbits", type=int)
+    parser.add_argument("--num-sats-per-orbit", type=int)
+    parser.add_argument("--inclination", type=float, help="Inclination in degrees")
+    parser.add_argument("--altitude-km", type=float, help="Circular orbit altitude; overrides --mean-motion")
+    parser.add_argument("--mean-motion", type=float, help="Revolutions per day (default " + str(DEFAULT_MEAN_MOTION)
+                                                          + ")")
+    parser.add_argument("--eccentricity", type=float, default=0.001)
+    parser.add_argument("--arg-of-perigee", type=float, default=0.0)
+    parser.add_argument("--no-phase-diff", action="store_true",
+                        help="Do not phase shift alternate orbits")
+    parser.add_argument("--epoch", default=DEFAULT_EPOCH)
+    parser.add_argument("--start-min", type=int, default=0)
+    parser.add_argument("--num-steps", type=int, default=1)
+    parser.add_argument("--step-min", type=int, default=1)
+    parser.add_argument("--cores", type=int, default=1)
+    parser.add_argument("--output-dir", required=True)
+    args = parser.parse_args()
+
+    constellation = dict(CONSTELLATIONS[args.constellation]) if args.constellation else {}
+    constellation.setdefault("mean_motion", DEFAULT_MEAN_MOTION)
+    for key in ("num_orbits", "num_sats_per_orbit", "inclination", "mean_motion"):
+        if getattr(args, key) is not None:
+            constellation[key] = getattr(args, key)
+        if key not in constellation:
+            parser.error("--" + key.replace("_", "-") + " is required without --constellation")
+
+    constellation_params = {
+        "num_orbits": constellation["num_orbits"],
+        "num_sats_per_orbit": constellation["num_sats_per_orbit"],
+        "inclination": constellation["inclination"],
+        "mean_motion": get_mean_motion(args.altitude_km) if args.altitude_km is not None else constellation[
+            "mean_motion"],
+        "eccentricity": args.eccentricity,
+        "arg_of_perigee": args.arg_of_perigee,
+        "phase_diff": not args.no_phase_diff,
+        "epoch": args.epoch
+    }
+    steps = [args.start_min + i * args.step_min for i in range(args.num_steps)]
+    files = generate_sat_positions(constellation_params, steps, args.output_dir, args.cores)
+    print("generated", len(files), "snapshots in", args.output_dir)
@@ -0,0 +1,230 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Earth-centred Cartesian geometry shared by ISL length computation and link generation.
+# Axes follow util.compute_isl_length: x = r cos(lat) sin(long), y = r sin(lat), z = r cos(lat) cos(long)
+# on a spherical earth of radius EARTH_RADIUS.
+
+import math
+import numpy as np
+
+EARTH_RADIUS = 6371  # km
+CITY_PAIR_EARTH_RADIUS = 6371.01  # km, radius of the geodesic distances in the shipped city pair files
+
+
+def get_cartesian(lat_rad, long_rad, alt_km):
+    """
+    Converts one position to Cartesian coordinates
+    :param lat_rad: Latitude in radians
+    :param long_rad: Longitude in radians
+    :param alt_km: Altitude above the earth surface in km
+    :return: Tuple of x, y, z in km
+    """
+    r = EARTH_RADIUS + alt_km
+    return (r * math.cos(lat_rad) * math.sin(long_rad),
+            r * math.sin(lat_rad),
+            r * math.cos(lat_rad) * math.cos(long_rad))
+
+
+def get_cartesian_array(lat_deg, long_deg, alt_km):
+    """
+    Converts arrays of positions to Cartesian coordinates
+    :param lat_deg: Latitudes in degrees
+    :param long_deg: Longitudes in degrees
+    :param alt_km: Altitudes above the earth surface in km (array or scalar)
+    :return: N x 3 array of x, y, z in km
+    """
+    lat_rad = np.radians(np.asarray(lat_deg, dtype=np.float64))
+    long_rad = np.radians(np.asarray(long_deg, dtype=np.float64))
+    r = EARTH_RADIUS + np.asarray(alt_km, dtype=np.float64)
+    return np.stack((r * np.cos(lat_rad) * np.sin(long_rad),
+                     r * np.sin(lat_rad),
+                     r * np.cos(lat_rad) * np.cos(long_rad)), axis=-1)
+
+
+def get_sat_cartesian(sat_positions):
+    """
+    Converts loaded satellite positions to Cartesian coordinates once, indexed by satellite id
+    :param sat_positions: Structured array of loader.SAT_POSITION_DTYPE
+    :return: Array with one x, y, z row per satellite id
+    """
+    points = np.zeros((int(np.max(sat_positions["sat_id"])) + 1, 3))
+    points[sat_positions["sat_id"]] = get_cartesian_array(sat_positions["lat_deg"], sat_positions["long_deg"],
+                                                          sat_positions["alt_km"])
+    return points
+
+
+def get_city_cartesian(city_positions):
+    """
+    Converts loaded city positions to Cartesian coordinates on the earth surface
+    :param city_positions: Structured array of loader.CITY_POSITION_DTYPE
+    :return: Array with one x, y, z row per city, in file order
+    """
+    return get_cartesian_array(city_positions["lat_deg"], city_positions["long_deg"], 0.0)
+
+
+def get_distances(points_1, points_2):
+    """
+    Straight-line distances between corresponding rows of two coordinate arrays, evaluated in the same order as
+    util.compute_isl_length so both give identical lengths
+    :param points_1: N x 3 array
+    :param points_2: N x 3 array
+    :return: Array of N distances in km
+    """
+    diff = points_2 - points_1
+    return np.sqrt(diff[:, 0] * diff[:, 0] + diff[:, 1] * diff[:, 1] + diff[:, 2] * diff[:, 2])
+
+
+def get_pair_distances(points, index_1, index_2):
+    """
+    Distances for a batch of index pairs, e.g. ISL lengths from get_sat_cartesian
+    :param points: Coordinate array
+    :param index_1: Indices of the first end points
+    :param index_2: Indices of the second end points
+    :return: Array of distances in km
+    """
+    return get_distances(points[index_1], points[index_2])
+
+
+def get_line_of_sight(points_1, points_2, min_altitude_km):
+    """
+    Checks whether the straight segments between corresponding points stay above an altitude everywhere
+    :param points_1: N x 3 array
+    :param points_2: N x 3 array
+    :param min_altitude_km: Lowest altitude a segment may graze, e.g. the top of the atmosphere
+    :return: Boolean array of N values
+    """
+    direction = points_2 - points_1
+    length_sq = np.sum(direction ** 2, axis=-1)
+    t = np.zeros(len(length_sq))
+    nonzero = length_sq > 0
+    t[nonzero] = np.clip(-np.sum(points_1[nonzero] * direction[nonzero], axis=-1) / length_sq[nonzero], 0.0, 1.0)
+    closest = points_1 + t[:, np.newaxis] * direction
+    return np.sqrt(np.sum(closest ** 2, axis=-1)) >= EARTH_RADIUS + min_altitude_km
+
+
+def get_pair_line_of_sight(points, index_1, index_2, min_altitude_km):
+    """
+    Line of sight check for a batch of index pairs
+    :param points: Coordinate array
+    :param index_1: Indices of the first end points
+    :param index_2: Indices of the second end points
+    :param min_altitude_km: Lowest altitude a segment may graze
+    :return: Boolean array
+    """
+    return get_line_of_sight(points[index_1], points[index_2], min_altitude_km)
+
+
+def get_elevation_angles(ground_points, sky_points):
+    """
+    Elevation angles of sky points as seen from corresponding ground points
+    :param ground_points: N x 3 array of observer positions
+    :param sky_points: N x 3 array of observed positions
+    :return: Array of N elevation angles in degrees
+    """
+    line = sky_points - ground_points
+    up = ground_points / np.sqrt(np.sum(ground_points ** 2, axis=-1))[:, np.newaxis]
+    sin_elevation = np.sum(line * up, axis=-1) / np.sqrt(np.sum(line ** 2, axis=-1))
+    return np.degrees(np.arcsin(np.clip(sin_elevation, -1.0, 1.0)))
+
+
+def get_pair_elevation_angles(ground_points, ground_index, sky_points, sky_index):
+    """
+    Elevation angles for a batch of (ground, sky) index pairs
+    :param ground_points: Coordinate array of observers
+    :param ground_index: Observer indices
+    :param sky_points: Coordinate array of observed positions
+    :param sky_index: Observed position indices
+    :return: Array of elevation angles in degrees
+    """
+    return get_elevation_angles(ground_points[ground_index], sky_points[sky_index])
+
+
+def find_pairs_within_distance(points_1, points_2, max_dist):
+    """
+    Finds all pairs of points closer than a distance using a uniform cell grid of side max_dist, so only points
+    in neighboring cells are compared and memory stays proportional to the number of nearby pairs
+    :param points_1: N x 3 array
+    :param points_2: M x 3 array, or None to search pairs within points_1 (each unordered pair reported once)
+    :param max_dist: Maximum distance in km (inclusive)
+    :return: Arrays of indices into points_1, indices into points_2 and distances
+    """
+    self_pairs = points_2 is None
+    if self_pairs:
+        points_2 = points_1
+    cells_1 = np.floor(points_1 / max_dist).astype(np.int64)
+    cells_2 = np.floor(points_2 / max_dist).astype(np.int64)
+    low = np.minimum(cells_1.min(axis=0), cells_2.min(axis=0)) - 1
+    span = np.maximum(cells_1.max(axis=0), cells_2.max(axis=0)) - low + 2
+    cells_1 -= low
+    cells_2 -= low
+
+    def get_keys(cells):
+        return (cells[:, 0] * span[1] + cells[:, 1]) * span[2] + cells[:, 2]
+
+    order = np.argsort(get_keys(cells_2), kind="stable")
+    sorted_keys = get_keys(cells_2)[order]
+    index_1 = []
+    index_2 = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            for dz in (-1, 0, 1):
+                keys = get_keys(cells_1 + np.array([dx, dy, dz]))
+                start = np.searchsorted(sorted_keys, keys, side="left")
+                count = np.searchsorted(sorted_keys, keys, side="right") - start
+                total = int(count.sum())
+                if total == 0:
+                    continue
+                candidate_1 = np.repeat(np.arange(len(points_1)), count)
+                run_start = np.repeat(np.cumsum(count) - count, count)
+                candidate_2 = order[np.repeat(start, count) + np.arange(total) - run_start]
+                if self_pairs:
+                    keep = candidate_1 < candidate_2
+                    candidate_1 = candidate_1[keep]
+                    candidate_2 = candidate_2[keep]
+                close = get_distances(points_1[candidate_1], points_2[candidate_2]) <= max_dist
+                index_1.append(candidate_1[close])
+                index_2.append(candidate_2[close])
+    if not index_1:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    index_1 = np.concatenate(index_1)
+    index_2 = np.concatenate(index_2)
+    return index_1, index_2, get_distances(points_1[index_1], points_2[index_2])
+
+
+def get_great_circle_distances(lat_deg_1, long_deg_1, lat_deg_2, long_deg_2, radius=CITY_PAIR_EARTH_RADIUS):
+    """
+    Great circle distances between corresponding points, as in the geo_dist column of the city pair files
+    :param lat_deg_1: Latitudes of the first points in degrees
+    :param long_deg_1: Longitudes of the first points in degrees
+    :param lat_deg_2: Latitudes of the second points in degrees
+    :param long_deg_2: Longitudes of the second points in degrees
+    :param radius: Earth radius in km
+    :return: Array of distances in km
+    """
+    lat_1 = np.radians(lat_deg_1)
+    lat_2 = np.radians(lat_deg_2)
+    delta_long = np.radians(np.asarray(long_deg_2) - np.asarray(long_deg_1))
+    y = np.hypot(np.cos(lat_2) * np.sin(delta_long),
+                 np.cos(lat_1) * np.sin(lat_2) - np.sin(lat_1) * np.cos(lat_2) * np.cos(delta_long))
+    x = np.sin(lat_1) * np.sin(lat_2) + np.cos(lat_1) * np.cos(lat_2) * np.cos(delta_long)
+    return radius * np.arctan2(y, x)
@@ -0,0 +1,159 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import json
+import os
+import numpy as np
+
+# Column layouts of the input_data files
+SAT_POSITION_DTYPE = np.dtype([("sat_id", np.int32), ("orb_id", np.int32), ("orb_sat_id", np.int32),
+                               ("lat_deg", np.float64), ("long_deg", np.float64), ("alt_km", np.float64)])
+VALID_ISL_DTYPE = np.dtype([("sat_1", np.int32), ("sat_2", np.int32), ("dist_km", np.float64)])
+CITY_COVERAGE_DTYPE = np.dtype([("city", np.int32), ("sat", np.int32), ("dist", np.float64)])
+CITY_PAIR_DTYPE = np.dtype([("city_1", np.int32), ("city_2", np.int32), ("geo_dist", np.float64)])
+CITY_POSITION_DTYPE = np.dtype([("city", np.int32), ("name", "U64"), ("lat_deg", np.float64),
+                                ("long_deg", np.float64), ("pop", np.float64)])
+
+CACHE_SUFFIX = ".cache.npy"
+CACHE_META_SUFFIX = ".cache.json"
+
+
+def get_file_signature(file_name, dtype):
+    """
+    Describes the state of a source file so that a stale cache can be detected
+    :param file_name: Source file
+    :param dtype: Structured dtype the file is parsed into
+    :return: Size, modification time and dtype description
+    """
+    stat = os.stat(file_name)
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "dtype": str(dtype.descr)
+    }
+
+
+def read_cache(file_name, dtype):
+    """
+    Memory-maps the binary cache of a source file if it is still valid
+    :param file_name: Source file
+    :param dtype: Structured dtype the file is parsed into
+    :return: Read-only structured array, or None if there is no valid cache
+    """
+    try:
+        with open(file_name + CACHE_META_SUFFIX) as reader:
+            meta = json.load(reader)
+        if meta != get_file_signature(file_name, dtype):
+            return None
+        return np.load(file_name + CACHE_SUFFIX, mmap_mode="r")
+    except (OSError, ValueError):
+        return None
+
+
+def write_cache(file_name, dtype, data):
+    """
+    Writes the binary cache next to the source file. Files are written under temporary names and renamed, so
+    concurrent runs never see a partial cache. Read-only input directories are silently skipped.
+    :param file_name: Source file
+    :param dtype: Structured dtype the file is parsed into
+    :param data: Parsed structured array
+    """
+    tmp_suffix = ".tmp" + str(os.getpid())
+    try:
+        with open(file_name + CACHE_SUFFIX + tmp_suffix, "wb") as writer:
+            np.save(writer, data)
+        with open(file_name + CACHE_META_SUFFIX + tmp_suffix, "w") as writer:
+            json.dump(get_file_signature(file_name, dtype), writer)
+        os.replace(file_name + CACHE_SUFFIX + tmp_suffix, file_name + CACHE_SUFFIX)
+        os.replace(file_name + CACHE_META_SUFFIX + tmp_suffix, file_name + CACHE_META_SUFFIX)
+    except OSError:
+        for suffix in (CACHE_SUFFIX, CACHE_META_SUFFIX):
+            if os.path.exists(file_name + suffix + tmp_suffix):
+                os.remove(file_name + suffix + tmp_suffix)
+
+
+def load_csv(file_name, dtype, use_cache=True):
+    """
+    Loads a comma separated input file into a structured array, going through the binary cache when possible
+    :param file_name: Source file
+    :param dtype: Structured dtype with one field per column
+    :param use_cache: Whether to read and refresh the binary cache
+    :return: Structured array with one row per line
+    """
+    if use_cache:
+        data = read_cache(file_name, dtype)
+        if data is not None:
+            return data
+    data = np.loadtxt(file_name, dtype=dtype, delimiter=",", ndmin=1, encoding="utf-8")
+    if use_cache:
+        write_cache(file_name, dtype, data)
+    return data
+
+
+def load_sat_positions(sat_pos_file, use_cache=True):
+    """
+    Loads satellite positions: satellite id, orbit id, slot in orbit, latitude, longitude, altitude in km
+    :param sat_pos_file: input file containing satellite positions at a particular instant of time
+    :param use_cache: Whether to read and refresh the binary cache
+    :return: Structured array of SAT_POSITION_DTYPE
+    """
+    return load_csv(sat_pos_file, SAT_POSITION_DTYPE, use_cache)
+
+
+def load_valid_isls(valid_isl_file, use_cache=True):
+    """
+    Loads valid ISLs: satellite 1, satellite 2, ISL length in km
+    :param valid_isl_file: File containing ISLs
+    :param use_cache: Whether to read and refresh the binary cache
+    :return: Structured array of VALID_ISL_DTYPE
+    """
+    return load_csv(valid_isl_file, VALID_ISL_DTYPE, use_cache)
+
+
+def load_city_coverage(coverage_file, use_cache=True):
+    """
+    Loads city coverage: city, satellite, up/down-link distance in km
+    :param coverage_file: File holding the city-satellite mapping
+    :param use_cache: Whether to read and refresh the binary cache
+    :return: Structured array of CITY_COVERAGE_DTYPE
+    """
+    return load_csv(coverage_file, CITY_COVERAGE_DTYPE, use_cache)
+
+
+def load_city_pairs(city_pair_file, use_cache=True):
+    """
+    Loads city pairs: city 1, city 2, geodesic distance in km
+    :param city_pair_file: File containing city pairs
+    :param use_cache: Whether to read and refresh the binary cache
+    :return: Structured array of CITY_PAIR_DTYPE
+    """
+    return load_csv(city_pair_file, CITY_PAIR_DTYPE, use_cache)
+
+
+def load_city_positions(city_pos_file, use_cache=True):
+    """
+    Loads cities: city id, name, latitude, longitude, population
+    :param city_pos_file: file containing city coordinates and population
+    :param use_cache: Whether to read and refresh the binary cache
+    :return: Structured array of CITY_POSITION_DTYPE
+    """
+    return load_csv(city_pos_file, CITY_POSITION_DTYPE, use_cache)
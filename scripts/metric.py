@@ -0,0 +1,883 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import math
+import time
+import numpy as np
+
+try:
+    from . import csr_graph
+    from . import geometry
+    from . import profiling
+except (ImportError, SystemError):
+    import csr_graph
+    import geometry
+    import profiling
+
+FAILED_METRIC = {
+    "avgWeightedStretch": 99999.0,
+    "avgWeightedHopCount": 99999.0,
+    "wMetric": 99999.0
+}
+PRUNE_TOLERANCE = 1e-9  # Relative margin keeping a motif whose bound only exceeds the best by rounding error
+SAMPLING_Z = 1.96  # Two-sided 95% normal confidence intervals for sampled estimates
+SAMPLING_STAGES = 4  # Stages of a progressive sampled estimate, each doubling the number of evaluated draws
+ASTAR_HEURISTIC_SLACK = 0.01  # km, keeps the A* heuristic a lower bound despite rounding
+LINK_LOAD_PERCENTILES = [50, 90, 99]  # Reported besides the maximum link load
+MATRIX_CHUNK_PAIRS = 1024  # City pairs per vectorized min-plus step, bounds the pairs x up-links x down-links block
+
+
+def group_city_pairs_by_source(city_pairs):
+    """
+    Groups city pairs by their source city so that one shortest path search serves every pair sharing it
+    :param city_pairs: Collection of city-city geodesic distances
+    :return: Mapping from source city to the list of pair indices originating from it
+    """
+    groups = {}
+    for i in range(len(city_pairs)):
+        groups.setdefault(city_pairs[i]["city_1"], []).append(i)
+    return groups
+
+
+def set_destination_results(dist, hops, pair_indices, city_pairs, coverage_index, distances, hop_counts):
+    """
+    Completes the pairs of one source city from its search result by picking the best down-link of each destination
+    :param dist: Array of distances from the source city to every satellite
+    :param hops: Array of hop counts from the source city to every satellite
+    :param pair_indices: Indices of the pairs originating from the source city
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param distances: Per-pair distances, updated in place
+    :param hop_counts: Per-pair hop counts, updated in place
+    """
+    for i in pair_indices:
+        downlinks = coverage_index.get(city_pairs[i]["city_2"])
+        if downlinks is None:
+            continue
+        total = dist[downlinks["sat"]] + downlinks["dist"]
+        best = int(np.argmin(total))
+        if total[best] != np.inf:
+            distances[i] = float(total[best])
+            hop_counts[i] = int(hops[downlinks["sat"][best]]) + 1
+
+
+def get_city_pair_results(graph, city_pairs, coverage_index, pair_groups=None, stage_times=None):
+    """
+    Computes the distance and hop count for every city pair, running one search per distinct source city.
+    The source city is attached virtually through its up-links and destinations are reached through their
+    down-links, so the graph is never mutated and no path transits through another city.
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Lists of per-pair distances and hop counts (None where the destination is unreachable)
+    """
+    if pair_groups is None:
+        pair_groups = group_city_pairs_by_source(city_pairs)
+    t = time.perf_counter()
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    t = profiling.add_stage_time(stage_times, "graph_build", t)
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    for source in pair_groups:
+        if source not in coverage_index:
+            continue
+        uplinks = list(zip(coverage_index[source]["sat"].tolist(), coverage_index[source]["dist"].tolist()))
+        t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+        dist, hops = csr_graph.single_source_dist_hops(adjacency, uplinks)
+        t = profiling.add_stage_time(stage_times, "path_search", t)
+        set_destination_results(np.array(dist), np.array(hops), pair_groups[source], city_pairs, coverage_index,
+                                distances, hop_counts)
+        t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+    return distances, hop_counts
+
+
+def update_city_pair_results(graph, city_pairs, coverage_index, trees, pair_groups=None):
+    """
+    Same as get_city_pair_results, but carries the shortest path tree of every source city over from the previous
+    snapshot and repairs it (csr_graph.repair_shortest_path_tree). The repair absorbs changed ISL lengths, added or
+    removed ISLs and changed up-links: the subtrees of up-links the city lost become unreachable and are searched
+    again, new or shorter up-links seed the search. A tree is searched from scratch only when none of its roots is
+    still an up-link.
+    :param graph: CSR graph of the current snapshot
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index for the current snapshot
+    :param trees: Mapping from source city to its last tree (predecessors and hop counts); empty for the first
+                  snapshot, updated in place
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :return: Lists of per-pair distances and hop counts (None where the destination is unreachable), the number of
+             source cities whose tree was repaired rather than searched and the number of distance improvements
+             the repairs made
+    """
+    if pair_groups is None:
+        pair_groups = group_city_pairs_by_source(city_pairs)
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    edge_index = None
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    repaired = 0
+    improvements = 0
+    for source in pair_groups:
+        if source not in coverage_index:
+            trees.pop(source, None)
+            continue
+        uplinks = list(zip(coverage_index[source]["sat"].tolist(), coverage_index[source]["dist"].tolist()))
+        roots_left = source in trees and np.any(trees[source]["parent"][coverage_index[source]["sat"]]
+                                                == csr_graph.TREE_ROOT)
+        if roots_left:
+            if edge_index is None:
+                edge_index = csr_graph.get_edge_index(graph)
+            dist, hops, parent, changed = csr_graph.repair_shortest_path_tree(graph, adjacency, edge_index, uplinks,
+                                                                              trees[source]["parent"],
+                                                                              trees[source]["hops"])
+            repaired += 1
+            improvements += changed
+        else:
+            dist, hops, parent = csr_graph.shortest_path_tree(adjacency, uplinks)
+            dist = np.array(dist)
+            hops = np.array(hops)
+            parent = np.array(parent, dtype=np.int64)
+        trees[source] = {
+            "parent": parent,
+            "hops": hops
+        }
+        set_destination_results(dist, hops, pair_groups[source], city_pairs, coverage_index, distances, hop_counts)
+    return distances, hop_counts, repaired, improvements
+
+
+def aggregate_metric(distances, hop_counts, city_pairs, city_positions):
+    """
+    Aggregates per-pair results into the population weighted stretch and hop count
+    :param distances: Per-pair distances (None where unreachable)
+    :param hop_counts: Per-pair hop counts
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :return: Computed aggregated metric (FAILED_METRIC values if any pair is unreachable)
+    """
+    weightSum = 0
+    weightedStretchSum = 0
+    weightedHopCountSum = 0
+    for i in range(len(city_pairs)):
+        if distances[i] is None:
+            return dict(FAILED_METRIC)
+        city1 = city_pairs[i]["city_1"]
+        city2 = city_pairs[i]["city_2"]
+        stretch = distances[i] / city_pairs[i]["geo_dist"]
+        weight = city_positions[city1]["pop"] * city_positions[city2]["pop"] / 10000000
+        weightSum += weight
+        weightedStretchSum += stretch * weight
+        weightedHopCountSum += hop_counts[i] * weight
+    avgWeightedStretch = weightedStretchSum / weightSum
+    avgWeightedHopCount = weightedHopCountSum / weightSum
+    return_val = {
+        "avgWeightedStretch": avgWeightedStretch,
+        "avgWeightedHopCount": avgWeightedHopCount,
+        "wMetric": avgWeightedStretch + avgWeightedHopCount
+    }
+    return return_val
+
+
+def get_city_pair_results_with_loads(graph, city_pairs, city_positions, coverage_index, pair_groups=None):
+    """
+    Computes the same per-pair results as get_city_pair_results and accumulates the population weight of every pair
+    onto each link of its path. The weight of a pair is put on the satellite where it leaves for the destination,
+    then the predecessor tree of the source city is walked from its deepest level up, handing each satellite's
+    accumulated weight to the ISL towards its parent and on to the parent. What reaches a satellite attached to the
+    source is the load of that up-link. Work per source city is linear in the number of satellites, whatever the
+    number of pairs, and no path is stored.
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :return: Lists of per-pair distances and hop counts (None where the destination is unreachable), ISL loads
+             aligned with csr_graph.get_undirected_edges and ground link loads per city aligned with
+             coverage_index[city]["sat"] (up- and down-link traffic of the city together)
+    """
+    if pair_groups is None:
+        pair_groups = group_city_pairs_by_source(city_pairs)
+    num_nodes = graph["num_nodes"]
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    isl_keys = csr_graph.get_undirected_edges(graph)[0]
+    isl_loads = np.zeros(len(isl_keys))
+    ground_loads = {}
+    for i in range(len(city_pairs)):
+        for city in (city_pairs[i]["city_1"], city_pairs[i]["city_2"]):
+            if city in coverage_index and city not in ground_loads:
+                ground_loads[city] = np.zeros(len(coverage_index[city]["sat"]))
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    for source in pair_groups:
+        if source not in coverage_index:
+            continue
+        uplinks = list(zip(coverage_index[source]["sat"].tolist(), coverage_index[source]["dist"].tolist()))
+        dist, hops, parent = csr_graph.shortest_path_tree(adjacency, uplinks)
+        dist = np.array(dist)
+        parent = np.array(parent, dtype=np.int64)
+        load = np.zeros(num_nodes)
+        for i in pair_groups[source]:
+            destination = city_pairs[i]["city_2"]
+            downlinks = coverage_index.get(destination)
+            if downlinks is None:
+                continue
+            total = dist[downlinks["sat"]] + downlinks["dist"]
+            best = int(np.argmin(total))
+            if total[best] != np.inf:
+                distances[i] = float(total[best])
+                hop_counts[i] = hops[downlinks["sat"][best]] + 1
+                weight = city_positions[source]["pop"] * city_positions[destination]["pop"] / 10000000
+                load[downlinks["sat"][best]] += weight
+                ground_loads[destination][best] += weight
+        levels = csr_graph.get_tree_levels(parent, np.array(hops))
+        for level in reversed(levels[1:]):
+            loaded = level[load[level] > 0]
+            # Every satellite has one parent, so no ISL appears twice within a level
+            np.add.at(load, parent[loaded], load[loaded])
+            isl_loads[np.searchsorted(isl_keys, np.minimum(parent[loaded], loaded) * num_nodes
+                                      + np.maximum(parent[loaded], loaded))] += load[loaded]
+        if levels:
+            uplink_position = {sat: position for position, sat in enumerate(coverage_index[source]["sat"].tolist())}
+            for sat in levels[0][load[levels[0]] > 0].tolist():
+                ground_loads[source][uplink_position[sat]] += load[sat]
+    return distances, hop_counts, isl_loads, ground_loads
+
+
+def get_load_summary(loads):
+    """
+    Summarizes link loads by their maximum and percentiles (LINK_LOAD_PERCENTILES); links carrying no traffic count
+    as zero
+    :param loads: Array of link loads
+    :return: Mapping from max and p<percentile> to load
+    """
+    summary = {"max": float(np.max(loads)) if len(loads) else 0.0}
+    for percentile in LINK_LOAD_PERCENTILES:
+        summary["p" + str(percentile)] = float(np.percentile(loads, percentile)) if len(loads) else 0.0
+    return summary
+
+
+def compute_metric_with_link_loads(graph, city_pairs, city_positions, coverage_index, pair_groups=None):
+    """
+    Computes the metric of compute_metric_avoid_city together with the population weighted traffic load of every
+    ISL and city-satellite link on the chosen paths (see get_city_pair_results_with_loads)
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :return: Computed aggregated metric with islLoad and groundLinkLoad summaries (see get_load_summary) and the
+             islLoads and groundLinkLoads themselves
+    """
+    distances, hop_counts, isl_loads, ground_loads = get_city_pair_results_with_loads(graph, city_pairs,
+                                                                                      city_positions, coverage_index,
+                                                                                      pair_groups)
+    return_val = aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+    return_val["islLoads"] = isl_loads
+    return_val["groundLinkLoads"] = ground_loads
+    return_val["islLoad"] = get_load_summary(isl_loads)
+    return_val["groundLinkLoad"] = get_load_summary(np.concatenate([ground_loads[city]
+                                                                    for city in sorted(ground_loads)] + [[]]))
+    return return_val
+
+
+def get_all_pairs_inputs(city_positions, coverage_index, min_geo_dist=0.0):
+    """
+    Prepares the per-city arrays from which the pairs of every source city are generated on the fly, so no pair
+    table is materialized for all-pairs evaluations
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param min_geo_dist: Pairs of cities at most this far apart (km) are left out
+    :return: Cities in order with their coordinates, populations and padded down-links (see get_coverage_arrays)
+    """
+    cities = sorted(city_positions)
+    down_sats, down_dists = get_coverage_arrays(coverage_index, cities)
+    return {
+        "cities": cities,
+        "lat_deg": np.array([city_positions[city]["lat_deg"] for city in cities]),
+        "long_deg": np.array([city_positions[city]["long_deg"] for city in cities]),
+        "pop": np.array([city_positions[city]["pop"] for city in cities]),
+        "down_sats": down_sats,
+        "down_dists": down_dists,
+        "min_geo_dist": min_geo_dist
+    }
+
+
+def new_metric_sums():
+    """
+    Creates the running sums of a streamed metric evaluation
+    :return: Pair counts and weighted sums, all zero
+    """
+    return {
+        "pairs": 0,
+        "unreachable": 0,
+        "weightSum": 0.0,
+        "weightedStretchSum": 0.0,
+        "weightedHopCountSum": 0.0
+    }
+
+
+def add_metric_sums(sums, other):
+    """
+    Adds the running sums of a part of the pairs to the total
+    :param sums: Output of new_metric_sums, updated in place
+    :param other: Sums of the part
+    """
+    for key in sums:
+        sums[key] += other[key]
+
+
+def get_source_city_sums(adjacency, all_pairs, row, coverage_index):
+    """
+    Evaluates every pair of a source city with the cities after it, so each unordered pair is evaluated once, with
+    one search from its up-links. Destinations, their geodesic distances and population weights are generated here
+    and folded into running sums right away.
+    :param adjacency: Output of csr_graph.get_adjacency_lists
+    :param all_pairs: Output of get_all_pairs_inputs
+    :param row: Position of the source city in all_pairs["cities"]
+    :param coverage_index: Output of util.build_city_coverage_index
+    :return: Sums as in new_metric_sums
+    """
+    sums = new_metric_sums()
+    geo_dist = geometry.get_great_circle_distances(all_pairs["lat_deg"][row], all_pairs["long_deg"][row],
+                                                   all_pairs["lat_deg"][row + 1:], all_pairs["long_deg"][row + 1:])
+    keep = np.flatnonzero(geo_dist > all_pairs["min_geo_dist"]) + row + 1
+    sums["pairs"] = len(keep)
+    source = all_pairs["cities"][row]
+    if len(keep) == 0:
+        return sums
+    if source not in coverage_index:
+        sums["unreachable"] = len(keep)
+        return sums
+    uplinks = list(zip(coverage_index[source]["sat"].tolist(), coverage_index[source]["dist"].tolist()))
+    dist, hops = csr_graph.single_source_dist_hops(adjacency, uplinks)
+    down_sats = all_pairs["down_sats"][keep]
+    total = np.array(dist)[down_sats] + all_pairs["down_dists"][keep]
+    best = np.argmin(total, axis=1)
+    distances = total[np.arange(len(keep)), best]
+    reachable = np.isfinite(distances)
+    sums["unreachable"] = int(len(keep) - np.count_nonzero(reachable))
+    hop_counts = np.array(hops)[down_sats[np.arange(len(keep)), best]] + 1
+    weights = all_pairs["pop"][row] * all_pairs["pop"][keep] / 10000000
+    stretches = distances / geo_dist[keep - row - 1]
+    sums["weightSum"] = float(np.sum(weights[reachable]))
+    sums["weightedStretchSum"] = float(np.sum(stretches[reachable] * weights[reachable]))
+    sums["weightedHopCountSum"] = float(np.sum(hop_counts[reachable] * weights[reachable]))
+    return sums
+
+
+def get_metric_from_sums(sums):
+    """
+    Turns running sums into the aggregated metric of aggregate_metric
+    :param sums: Output of new_metric_sums after all pairs were added
+    :return: Computed aggregated metric (FAILED_METRIC values if any pair is unreachable)
+    """
+    if sums["unreachable"] > 0 or sums["weightSum"] == 0:
+        return dict(FAILED_METRIC)
+    avgWeightedStretch = sums["weightedStretchSum"] / sums["weightSum"]
+    avgWeightedHopCount = sums["weightedHopCountSum"] / sums["weightSum"]
+    return {
+        "avgWeightedStretch": avgWeightedStretch,
+        "avgWeightedHopCount": avgWeightedHopCount,
+        "wMetric": avgWeightedStretch + avgWeightedHopCount
+    }
+
+
+def compute_metric_avoid_city(graph, city_pairs, city_positions, coverage_index, pair_groups=None, stage_times=None):
+    """
+    Computes city-pair wise stretch and hop count and the aggregate metric values
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric
+    """
+    distances, hop_counts = get_city_pair_results(graph, city_pairs, coverage_index, pair_groups, stage_times)
+    t = time.perf_counter()
+    return_val = aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+    profiling.add_stage_time(stage_times, "aggregation", t)
+    return return_val
+
+
+def get_coverage_arrays(coverage_index, cities):
+    """
+    Pads the coverage of a list of cities into arrays with one row per city, so the links of many cities can be
+    combined at once. Padding and cities without coverage have an infinite link distance.
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param cities: List of cities
+    :return: Arrays of covering satellites and link distances (cities x most links of a city)
+    """
+    width = max([len(coverage_index[city]["sat"]) for city in cities if city in coverage_index] + [1])
+    sats = np.zeros((len(cities), width), dtype=np.int64)
+    dists = np.full((len(cities), width), np.inf)
+    for row in range(len(cities)):
+        links = coverage_index.get(cities[row])
+        if links is not None:
+            sats[row, :len(links["sat"])] = links["sat"]
+            dists[row, :len(links["sat"])] = links["dist"]
+    return sats, dists
+
+
+def get_satellite_distance_matrix(adjacency, sources, targets):
+    """
+    Computes the shortest distances and hop counts over ISLs from every source satellite to every target satellite,
+    with one search per source
+    :param adjacency: Output of csr_graph.get_adjacency_lists
+    :param sources: List of source satellites
+    :param targets: Array of target satellites
+    :return: Distance matrix (infinity if unreachable) and matrix of ISL hop counts plus one (sources x targets)
+    """
+    dist = np.empty((len(sources), len(targets)))
+    hops = np.empty((len(sources), len(targets)), dtype=np.int32)
+    for row in range(len(sources)):
+        best, best_hops = csr_graph.single_source_dist_hops(adjacency, [(sources[row], 0.0)])
+        dist[row] = np.array(best)[targets]
+        hops[row] = np.array(best_hops)[targets]
+    return dist, hops
+
+
+def get_city_pair_results_matrix(graph, city_pairs, coverage_index, pair_groups=None, stage_times=None):
+    """
+    Computes the same per-pair results as get_city_pair_results in two stages. First the distances and hop counts
+    between every satellite covering a source city and every satellite covering a destination city are computed
+    over ISLs (get_satellite_distance_matrix), searching from the smaller of the two satellite sets. Then every pair
+    takes the minimum of up-link + ISL path + down-link over all combinations of its links, vectorized over chunks
+    of MATRIX_CHUNK_PAIRS pairs. Distances agree with get_city_pair_results up to rounding, as the link and path
+    lengths are added in a different order, and so may the chosen path between equally long ones.
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Lists of per-pair distances and hop counts (None where the destination is unreachable)
+    """
+    if pair_groups is None:
+        pair_groups = group_city_pairs_by_source(city_pairs)
+    t = time.perf_counter()
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    t = profiling.add_stage_time(stage_times, "graph_build", t)
+    source_cities = list(pair_groups)
+    destination_cities = sorted(set(city_pairs[i]["city_2"] for i in range(len(city_pairs))))
+    up_sats, up_dists = get_coverage_arrays(coverage_index, source_cities)
+    down_sats, down_dists = get_coverage_arrays(coverage_index, destination_cities)
+    sources = np.unique(up_sats[np.isfinite(up_dists)])
+    targets = np.unique(down_sats[np.isfinite(down_dists)])
+    # Matrix rows and columns of every satellite (0 for padding, whose infinite link distance masks it)
+    up_index = np.zeros(graph["num_nodes"], dtype=np.int64)
+    up_index[sources] = np.arange(len(sources))
+    down_index = np.zeros(graph["num_nodes"], dtype=np.int64)
+    down_index[targets] = np.arange(len(targets))
+    t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+    if len(sources) == 0 or len(targets) == 0:
+        return [None] * len(city_pairs), [None] * len(city_pairs)
+    if len(targets) < len(sources):
+        # ISLs are undirected, so searching from the targets gives the same matrix transposed
+        sat_dist, sat_hops = get_satellite_distance_matrix(adjacency, targets.tolist(), sources)
+        sat_dist = sat_dist.T
+        sat_hops = sat_hops.T
+    else:
+        sat_dist, sat_hops = get_satellite_distance_matrix(adjacency, sources.tolist(), targets)
+    t = profiling.add_stage_time(stage_times, "path_search", t)
+
+    source_row = {source_cities[row]: row for row in range(len(source_cities))}
+    destination_row = {destination_cities[row]: row for row in range(len(destination_cities))}
+    pair_up = np.array([source_row[city_pairs[i]["city_1"]] for i in range(len(city_pairs))], dtype=np.int64)
+    pair_down = np.array([destination_row[city_pairs[i]["city_2"]] for i in range(len(city_pairs))], dtype=np.int64)
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    for start in range(0, len(city_pairs), MATRIX_CHUNK_PAIRS):
+        up = pair_up[start:start + MATRIX_CHUNK_PAIRS]
+        down = pair_down[start:start + MATRIX_CHUNK_PAIRS]
+        rows = up_index[up_sats[up]][:, :, np.newaxis]
+        columns = down_index[down_sats[down]][:, np.newaxis, :]
+        total = up_dists[up][:, :, np.newaxis] + sat_dist[rows, columns] + down_dists[down][:, np.newaxis, :]
+        total = total.reshape(len(up), -1)
+        best = np.argmin(total, axis=1)
+        best_total = total[np.arange(len(up)), best]
+        best_hops = np.broadcast_to(sat_hops[rows, columns], (len(up), rows.shape[1], columns.shape[2]))
+        best_hops = best_hops.reshape(len(up), -1)[np.arange(len(up)), best] + 1
+        for i, d, h in zip(range(start, start + len(up)), best_total.tolist(), best_hops.tolist()):
+            if d != np.inf:
+                distances[i] = d
+                hop_counts[i] = h
+    profiling.add_stage_time(stage_times, "coverage_attach", t)
+    return distances, hop_counts
+
+
+def compute_metric_avoid_city_matrix(graph, city_pairs, city_positions, coverage_index, pair_groups=None,
+                                     stage_times=None):
+    """
+    Computes the metric of compute_metric_avoid_city with the two-stage evaluation of
+    get_city_pair_results_matrix, which needs fewer searches than there are source cities whenever the source cities
+    share covering satellites, e.g. for all-pairs city workloads
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric
+    """
+    distances, hop_counts = get_city_pair_results_matrix(graph, city_pairs, coverage_index, pair_groups,
+                                                         stage_times)
+    t = time.perf_counter()
+    return_val = aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+    profiling.add_stage_time(stage_times, "aggregation", t)
+    return return_val
+
+
+def get_astar_heuristic(sat_cartesian, downlinks):
+    """
+    Bounds the remaining distance from every satellite to a destination city: any path over ISLs to a covering
+    satellite is at least as long as the straight line to it, so the shortest straight line plus down-link is a
+    lower bound, and it is consistent as every ISL is itself a straight line (csr_graph.extend_isls)
+    :param sat_cartesian: Satellite coordinates indexed by satellite id (geometry.get_sat_cartesian)
+    :param downlinks: Coverage of the destination city (util.build_city_coverage_index)
+    :return: List of lower bounds indexed by satellite
+    """
+    # Squared distances through the dot product are much faster than coordinate differences; the slack absorbs
+    # their cancellation error for nearby satellites
+    points = sat_cartesian[downlinks["sat"]]
+    square = np.sum(sat_cartesian * sat_cartesian, axis=1)[:, np.newaxis] + np.sum(points * points, axis=1) \
+        - 2 * np.dot(sat_cartesian, points.T)
+    remaining = np.sqrt(np.maximum(square, 0.0)) + downlinks["dist"]
+    return np.maximum(np.min(remaining, axis=1) - ASTAR_HEURISTIC_SLACK, 0.0).tolist()
+
+
+def get_city_pair_results_astar(graph, city_pairs, coverage_index, sat_cartesian, stage_times=None):
+    """
+    Computes the same per-pair results as get_city_pair_results with one A* search per pair
+    (csr_graph.astar_dist_hops), guided by the straight line distance to the destination (get_astar_heuristic).
+    The search of a pair only expands the satellites that can lie on a path shorter than its result, which for
+    long-haul pairs is a fraction of the satellites a search from the source city expands.
+    :param graph: CSR graph of the satellite network, with straight line ISL lengths between sat_cartesian
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param sat_cartesian: Satellite coordinates indexed by satellite id (geometry.get_sat_cartesian)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Lists of per-pair distances and hop counts (None where the destination is unreachable), and the total
+             number of expanded satellites
+    """
+    t = time.perf_counter()
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    t = profiling.add_stage_time(stage_times, "graph_build", t)
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    expanded = 0
+    # Pairs are grouped by destination, so the heuristic of a destination is computed once
+    destination_groups = {}
+    for i in range(len(city_pairs)):
+        destination_groups.setdefault(city_pairs[i]["city_2"], []).append(i)
+    for destination in destination_groups:
+        downlinks = coverage_index.get(destination)
+        if downlinks is None:
+            continue
+        heuristic = get_astar_heuristic(sat_cartesian, downlinks)
+        targets = list(zip(downlinks["sat"].tolist(), downlinks["dist"].tolist()))
+        t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+        for i in destination_groups[destination]:
+            uplinks = coverage_index.get(city_pairs[i]["city_1"])
+            if uplinks is None:
+                continue
+            dist, hops, pair_expanded = csr_graph.astar_dist_hops(
+                adjacency, list(zip(uplinks["sat"].tolist(), uplinks["dist"].tolist())), targets, heuristic)
+            expanded += pair_expanded
+            if dist != np.inf:
+                distances[i] = dist
+                hop_counts[i] = hops
+        t = profiling.add_stage_time(stage_times, "path_search", t)
+    return distances, hop_counts, expanded
+
+
+def count_search_settled(graph, city_pairs, coverage_index, pair_groups=None):
+    """
+    Counts the satellites the searches of get_city_pair_results settle: one search per source city, which settles
+    every satellite reachable from its up-links
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Pre-computed output of group_city_pairs_by_source (optional)
+    :return: Number of settled satellites summed over the source cities
+    """
+    if pair_groups is None:
+        pair_groups = group_city_pairs_by_source(city_pairs)
+    labels = csr_graph.get_component_labels(graph)
+    component_sizes = np.bincount(labels, minlength=graph["num_nodes"])
+    settled = 0
+    for source in pair_groups:
+        if source in coverage_index:
+            settled += int(np.sum(component_sizes[np.unique(labels[coverage_index[source]["sat"]])]))
+    return settled
+
+
+def compute_metric_avoid_city_astar(graph, city_pairs, city_positions, coverage_index, sat_cartesian,
+                                    stage_times=None):
+    """
+    Computes the metric of compute_metric_avoid_city with one A* search per pair (get_city_pair_results_astar)
+    :param graph: CSR graph of the satellite network, with straight line ISL lengths between sat_cartesian
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param sat_cartesian: Satellite coordinates indexed by satellite id (geometry.get_sat_cartesian)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric, with the number of satellites the A* searches expanded as
+             expandedSatellites and the number the per-source searches of compute_metric_avoid_city would settle
+             (count_search_settled) as searchSettledSatellites
+    """
+    distances, hop_counts, expanded = get_city_pair_results_astar(graph, city_pairs, coverage_index, sat_cartesian,
+                                                                  stage_times)
+    t = time.perf_counter()
+    return_val = aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+    return_val["expandedSatellites"] = expanded
+    return_val["searchSettledSatellites"] = count_search_settled(graph, city_pairs, coverage_index)
+    profiling.add_stage_time(stage_times, "aggregation", t)
+    return return_val
+
+
+def get_pair_weights(city_pairs, city_positions):
+    """
+    Computes the population weight of every city pair
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :return: List of weights in pair order
+    """
+    return [city_positions[city_pairs[i]["city_1"]]["pop"] * city_positions[city_pairs[i]["city_2"]]["pop"] / 10000000
+            for i in range(len(city_pairs))]
+
+
+def get_pair_lower_bounds(city_pairs, coverage_index, sat_cartesian):
+    """
+    Computes the motif independent parts of the lower bounds used by compute_metric_avoid_city_bounded. A path goes
+    up to a satellite s covering the source, then over ISLs whose total length is at least the straight line from s
+    to the last satellite t, which covers the destination. This bounds the distance, and with the longest ISL of a
+    graph it bounds the number of ISLs.
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param sat_cartesian: Satellite coordinates indexed by satellite id (geometry.get_sat_cartesian)
+    :return: Lists of stretch lower bounds and of the shortest straight line between a satellite covering the source
+             and one covering the destination (0 if they share one, -1 where a city has no coverage), in pair order
+    """
+    stretch_bounds = []
+    sat_gaps = []
+    for i in range(len(city_pairs)):
+        uplinks = coverage_index.get(city_pairs[i]["city_1"])
+        downlinks = coverage_index.get(city_pairs[i]["city_2"])
+        if uplinks is None or downlinks is None:
+            stretch_bounds.append(0.0)
+            sat_gaps.append(-1.0)
+            continue
+        diff = sat_cartesian[uplinks["sat"]][:, np.newaxis, :] - sat_cartesian[downlinks["sat"]][np.newaxis, :, :]
+        gap = np.sqrt(np.sum(diff * diff, axis=-1))
+        total = uplinks["dist"][:, np.newaxis] + gap + downlinks["dist"][np.newaxis, :]
+        stretch_bounds.append(float(np.min(total)) / city_pairs[i]["geo_dist"])
+        sat_gaps.append(0.0 if np.intersect1d(uplinks["sat"], downlinks["sat"]).size > 0 else float(np.min(gap)))
+    return stretch_bounds, sat_gaps
+
+
+def get_hop_lower_bounds(graph, sat_gaps):
+    """
+    Bounds the hop count of every pair on a given graph: the up- and down-link, plus as many ISLs as the longest
+    ISL of the graph needs to cover the straight line between the closest covering satellites (at least one when
+    the cities share no satellite)
+    :param graph: CSR graph of the satellite network
+    :param sat_gaps: Second output of get_pair_lower_bounds
+    :return: List of hop count lower bounds in pair order
+    """
+    max_isl_length = float(np.max(graph["length"])) if len(graph["length"]) > 0 else np.inf
+    hop_bounds = []
+    for gap in sat_gaps:
+        if gap < 0:
+            hop_bounds.append(0)
+        elif gap == 0:
+            hop_bounds.append(2)
+        else:
+            # The small margin keeps the bound valid when the ratio is an integer up to rounding
+            hop_bounds.append(2 + max(1, math.ceil(gap / max_isl_length - 1e-9)))
+    return hop_bounds
+
+
+def compute_metric_avoid_city_bounded(graph, city_pairs, city_positions, coverage_index, pair_groups, pair_bounds,
+                                      get_best_metric, stage_times=None):
+    """
+    Computes the same metric as compute_metric_avoid_city, but abandons the motif as soon as its metric provably
+    exceeds the best metric found so far. After every source city the exact contribution of the finished pairs plus
+    the lower bounds of the remaining ones (get_pair_lower_bounds, get_hop_lower_bounds) bound the final metric from
+    below.
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param city_positions: Collection of cities with coordinates and populations
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param pair_groups: Output of group_city_pairs_by_source
+    :param pair_bounds: Output of get_pair_lower_bounds
+    :param get_best_metric: Function returning the best wMetric found so far (may change while this runs)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Computed aggregated metric, identical to compute_metric_avoid_city, or for an abandoned motif the lower
+             bound reached as wMetric (stretch and hop count None) with "pruned" set and the number of pairs
+             evaluated until then as numPairs
+    """
+    weights = get_pair_weights(city_pairs, city_positions)
+    weight_sum = sum(weights)
+    stretch_bounds, sat_gaps = pair_bounds
+    hop_bounds = get_hop_lower_bounds(graph, sat_gaps)
+    remaining_bound = sum(weights[i] * (stretch_bounds[i] + hop_bounds[i]) for i in range(len(city_pairs)))
+    exact_sum = 0.0
+    failed = False
+    t = time.perf_counter()
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    t = profiling.add_stage_time(stage_times, "graph_build", t)
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    num_pairs = 0
+    for source in pair_groups:
+        if source in coverage_index:
+            uplinks = list(zip(coverage_index[source]["sat"].tolist(), coverage_index[source]["dist"].tolist()))
+            t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+            dist, hops = csr_graph.single_source_dist_hops(adjacency, uplinks)
+            t = profiling.add_stage_time(stage_times, "path_search", t)
+            set_destination_results(np.array(dist), np.array(hops), pair_groups[source], city_pairs, coverage_index,
+                                    distances, hop_counts)
+            t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+        num_pairs += len(pair_groups[source])
+        for i in pair_groups[source]:
+            remaining_bound -= weights[i] * (stretch_bounds[i] + hop_bounds[i])
+            if distances[i] is None:
+                failed = True
+            else:
+                exact_sum += weights[i] * (distances[i] / city_pairs[i]["geo_dist"] + hop_counts[i])
+        lower_bound = FAILED_METRIC["wMetric"] if failed else min((exact_sum + remaining_bound) / weight_sum,
+                                                                  FAILED_METRIC["wMetric"])
+        best = get_best_metric()
+        t = profiling.add_stage_time(stage_times, "aggregation", t)
+        if lower_bound > best + abs(best) * PRUNE_TOLERANCE:
+            return {
+                "avgWeightedStretch": None,
+                "avgWeightedHopCount": None,
+                "wMetric": lower_bound,
+                "pruned": True,
+                "numPairs": num_pairs
+            }
+    return_val = aggregate_metric(distances, hop_counts, city_pairs, city_positions)
+    profiling.add_stage_time(stage_times, "aggregation", t)
+    return return_val
+
+
+def draw_pair_sample(weights, sample_size, seed=0):
+    """
+    Draws city pairs with replacement, with probability proportional to their population weight. The plain mean of
+    a per-pair value over the draws is then an unbiased estimate of its weighted average over all pairs.
+    :param weights: Output of get_pair_weights
+    :param sample_size: Number of draws
+    :param seed: Seed of the random generator, so every motif is estimated on the same draws
+    :return: List of drawn pair indices
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return np.random.RandomState(seed).choice(len(weights), size=sample_size, p=weights / weights.sum()).tolist()
+
+
+def get_sample_estimate(stretches, hop_counts):
+    """
+    Estimates the aggregated metric values from the values of the drawn pairs
+    :param stretches: Stretch of every draw
+    :param hop_counts: Hop count of every draw
+    :return: Estimated aggregated metric with the confidence interval half widths (keys ending in CI) and the number
+             of draws
+    """
+    estimate = {"numDraws": len(stretches)}
+    stretches = np.asarray(stretches, dtype=np.float64)
+    hop_counts = np.asarray(hop_counts, dtype=np.float64)
+    for name, values in (("avgWeightedStretch", stretches), ("avgWeightedHopCount", hop_counts),
+                         ("wMetric", stretches + hop_counts)):
+        estimate[name] = float(np.mean(values))
+        if len(values) > 1:
+            estimate[name + "CI"] = SAMPLING_Z * float(np.std(values, ddof=1)) / math.sqrt(len(values))
+        else:
+            estimate[name + "CI"] = np.inf
+    return estimate
+
+
+def estimate_metric_avoid_city_sampled(graph, city_pairs, coverage_index, sample, get_best_upper_bound=None,
+                                       report=None, stage_times=None):
+    """
+    Estimates the metric of compute_metric_avoid_city from a population weighted sample of city pairs
+    (draw_pair_sample). The draws are evaluated in SAMPLING_STAGES stages, each doubling the number of draws, and
+    only pairs not evaluated in an earlier stage are searched. The estimation stops after a stage once the whole
+    confidence interval lies above the lowest upper bound found so far.
+    :param graph: CSR graph of the satellite network
+    :param city_pairs: Collection of city-city geodesic distances
+    :param coverage_index: Output of util.build_city_coverage_index
+    :param sample: Output of draw_pair_sample
+    :param get_best_upper_bound: Function returning the lowest upper confidence bound of the wMetric found so far
+                                 (optional)
+    :param report: Function called with the running estimate after every stage (optional)
+    :param stage_times: Mapping from stage to seconds, see profiling.add_stage_time (optional)
+    :return: Output of get_sample_estimate, with "stopped" set if the estimation stopped early, or FAILED_METRIC
+             with zero width intervals and "failed" set if a drawn pair is unreachable (the full metric fails too)
+    """
+    t = time.perf_counter()
+    adjacency = csr_graph.get_adjacency_lists(graph)
+    profiling.add_stage_time(stage_times, "graph_build", t)
+    distances = [None] * len(city_pairs)
+    hop_counts = [None] * len(city_pairs)
+    evaluated = set()
+    stretches = []
+    hops = []
+    estimate = None
+    start = 0
+    for stage in range(SAMPLING_STAGES):
+        end = int(math.ceil(len(sample) / 2 ** (SAMPLING_STAGES - 1 - stage)))
+        draws = sample[start:end]
+        pair_groups = {}
+        for i in sorted(set(draws) - evaluated):
+            pair_groups.setdefault(city_pairs[i]["city_1"], []).append(i)
+        t = time.perf_counter()
+        for source in pair_groups:
+            if source not in coverage_index:
+                continue
+            uplinks = list(zip(coverage_index[source]["sat"].tolist(), coverage_index[source]["dist"].tolist()))
+            t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+            dist, dist_hops = csr_graph.single_source_dist_hops(adjacency, uplinks)
+            t = profiling.add_stage_time(stage_times, "path_search", t)
+            set_destination_results(np.array(dist), np.array(dist_hops), pair_groups[source], city_pairs,
+                                    coverage_index, distances, hop_counts)
+            t = profiling.add_stage_time(stage_times, "coverage_attach", t)
+        evaluated.update(draws)
+        for i in draws:
+            if distances[i] is None:
+                failed = dict(FAILED_METRIC)
+                failed.update({"avgWeightedStretchCI": 0.0, "avgWeightedHopCountCI": 0.0, "wMetricCI": 0.0,
+                               "numDraws": end, "failed": True})
+                return failed
+            stretches.append(distances[i] / city_pairs[i]["geo_dist"])
+            hops.append(hop_counts[i])
+        start = end
+        if not stretches:
+            continue
+        estimate = get_sample_estimate(stretches, hops)
+        profiling.add_stage_time(stage_times, "aggregation", t)
+        if report is not None:
+            report(estimate)
+        if get_best_upper_bound is not None and end < len(sample) \
+                and estimate["wMetric"] - estimate["wMetricCI"] > get_best_upper_bound():
+            estimate["stopped"] = True
+            break
+    return estimate
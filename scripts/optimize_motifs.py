@@ -0,0 +1,471 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Searches joint zone-wise motif assignments with simulated annealing, instead of fixing the zones one after the
+# other from the equator up as find_multi_motifs.py does. Every step changes the motif of one zone and accepts a
+# worse assignment with a probability that shrinks as the budget is used up. One chain runs per core; the chains
+# share the best assignment found so far and a chain that stops improving restarts from it.
+# Candidate motifs of a zone are enumerated as in find_multi_motifs.py (util.find_zone_motif_possibilities). An
+# assignment is only evaluated until its metric provably exceeds the acceptance threshold drawn for it
+# (metric.compute_metric_avoid_city_bounded), the ISLs of unchanged lower zones are reused, and results are cached
+# by graph topology across runs (result_cache).
+# Outputs in --output-dir, in the formats of find_multi_motifs.py:
+#   level_wise_best_motif.txt, best_motif_overall.txt, metric_improvement.txt
+#   optimization_trace.txt: evaluations, seconds and wMetric whenever the best assignment improved
+#
+# Example (40x40 53deg, 1467 km, 4 chains, 300 evaluations, starting from the greedy result):
+#   python3 optimize_motifs.py 40_40_53deg 1467 4 --max-evaluations 300 \
+#       --initial ../output_data_generated/multi_motif/level_wise_best_motif.txt
+
+import argparse
+import datetime
+import math
+import multiprocessing
+import os
+import random
+import time
+import numpy as np
+
+try:
+    from . import util
+    from . import metric
+    from . import csr_graph
+    from . import geometry
+    from . import loader
+    from . import result_cache
+except (ImportError, SystemError):
+    import util
+    import metric
+    import csr_graph
+    import geometry
+    import loader
+    import result_cache
+
+sat_positions = {}
+orb_0_sat_positions = {}
+valid_isls = {}
+orbit_slot_index = {}
+sat_cartesian = None
+sat_abs_lat_deg = None
+city_positions = {}
+city_pairs = {}
+city_pair_groups = {}
+city_coverage_index = {}
+pair_bounds = None
+levels = []
+zone_motifs = []
+zone_isls_cache = {}
+input_digest = None
+cached_results = {}
+cache_writer = None
+
+# Search state shared by the chains; set before the workers are forked
+best_metric = None
+best_assignment = None
+evaluation_count = None
+start_time = None
+max_evaluations = None
+time_limit = None
+
+
+def read_sat_positions(sat_pos_file):
+    """
+    Reads satellite positions from input file
+    :param sat_pos_file: input file containing satellite positions at a particular instant of time
+    """
+    global sat_positions
+    global orb_0_sat_positions
+    global orbit_slot_index
+    global sat_cartesian
+    global sat_abs_lat_deg
+    sat_positions = {}
+    orb_0_sat_positions = {}
+    cnt = 0
+    positions = loader.load_sat_positions(sat_pos_file)
+    for sat_id, orb_id, orb_sat_id, lat_deg, long_deg, alt_km in positions.tolist():
+        sat_positions[sat_id] = {
+            "orb_id": orb_id,
+            "orb_sat_id": orb_sat_id,
+            "lat_deg": lat_deg,
+            "lat_rad": math.radians(lat_deg),
+            "long_deg": long_deg,
+            "long_rad": math.radians(long_deg),
+            "alt_km": alt_km
+        }
+        if cnt < NUM_SATS_PER_ORBIT / 4 and orb_id == 0:  # we need first quadrant of satellites
+            orb_0_sat_positions[sat_id] = sat_positions[sat_id]
+            cnt += 1
+    orbit_slot_index = util.build_orbit_slot_index(sat_positions, NUM_ORBITS, NUM_SATS_PER_ORBIT)
+    sat_cartesian = geometry.get_sat_cartesian(positions)
+    sat_abs_lat_deg = np.abs(np.array([sat_positions[i]["lat_deg"] for i in sat_positions]))
+
+
+def get_zone(l, motif, lat_top=True):
+    """
+    Describes a zone with its motif for csr_graph.build_zone_isls
+    :param l: Zone index
+    :param motif: Motif of the zone
+    :param lat_top: Whether the motif stops at the upper latitude of the zone; otherwise it is applied to everything
+                    above the lower latitude, as when find_multi_motifs.py evaluates a zone
+    :return: Zone with latitude bounds and motif
+    """
+    return {
+        "lat_bottom": levels[l],
+        "lat_top": levels[l + 1] if lat_top else None,
+        "motif": motif
+    }
+
+
+def get_assignment_isls(assignment):
+    """
+    Builds the ISL set of an assignment zone by zone, reusing the ISL sets of already built lower zones
+    :param assignment: Index of the candidate motif of every zone
+    :return: ISL set
+    """
+    isls = csr_graph.empty_isls()
+    for l in range(len(assignment)):
+        prefix = tuple(assignment[:l + 1])
+        if prefix not in zone_isls_cache:
+            zone_isls_cache[prefix] = csr_graph.build_zone_isls(orbit_slot_index,
+                                                                [get_zone(l, zone_motifs[l][assignment[l]])],
+                                                                sat_cartesian, sat_abs_lat_deg, isls)
+        isls = zone_isls_cache[prefix]
+    return isls
+
+
+def evaluate_isls(isls, threshold=float("inf")):
+    """
+    Computes the metric of a satellite graph, or abandons it once it provably exceeds a threshold
+    :param isls: ISL set of the graph
+    :param threshold: wMetric above which the exact value is not needed
+    :return: Computed aggregated metric ("pruned" set if abandoned)
+    """
+    # Both the full and the bounded evaluation run the reference search, so they share their results
+    key = result_cache.get_topology_key(input_digest, isls, result_cache.REFERENCE_ENGINE)
+    with evaluation_count.get_lock():
+        evaluation_count.value += 1
+    if key in cached_results:
+        return cached_results[key]
+    a = datetime.datetime.now()
+    graph = csr_graph.build_csr_graph(len(sat_positions), isls)
+    if threshold < float("inf"):
+        return_val = metric.compute_metric_avoid_city_bounded(graph, city_pairs, city_positions, city_coverage_index,
+                                                              city_pair_groups, pair_bounds, lambda: threshold)
+    else:
+        return_val = metric.compute_metric_avoid_city(graph, city_pairs, city_positions, city_coverage_index,
+                                                      city_pair_groups)
+    b = datetime.datetime.now() - a
+    if return_val.get("pruned"):
+        print("time to compute metric:", b.seconds, ", rejected with wMetric lower bound:", return_val["wMetric"])
+        return return_val
+    print("time to compute metric:", b.seconds, ", wMetric:", return_val["wMetric"])
+    cached_results[key] = return_val
+    result_cache.append_result(cache_writer, key, return_val)
+    return return_val
+
+
+def get_progress():
+    """
+    Gets the share of the budget used up by all chains
+    :return: Value between 0 and 1 (or above once the budget is exhausted)
+    """
+    progress = 0.0
+    if max_evaluations is not None:
+        progress = max(progress, evaluation_count.value / max_evaluations)
+    if time_limit is not None:
+        progress = max(progress, (time.time() - start_time) / time_limit)
+    return progress
+
+
+def publish_best(assignment, wMetric):
+    """
+    Replaces the shared best assignment if an assignment is better
+    :param assignment: Index of the candidate motif of every zone
+    :param wMetric: Metric of the assignment
+    :return: Whether the shared best assignment was replaced
+    """
+    with best_metric.get_lock():
+        if wMetric < best_metric.value:
+            best_metric.value = wMetric
+            best_assignment[:] = assignment
+            return True
+    return False
+
+
+def get_shared_best():
+    """
+    Gets the best assignment found by any chain
+    :return: Assignment and its metric
+    """
+    with best_metric.get_lock():
+        return list(best_assignment), best_metric.value
+
+
+def get_neighbor(assignment, rng):
+    """
+    Changes the motif of one randomly picked zone to another of its candidates
+    :param assignment: Index of the candidate motif of every zone
+    :param rng: Random generator of the chain
+    :return: Neighboring assignment (None if no zone has more than one candidate)
+    """
+    zones = [l for l in range(len(assignment)) if len(zone_motifs[l]) > 1]
+    if not zones:
+        return None
+    l = rng.choice(zones)
+    neighbor = list(assignment)
+    neighbor[l] = rng.choice([cnt for cnt in range(len(zone_motifs[l])) if cnt != assignment[l]])
+    return neighbor
+
+
+def run_chain(chain):
+    """
+    Runs one simulated annealing chain until the budget is used up (pool worker)
+    :param chain: Chain index, also offsetting the random seed; chain 0 starts from the initial assignment if given
+    :return: List of (evaluations, seconds, wMetric) whenever the chain improved the shared best assignment
+    """
+    rng = random.Random(seed + chain)
+    if chain == 0 and initial_assignment is not None:
+        current = list(initial_assignment)
+    else:
+        current = [rng.randrange(len(motifs)) for motifs in zone_motifs]
+    current_metric = evaluate_isls(get_assignment_isls(current))["wMetric"]
+    chain_best_metric = current_metric
+    trace = []
+    if publish_best(current, current_metric):
+        trace.append((evaluation_count.value, time.time() - start_time, current_metric))
+    stagnation = 0
+    while get_progress() < 1.0:
+        temperature = initial_temperature * (final_temperature / initial_temperature) ** get_progress()
+        candidate = get_neighbor(current, rng)
+        if candidate is None:
+            break
+        # The acceptance threshold is drawn before the evaluation, so a candidate is rejected as soon as its metric
+        # provably exceeds it
+        threshold = current_metric - temperature * math.log(1.0 - rng.random())
+        result = evaluate_isls(get_assignment_isls(candidate), threshold)
+        if not result.get("pruned") and result["wMetric"] < threshold:
+            current = candidate
+            current_metric = result["wMetric"]
+            if publish_best(current, current_metric):
+                trace.append((evaluation_count.value, time.time() - start_time, current_metric))
+        if current_metric < chain_best_metric:
+            chain_best_metric = current_metric
+            stagnation = 0
+        else:
+            stagnation += 1
+        if stagnation >= restart_after:
+            shared_assignment, shared_metric = get_shared_best()
+            if shared_metric < current_metric:
+                current = shared_assignment
+                current_metric = shared_metric
+            stagnation = 0
+    return trace
+
+
+def read_initial_assignment(motif_file):
+    """
+    Reads a level_wise_best_motif.txt file as the initial assignment; motifs that are not among the candidates of
+    their zone are added to them
+    :param motif_file: File with one line per zone: bottom latitude, top latitude, wStretch, wHop, wMetric and the
+                       motif offsets
+    :return: Index of the candidate motif of every zone
+    """
+    lines = [line.rstrip('\n').split(",") for line in open(motif_file) if line.strip()]
+    if [float(val[0]) for val in lines] != levels[:-1] or [float(val[1]) for val in lines] != levels[1:]:
+        raise ValueError("Zones of " + motif_file + " do not match the boundaries " + str(levels))
+    assignment = []
+    for l in range(len(lines)):
+        offsets = [int(offset) for offset in lines[l][5:9]]
+        for cnt in range(len(zone_motifs[l])):
+            motif = zone_motifs[l][cnt]
+            if offsets == [motif["sat_1_orb_offset"], motif["sat_1_sat_offset"], motif["sat_2_orb_offset"],
+                           motif["sat_2_sat_offset"]]:
+                assignment.append(cnt)
+                break
+        else:
+            zone_motifs[l].append({
+                "sat_1_orb_offset": offsets[0],
+                "sat_1_sat_offset": offsets[1],
+                "sat_2_orb_offset": offsets[2],
+                "sat_2_sat_offset": offsets[3]
+            })
+            assignment.append(len(zone_motifs[l]) - 1)
+    return assignment
+
+
+# =====================================================================
+# INPUTS
+# =====================================================================
+
+parser = argparse.ArgumentParser(description="Optimize the motifs of all latitude zones jointly")
+parser.add_argument("config", help="40_40_53deg, kuiper_p1, starlink_p1")
+parser.add_argument("max_isl_length", help="5014/1467 (for 40_40_53deg), 5440/1761 (kuiper_p1), 5014/2006 (starlink_p1)")
+parser.add_argument("cores", type=int, help="Number of parallel chains")
+parser.add_argument("--boundaries", type=float, nargs="+", default=[0.0, 18.0, 36.0, 90.0],
+                    help="Zone boundaries in degrees, from 0 to 90")
+parser.add_argument("--max-evaluations", type=int,
+                    help="Number of assignments evaluated by all chains together, cached ones included "
+                         "(default 200 without --time-limit)")
+parser.add_argument("--time-limit", type=float, help="Seconds the chains may run")
+parser.add_argument("--initial", help="level_wise_best_motif.txt to start chain 0 from, e.g. the greedy result")
+parser.add_argument("--initial-temperature", type=float, default=0.1,
+                    help="wMetric increase accepted with probability 1/e at the start")
+parser.add_argument("--final-temperature", type=float, default=0.001,
+                    help="wMetric increase accepted with probability 1/e when the budget is used up")
+parser.add_argument("--restart-after", type=int, default=20,
+                    help="Steps without improvement after which a chain restarts from the shared best assignment")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output-dir", default="../output_data_generated/optimized_motif")
+args = parser.parse_args()
+
+config = args.config
+max_isl_length = args.max_isl_length
+CORE_CNT = args.cores
+levels = args.boundaries
+max_evaluations = args.max_evaluations
+time_limit = args.time_limit
+if max_evaluations is None and time_limit is None:
+    max_evaluations = 200
+initial_temperature = args.initial_temperature
+final_temperature = args.final_temperature
+restart_after = args.restart_after
+seed = args.seed
+if levels[0] != 0.0 or levels[-1] != 90.0 or any(levels[l] >= levels[l + 1] for l in range(len(levels) - 1)):
+    parser.error("--boundaries must increase from 0 to 90")
+if not 0.0 < final_temperature <= initial_temperature:
+    parser.error("temperatures must satisfy 0 < --final-temperature <= --initial-temperature")
+
+satPositionsFile = "../input_data/constellation_" + config + "/data_sat_position/sat_positions_0.txt"
+validISLFile = "../input_data/constellation_" + config + "/data_validISLs_" + max_isl_length + "/valid_ISLs_0.txt"
+cityPositionsFile = "../input_data/data_cities/cities.txt"
+cityCoverageFile = "../input_data/constellation_" + config + "/data_coverage/city_coverage_0.txt"
+cityPairFile = "../input_data/data_cities/city_pairs_rand_5K.txt"
+baseline_config_file = "../input_data/baseline_config.txt"
+
+NUM_ORBITS = -1
+NUM_SATS_PER_ORBIT = -1
+if config == "40_40_53deg":
+    NUM_ORBITS = 40
+    NUM_SATS_PER_ORBIT = 40
+elif config == "kuiper_p1":
+    NUM_ORBITS = 34
+    NUM_SATS_PER_ORBIT = 34
+elif config == "starlink_p1":
+    NUM_ORBITS = 24
+    NUM_SATS_PER_ORBIT = 66
+else:
+    print("Unable to identify configuration: "+config)
+    exit(1)
+
+# =====================================================================
+# READING INPUTS
+# =====================================================================
+
+read_sat_positions(satPositionsFile)
+valid_isls = util.read_valid_isls(validISLFile)
+city_positions, _ = util.read_city_positions(cityPositionsFile, None)
+city_pairs = util.read_city_pair_file(cityPairFile)
+city_pair_groups = metric.group_city_pairs_by_source(city_pairs)
+city_coverage_index = util.build_city_coverage_index(util.read_city_coverage(cityCoverageFile))
+pair_bounds = metric.get_pair_lower_bounds(city_pairs, city_coverage_index, sat_cartesian)
+
+input_digest = result_cache.get_input_digest([satPositionsFile, cityCoverageFile, cityPositionsFile, cityPairFile])
+cached_results = result_cache.load_results(result_cache.DEFAULT_CACHE_FILE)
+cache_writer = result_cache.open_results(result_cache.DEFAULT_CACHE_FILE)
+
+for l in range(len(levels) - 1):
+    motifs = util.find_zone_motif_possibilities(valid_isls, sat_positions, orb_0_sat_positions, NUM_ORBITS,
+                                                NUM_SATS_PER_ORBIT, levels[l], levels[l + 1])
+    zone_motifs.append([motifs[cnt] for cnt in range(len(motifs))])
+    print("zone", levels[l], "-", levels[l + 1], ": candidate motifs", len(zone_motifs[l]))
+if any(len(motifs) == 0 for motifs in zone_motifs):
+    print("A zone has no candidate motif")
+    exit(1)
+initial_assignment = read_initial_assignment(args.initial) if args.initial else None
+
+# =====================================================================
+# OPTIMIZATION
+# =====================================================================
+
+best_metric = multiprocessing.get_context("fork").Value("d", float("inf"))
+best_assignment = multiprocessing.get_context("fork").Array("i", len(zone_motifs))
+evaluation_count = multiprocessing.get_context("fork").Value("i", 0)
+start_time = time.time()
+pool = multiprocessing.get_context("fork").Pool(CORE_CNT)
+traces = pool.map(run_chain, range(CORE_CNT))
+pool.close()
+pool.join()
+assignment, wMetric = get_shared_best()
+print("best assignment:", assignment, ", wMetric:", wMetric, ", evaluations:", evaluation_count.value)
+
+# =====================================================================
+# OUTPUTS
+# =====================================================================
+
+if not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+
+# Every zone line carries the metric of the lower zones plus the motif of the zone applied above its lower latitude,
+# as written by find_multi_motifs.py
+writer_level_wise_best_motif = open(os.path.join(args.output_dir, "level_wise_best_motif.txt"), 'w')
+for l in range(len(assignment)):
+    motif = zone_motifs[l][assignment[l]]
+    isls = get_assignment_isls(assignment[:l]) if l > 0 else csr_graph.empty_isls()
+    isls = csr_graph.build_zone_isls(orbit_slot_index, [get_zone(l, motif, False)], sat_cartesian, sat_abs_lat_deg,
+                                     isls)
+    zone_metric = evaluate_isls(isls)
+    writer_level_wise_best_motif.write(
+        str(levels[l]) + "," + str(levels[l + 1]) + "," + str(zone_metric["avgWeightedStretch"]) + "," + str(
+            zone_metric["avgWeightedHopCount"]) + "," + str(zone_metric["wMetric"]) + "," + str(
+            motif["sat_1_orb_offset"]) + "," + str(motif["sat_1_sat_offset"]) + "," + str(
+            motif["sat_2_orb_offset"]) + "," + str(motif["sat_2_sat_offset"]) + "\n")
+writer_level_wise_best_motif.close()
+
+# Print ISLs corresponding to the best assignment
+isls = get_assignment_isls(assignment)
+with open(os.path.join(args.output_dir, "best_motif_overall.txt"), 'w') as writer:
+    for sat_1, sat_2 in zip(isls["sat_1"].tolist(), isls["sat_2"].tolist()):
+        writer.write(str(sat_1) + "," + str(sat_2) + "\n")
+
+# Compute Phi-improvement over baseline
+val = open(baseline_config_file).readline().rstrip('\n').split(",")
+baseline_zone = {
+    "lat_bottom": float(val[0]),
+    "lat_top": None,
+    "motif": {
+        "sat_1_orb_offset": int(val[2]),
+        "sat_1_sat_offset": int(val[3]),
+        "sat_2_orb_offset": int(val[4]),
+        "sat_2_sat_offset": int(val[5])
+    }
+}
+baseline_metric = evaluate_isls(csr_graph.build_zone_isls(orbit_slot_index, [baseline_zone], sat_cartesian,
+                                                          sat_abs_lat_deg))
+reduction = (baseline_metric["wMetric"] - wMetric) * 100 / baseline_metric["wMetric"]
+print(baseline_metric["wMetric"], wMetric, reduction)
+with open(os.path.join(args.output_dir, "metric_improvement.txt"), 'w') as writer:
+    writer.write(str(reduction))
+
+with open(os.path.join(args.output_dir, "optimization_trace.txt"), 'w') as writer:
+    for evaluations, seconds, trace_metric in sorted(entry for trace in traces for entry in trace):
+        writer.write(str(evaluations) + "," + str(seconds) + "," + str(trace_metric) + "\n")
+cache_writer.close()
@@ -0,0 +1,162 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Instrumentation of motif sweeps. Every evaluated motif yields a record with the worker that ran it, the time the
+# task waited in the pool queue and the time spent per stage (graph build, coverage attach, path search,
+# aggregation), appended to a JSON lines log by the parent process. A progress line with throughput and ETA is
+# printed as results arrive, and a per-worker summary at the end of every sweep shows stragglers and idle workers.
+
+import json
+import multiprocessing
+import os
+import time
+
+STAGES = ["graph_build", "coverage_attach", "path_search", "aggregation"]
+
+
+def add_stage_time(stage_times, stage, start):
+    """
+    Adds the time elapsed since start to a stage
+    :param stage_times: Mapping from stage to seconds, updated in place (None to skip the accounting)
+    :param stage: Stage name, one of STAGES
+    :param start: Output of time.perf_counter when the stage started
+    :return: Output of time.perf_counter now, the start of the next stage
+    """
+    now = time.perf_counter()
+    if stage_times is not None:
+        stage_times[stage] = stage_times.get(stage, 0.0) + now - start
+    return now
+
+
+def start_record(submitted, fields=None):
+    """
+    Starts the record of a task inside a pool worker
+    :param submitted: Output of time.time when the task was handed to the pool
+    :param fields: Additional fields describing the task (optional)
+    :return: Record
+    """
+    record = {
+        "worker": multiprocessing.current_process().name,
+        "pid": os.getpid(),
+        "queue_wait": max(0.0, time.time() - submitted),
+        "stages": {stage: 0.0 for stage in STAGES},
+        "perf_start": time.perf_counter()
+    }
+    record.update(fields or {})
+    return record
+
+
+def finish_record(record, num_pairs, result):
+    """
+    Completes the record of a task once its metric is computed
+    :param record: Output of start_record
+    :param num_pairs: Number of city pairs evaluated
+    :param result: Aggregated metric values of the task
+    :return: Record
+    """
+    record["seconds"] = time.perf_counter() - record.pop("perf_start")
+    record["pairs"] = num_pairs
+    record["pairs_per_s"] = num_pairs / record["seconds"] if record["seconds"] > 0 else None
+    record["wMetric"] = result["wMetric"]
+    for flag in ("pruned", "stopped", "failed"):
+        if result.get(flag):
+            record[flag] = True
+    return record
+
+
+def open_log(log_file):
+    """
+    Opens the JSON lines log for appending records
+    :param log_file: Log file (None to disable the log)
+    :return: Writer, or None
+    """
+    if log_file is None:
+        return None
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    return open(log_file, "a")
+
+
+def start_progress(label, total):
+    """
+    Starts tracking the progress of a sweep
+    :param label: Name of the sweep printed with every progress line
+    :param total: Number of tasks of the sweep
+    :return: Progress
+    """
+    return {
+        "label": label,
+        "total": total,
+        "done": 0,
+        "pairs": 0,
+        "start": time.time(),
+        "records": []
+    }
+
+
+def update_progress(progress, record, writer=None):
+    """
+    Accounts for a finished task, logs its record and prints the progress of the sweep
+    :param progress: Output of start_progress
+    :param record: Output of finish_record
+    :param writer: Output of open_log (optional)
+    """
+    progress["done"] += 1
+    progress["pairs"] += record["pairs"]
+    progress["records"].append(record)
+    record = dict(record, sweep=progress["label"], finished=time.time())
+    if writer is not None:
+        writer.write(json.dumps(record) + "\n")
+        writer.flush()
+    elapsed = time.time() - progress["start"]
+    eta = elapsed / progress["done"] * (progress["total"] - progress["done"])
+    print("progress " + progress["label"] + ": " + str(progress["done"]) + "/" + str(progress["total"])
+          + " motifs, " + "%.1f" % elapsed + " s elapsed, " + "%.0f" % (progress["pairs"] / max(elapsed, 1e-9))
+          + " pairs/s, ETA " + "%.1f" % eta + " s")
+
+
+def print_worker_summary(progress):
+    """
+    Prints how busy every worker was during a sweep and its slowest task. Workers far below full utilization
+    mean more cores than tasks, a slowest task far above the median one is a straggler holding up the sweep.
+    :param progress: Output of start_progress after the sweep
+    """
+    records = progress["records"]
+    if not records:
+        return
+    elapsed = max(time.time() - progress["start"], 1e-9)
+    workers = {}
+    for record in records:
+        workers.setdefault(record["worker"], []).append(record)
+    print("sweep " + progress["label"] + ": " + "%.1f" % elapsed + " s, " + str(len(workers)) + " workers")
+    for stage in STAGES:
+        print("  " + stage + ": " + "%.2f" % sum(record["stages"][stage] for record in records) + " s")
+    for worker in sorted(workers):
+        busy = sum(record["seconds"] for record in workers[worker])
+        slowest = max(workers[worker], key=lambda record: record["seconds"])
+        print("  " + worker + ": " + str(len(workers[worker])) + " motifs, busy " + "%.1f" % busy + " s ("
+              + "%.0f" % (100 * busy / elapsed) + "%), mean queue wait "
+              + "%.1f" % (sum(record["queue_wait"] for record in workers[worker]) / len(workers[worker]))
+              + " s, slowest " + "%.1f" % slowest["seconds"] + " s")
+    seconds = sorted(record["seconds"] for record in records)
+    print("  median motif " + "%.1f" % seconds[len(seconds) // 2] + " s, slowest " + "%.1f" % seconds[-1] + " s")
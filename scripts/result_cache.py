@@ -0,0 +1,187 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Persistent cache of motif evaluation results. Each result is appended to a JSON lines file as soon as it is
+# computed, keyed by a hash of everything the metric depends on: the snapshot and city input files, the ISLs fixed
+# before the motif is added, the latitude level the motif applies to and the motif offsets. An interrupted sweep
+# resumes where it stopped and repeated runs do not recompute anything.
+
+import hashlib
+import json
+import os
+import numpy as np
+
+try:
+    from . import csr_graph
+except (ImportError, SystemError):
+    import csr_graph
+
+CACHE_VERSION = 1  # Bump when the metric computation changes so older results are not reused
+# Engines computing the metric. The search (and the bounded search of --prune, which runs the same single source
+# searches and aggregation) is the reference; the others may differ in the last bits and are cached apart.
+REFERENCE_ENGINE = "search"
+ENGINES = [REFERENCE_ENGINE, "matrix", "astar"]
+DEFAULT_CACHE_FILE = "../output_data_generated/motif_cache/motif_results.jsonl"
+
+
+def get_file_digest(file_name):
+    """
+    Hashes the content of a file
+    :param file_name: File to hash
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    with open(file_name, "rb") as reader:
+        for block in iter(lambda: reader.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_input_digest(file_names):
+    """
+    Hashes a list of input files, e.g. satellite positions, city coverage, cities and city pairs
+    :param file_names: Input files, in a fixed order
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    for file_name in file_names:
+        digest.update(get_file_digest(file_name).encode())
+    return digest.hexdigest()
+
+
+def get_isls_digest(isls):
+    """
+    Hashes an ISL set (see csr_graph.empty_isls)
+    :param isls: ISL set
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    for name in ("sat_1", "sat_2", "length"):
+        digest.update(isls[name].tobytes())
+    return digest.hexdigest()
+
+
+def get_topology_digest(isls):
+    """
+    Hashes the topology of an ISL set (see csr_graph.get_canonical_isls), so equivalent motifs share the digest
+    :param isls: ISL set
+    :return: Hex digest
+    """
+    digest = hashlib.sha256()
+    for sats in csr_graph.get_canonical_isls(isls):
+        digest.update(sats.astype(np.int32).tobytes())
+    return digest.hexdigest()
+
+
+def get_engine_description(description, engine):
+    """
+    Adds the evaluation engine to a cache key description. Engines other than the reference search (see
+    REFERENCE_ENGINE) may differ from it in the last bits, so their results are kept apart. Reference keys are left
+    unchanged, so caches written before engines were told apart stay valid.
+    :param description: List describing the evaluation
+    :param engine: Name of the engine computing the metric ("search", "matrix" or "astar")
+    :return: Description including the engine
+    """
+    if engine not in ENGINES:
+        raise ValueError("Unknown evaluation engine: " + str(engine))
+    if engine == REFERENCE_ENGINE:
+        return description
+    return description + [engine]
+
+
+def get_motif_key(input_digest, isls_digest, lat_level, motif, engine=REFERENCE_ENGINE):
+    """
+    Computes the cache key of a motif evaluation
+    :param input_digest: Output of get_input_digest
+    :param isls_digest: Output of get_isls_digest for the ISLs present before the motif is added
+    :param lat_level: Latitude above which the motif is applied (None if it applies everywhere)
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :param engine: Name of the engine computing the metric, see get_engine_description
+    :return: Hex digest
+    """
+    description = [CACHE_VERSION, input_digest, isls_digest, lat_level,
+                   motif["sat_1_orb_offset"], motif["sat_1_sat_offset"],
+                   motif["sat_2_orb_offset"], motif["sat_2_sat_offset"]]
+    description = get_engine_description(description, engine)
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+def get_topology_key(input_digest, isls, engine=REFERENCE_ENGINE):
+    """
+    Computes the cache key of a complete satellite graph, independent of the motifs that produced it
+    :param input_digest: Output of get_input_digest
+    :param isls: ISL set of the graph
+    :param engine: Name of the engine computing the metric, see get_engine_description
+    :return: Hex digest
+    """
+    description = get_engine_description([CACHE_VERSION, input_digest, get_topology_digest(isls)], engine)
+    return hashlib.sha256(json.dumps(description).encode()).hexdigest()
+
+
+def load_results(cache_file):
+    """
+    Loads all cached results. A line cut short by an interrupted run is ignored.
+    :param cache_file: Cache file
+    :return: Mapping from key to the aggregated metric values
+    """
+    results = {}
+    if not os.path.exists(cache_file):
+        return results
+    with open(cache_file) as reader:
+        for line in reader:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            results[entry["key"]] = entry["result"]
+    return results
+
+
+def open_results(cache_file):
+    """
+    Opens the cache file for appending results
+    :param cache_file: Cache file
+    :return: Writer
+    """
+    cache_dir = os.path.dirname(cache_file)
+    if cache_dir and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    writer = open(cache_file, "a")
+    if writer.tell() > 0:
+        with open(cache_file, "rb") as reader:
+            reader.seek(-1, os.SEEK_END)
+            if reader.read(1) != b"\n":
+                # Terminate a line cut short by an interrupted run so the next result starts on its own line
+                writer.write("\n")
+    return writer
+
+
+def append_result(writer, key, result):
+    """
+    Persists one result immediately, so it survives the process being killed
+    :param writer: Output of open_results
+    :param key: Output of get_motif_key
+    :param result: Aggregated metric values (wMetric, avgWeightedStretch, avgWeightedHopCount)
+    """
+    writer.write(json.dumps({"key": key, "result": result}) + "\n")
+    writer.flush()
+    os.fsync(writer.fileno())
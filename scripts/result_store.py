@@ -0,0 +1,383 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2019 Debopam Bhattacherjee
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# Run results as one self-describing dataset: a motif table (offsets, metrics, status and timings of every motif of
+# every zone node) and an edge table (ISLs of the resulting graphs with their length and zone), stored with the run
+# metadata in a compressed NPZ file. Rows are streamed to a spool file next to the dataset as they are produced, so
+# an interrupted run keeps them (see read_spool), and packed into the NPZ file when the run completes. The legacy
+# text outputs are exported from the dataset.
+#
+# Example (analysis):
+#   dataset = result_store.load_dataset("../output_data_generated/multi_motif/results.npz")
+#   motifs = dataset["motifs"][dataset["motifs"]["status"] == "evaluated"]
+#
+# Example (legacy text outputs of an existing dataset):
+#   python3 result_store.py ../output_data_generated/multi_motif/results.npz --output-dir /tmp/multi_motif
+
+import argparse
+import json
+import os
+import numpy as np
+
+DATASET_VERSION = 1
+SPOOL_SUFFIX = ".spool"
+
+# status: evaluated on all pairs, cached (taken from result_cache), pruned (wMetric is the lower bound reached),
+# screened (left out after sampling) or failed (a sampled pair is unreachable). Motifs inducing the same ISLs are
+# run once; shared is set where the timings are those of such an equivalent motif (NaN if none was run, i.e. for
+# cached motifs), so they are only counted once when summed over rows without shared. Sample columns are
+# NaN and sample_draws 0 for motifs that were not sampled; level and next_level are NaN for motifs applied to all
+# latitudes.
+MOTIF_DTYPE = np.dtype([("node", "U128"), ("zone", np.int32), ("level", np.float64), ("next_level", np.float64),
+                        ("motif_cnt", np.int32), ("sat_1_id", np.int32), ("sat_2_id", np.int32),
+                        ("sat_1_orb_offset", np.int32), ("sat_1_sat_offset", np.int32),
+                        ("sat_2_orb_offset", np.int32), ("sat_2_sat_offset", np.int32),
+                        ("wStretch", np.float64), ("wHop", np.float64), ("wMetric", np.float64),
+                        ("status", "U10"), ("best", np.bool_), ("shared", np.bool_),
+                        ("seconds", np.float64), ("queue_wait", np.float64), ("graph_build", np.float64),
+                        ("coverage_attach", np.float64), ("path_search", np.float64), ("aggregation", np.float64),
+                        ("pairs", np.int64), ("sample_draws", np.int32), ("sample_wStretch", np.float64),
+                        ("sample_wStretchCI", np.float64), ("sample_wHop", np.float64),
+                        ("sample_wHopCI", np.float64), ("sample_wMetric", np.float64),
+                        ("sample_wMetricCI", np.float64)])
+# graph: level_<zone> for the graph with the best motif of a zone applied above its lower latitude, overall for the
+# final graph of a configuration. level is NaN, zone 0 and color empty for ISLs of motifs applied to all latitudes.
+EDGE_DTYPE = np.dtype([("configuration", "U128"), ("graph", "U16"), ("sat_1", np.int32), ("sat_2", np.int32),
+                       ("length", np.float64), ("zone", np.int32), ("level", np.float64), ("color", "U16")])
+TABLES = {
+    "motifs": MOTIF_DTYPE,
+    "edges": EDGE_DTYPE
+}
+STAGE_COLUMNS = ["graph_build", "coverage_attach", "path_search", "aggregation"]
+
+
+def get_motif_row(node, zone, level, next_level, motif, status, best, shared=False, records=None, estimate=None):
+    """
+    Builds the motif table row of a motif
+    :param node: Name of the zone node, e.g. the zone boundaries up to the upper one joined by underscores
+    :param zone: Zone index
+    :param level: Lower latitude of the zone (None if the motif applies to all latitudes)
+    :param next_level: Upper latitude of the zone (None if the motif applies to all latitudes)
+    :param motif: Motif with its offsets and aggregated metric values
+    :param status: One of evaluated, cached, pruned, screened, failed
+    :param best: Whether the motif is the best one of its zone node
+    :param shared: Whether the records are those of an equivalent motif rather than of this one
+    :param records: Profiling records of the evaluation (profiling.finish_record), summed up (optional)
+    :param estimate: Sampled estimate of the motif (metric.get_sample_estimate, optional)
+    :return: Tuple in MOTIF_DTYPE order
+    """
+    records = records or []
+    nan = float("nan")
+    timings = [sum(record["seconds"] for record in records) if records else nan,
+               sum(record["queue_wait"] for record in records) if records else nan]
+    timings += [sum(record["stages"][stage] for record in records) if records else nan for stage in STAGE_COLUMNS]
+    sample = [0] + [nan] * 6
+    if estimate is not None:
+        sample = [estimate["numDraws"], estimate["avgWeightedStretch"], estimate["avgWeightedStretchCI"],
+                  estimate["avgWeightedHopCount"], estimate["avgWeightedHopCountCI"], estimate["wMetric"],
+                  estimate["wMetricCI"]]
+
+    def get_value(value):
+        return nan if value is None or value == -1.0 and status in ("pruned", "screened") else value
+
+    return tuple([node, zone, nan if level is None else level, nan if next_level is None else next_level,
+                  motif["motif_cnt"], motif["sat_1_id"], motif["sat_2_id"], motif["sat_1_orb_offset"],
+                  motif["sat_1_sat_offset"], motif["sat_2_orb_offset"], motif["sat_2_sat_offset"],
+                  get_value(motif["wStretch"]), get_value(motif["wHop"]), get_value(motif.get("wMetric")), status,
+                  best, shared] + timings + [sum(record["pairs"] for record in records)] + sample)
+
+
+def get_edge_rows(grph, configuration, graph_name, levels=None):
+    """
+    Builds the edge table rows of a graph, in the order of its edges
+    :param grph: networkx graph whose ISLs have a length and, for zone motifs, a level and color attribute
+    :param configuration: Name of the zone configuration
+    :param graph_name: level_<zone> or overall
+    :param levels: Zone boundaries of the configuration, to map the level of an ISL to its zone (optional)
+    :return: List of tuples in EDGE_DTYPE order
+    """
+    rows = []
+    for sat_1, sat_2, data in grph.edges(data=True):
+        level = data.get("level")
+        zone = levels.index(level) if levels is not None and level in levels else 0
+        rows.append((configuration, graph_name, sat_1, sat_2, data["length"], zone,
+                     float("nan") if level is None else level, data.get("color", "")))
+    return rows
+
+
+def open_dataset(file_name, metadata):
+    """
+    Starts a dataset, streaming its rows to a spool file until close_dataset
+    :param file_name: Dataset file (.npz)
+    :param metadata: JSON serializable description of the run
+    :return: Dataset writer
+    """
+    dataset_dir = os.path.dirname(file_name)
+    if dataset_dir and not os.path.isdir(dataset_dir):
+        os.makedirs(dataset_dir)
+    return {
+        "file_name": file_name,
+        "metadata": dict(metadata, version=DATASET_VERSION),
+        "spool": open(file_name + SPOOL_SUFFIX, "wb")
+    }
+
+
+def append_rows(dataset, table, rows):
+    """
+    Appends rows to a table of the dataset and flushes them to the spool file
+    :param dataset: Output of open_dataset
+    :param table: motifs or edges
+    :param rows: List of tuples in the dtype order of the table
+    """
+    if not rows:
+        return
+    np.save(dataset["spool"], np.array([table]))
+    np.save(dataset["spool"], np.array(rows, dtype=TABLES[table]))
+    dataset["spool"].flush()
+
+
+def read_spool(spool_file):
+    """
+    Reads the rows streamed to a spool file, including those of an interrupted run
+    :param spool_file: Spool file
+    :return: Mapping from table name to structured array
+    """
+    chunks = {table: [] for table in TABLES}
+    with open(spool_file, "rb") as reader:
+        while True:
+            try:
+                table = str(np.load(reader)[0])
+                rows = np.load(reader)
+            except (EOFError, ValueError):
+                # End of the file, or a chunk cut short by an interrupted run
+                break
+            chunks[table].append(rows)
+    return {table: np.concatenate(chunks[table]) if chunks[table] else np.zeros(0, dtype=TABLES[table])
+            for table in TABLES}
+
+
+def close_dataset(dataset, metadata=None):
+    """
+    Packs the streamed rows and the metadata into the dataset file and removes the spool file
+    :param dataset: Output of open_dataset
+    :param metadata: Metadata known only at the end of the run, merged into the initial one (optional)
+    :return: Dataset as returned by load_dataset
+    """
+    dataset["spool"].close()
+    spool_file = dataset["file_name"] + SPOOL_SUFFIX
+    tables = read_spool(spool_file)
+    dataset["metadata"].update(metadata or {})
+    tmp_file = dataset["file_name"] + ".tmp" + str(os.getpid())
+    with open(tmp_file, "wb") as writer:
+        np.savez_compressed(writer, metadata=np.array(json.dumps(dataset["metadata"])), **tables)
+    os.replace(tmp_file, dataset["file_name"])
+    os.remove(spool_file)
+    return dict(tables, metadata=dataset["metadata"])
+
+
+def load_dataset(file_name):
+    """
+    Loads a dataset
+    :param file_name: Dataset file (.npz)
+    :return: Mapping with the metadata and a structured array per table
+    """
+    with np.load(file_name) as data:
+        dataset = {table: data[table] for table in TABLES}
+        dataset["metadata"] = json.loads(str(data["metadata"]))
+    return dataset
+
+
+def export_edges(edges, file_name):
+    """
+    Writes ISLs in the legacy format (satellite 1, satellite 2)
+    :param edges: Edge table rows of one graph, in graph order
+    :param file_name: Output file
+    """
+    with open(file_name, "w") as writer:
+        for sat_1, sat_2 in zip(edges["sat_1"].tolist(), edges["sat_2"].tolist()):
+            writer.write(str(sat_1) + "," + str(sat_2) + "\n")
+
+
+def export_motif_metrics(motifs, file_name):
+    """
+    Writes the metrics of the motifs of a zone node in the legacy multi motif format (counter, stretch, hop count,
+    metric); pruned and screened motifs are left out
+    :param motifs: Motif table rows of the zone node
+    :param file_name: Output file
+    """
+    with open(file_name, "w") as writer:
+        for row in motifs.tolist():
+            row = dict(zip(MOTIF_DTYPE.names, row))
+            if row["status"] in ("pruned", "screened"):
+                continue
+            writer.write(str(row["motif_cnt"]) + "," + str(row["wStretch"]) + "," + str(row["wHop"]) + ","
+                         + str(row["wMetric"]) + "\n")
+
+
+def export_single_motif_metrics(motifs, file_name):
+    """
+    Writes motif metrics in the legacy single motif format (counter, satellite 1, satellite 2, stretch, hop count);
+    pruned motifs are left out
+    :param motifs: Motif table rows
+    :param file_name: Output file
+    """
+    with open(file_name, "w") as writer:
+        for row in motifs.tolist():
+            row = dict(zip(MOTIF_DTYPE.names, row))
+            if row["status"] == "pruned":
+                continue
+            writer.write(str(row["motif_cnt"]) + "," + str(row["sat_1_id"]) + "," + str(row["sat_2_id"]) + ","
+                         + str(row["wStretch"]) + "," + str(row["wHop"]) + "\n")
+
+
+def export_pruned_motifs(motifs, file_name):
+    """
+    Writes the pruned motifs with the lower bound they reached (counter, metric lower bound)
+    :param motifs: Motif table rows of a zone node
+    :param file_name: Output file
+    """
+    pruned = np.sort(motifs[motifs["status"] == "pruned"], order="motif_cnt")
+    with open(file_name, "w") as writer:
+        for cnt, wMetric in zip(pruned["motif_cnt"].tolist(), pruned["wMetric"].tolist()):
+            writer.write(str(cnt) + "," + str(wMetric) + "\n")
+
+
+def export_sampled_motifs(motifs, file_name):
+    """
+    Writes the sampled estimates (counter, draws, stretch and confidence interval half width, hop count and half
+    width, metric and half width, whether the motif was kept as a contender)
+    :param motifs: Motif table rows of a zone node
+    :param file_name: Output file
+    """
+    sampled = np.sort(motifs[motifs["sample_draws"] > 0], order="motif_cnt")
+    with open(file_name, "w") as writer:
+        for row in sampled.tolist():
+            row = dict(zip(MOTIF_DTYPE.names, row))
+            writer.write(str(row["motif_cnt"]) + "," + str(row["sample_draws"]) + "," + str(row["sample_wStretch"])
+                         + "," + str(row["sample_wStretchCI"]) + "," + str(row["sample_wHop"]) + ","
+                         + str(row["sample_wHopCI"]) + "," + str(row["sample_wMetric"]) + ","
+                         + str(row["sample_wMetricCI"]) + "," + str(int(row["status"] != "screened")) + "\n")
+
+
+def export_level_wise_best_motif(best_motifs, file_name):
+    """
+    Writes the best motif of every zone (lower and upper latitude, stretch, hop count, metric, offsets)
+    :param best_motifs: Motif table rows of the best motifs in zone order
+    :param file_name: Output file
+    """
+    with open(file_name, "w") as writer:
+        for row in best_motifs.tolist():
+            row = dict(zip(MOTIF_DTYPE.names, row))
+            writer.write(str(row["level"]) + "," + str(row["next_level"]) + "," + str(row["wStretch"]) + ","
+                         + str(row["wHop"]) + "," + str(row["wMetric"]) + "," + str(row["sat_1_orb_offset"]) + ","
+                         + str(row["sat_1_sat_offset"]) + "," + str(row["sat_2_orb_offset"]) + ","
+                         + str(row["sat_2_sat_offset"]) + "\n")
+
+
+def get_node_name(boundaries):
+    """
+    Names a zone node or configuration after its boundaries
+    :param boundaries: Zone boundaries in degrees
+    :return: Boundaries joined by underscores
+    """
+    return "_".join(str(boundary) for boundary in boundaries)
+
+
+def export_multi_motif(dataset, output_dir):
+    """
+    Writes the legacy outputs of find_multi_motifs.py from its dataset: per configuration the level-wise files,
+    level_wise_best_motif.txt, best_motif_overall.txt and metric_improvement.txt, and zone_search.txt for a zone
+    boundary search
+    :param dataset: Output of load_dataset or close_dataset
+    :param output_dir: Output directory of the run
+    :return: List of (best metric, configuration name, improvement over the baseline in percent) per configuration
+    """
+    metadata = dataset["metadata"]
+    motifs = dataset["motifs"]
+    edges = dataset["edges"]
+    ranking = []
+    for configuration in metadata["configurations"]:
+        boundaries = configuration["boundaries"]
+        name = get_node_name(boundaries)
+        configuration_dir = os.path.join(output_dir, configuration["dir"])
+        if not os.path.isdir(configuration_dir):
+            os.makedirs(configuration_dir)
+        best_motifs = []
+        for l in range(len(boundaries) - 1):
+            node_motifs = motifs[motifs["node"] == get_node_name(boundaries[:l + 2])]
+            best_motifs.append(node_motifs[node_motifs["best"]][0])
+            export_motif_metrics(node_motifs, os.path.join(configuration_dir, "level_" + str(l) + "_motif_metrics.txt"))
+            if metadata["prune"]:
+                export_pruned_motifs(node_motifs,
+                                     os.path.join(configuration_dir, "level_" + str(l) + "_pruned_motifs.txt"))
+            if metadata["sample_size"] > 0:
+                export_sampled_motifs(node_motifs,
+                                      os.path.join(configuration_dir, "level_" + str(l) + "_sampled_motifs.txt"))
+            level_edges = edges[(edges["configuration"] == name) & (edges["graph"] == "level_" + str(l))]
+            export_edges(level_edges, os.path.join(configuration_dir, "level_" + str(l) + "_best_motif.txt"))
+        export_level_wise_best_motif(np.array(best_motifs, dtype=MOTIF_DTYPE),
+                                     os.path.join(configuration_dir, "level_wise_best_motif.txt"))
+        export_edges(edges[(edges["configuration"] == name) & (edges["graph"] == "overall")],
+                     os.path.join(configuration_dir, "best_motif_overall.txt"))
+
+        # Phi-improvement over baseline
+        best_motif_metric = float(best_motifs[-1]["wMetric"])
+        baseline_metric = metadata["baseline_wMetric"]
+        reduction = (baseline_metric - best_motif_metric) * 100 / baseline_metric
+        with open(os.path.join(configuration_dir, "metric_improvement.txt"), "w") as writer:
+            writer.write(str(reduction))
+        ranking.append((best_motif_metric, name, reduction))
+    if metadata["zone_search"]:
+        with open(os.path.join(output_dir, "zone_search.txt"), "w") as writer:
+            for best_motif_metric, name, reduction in sorted(ranking):
+                writer.write(name + "," + str(best_motif_metric) + "," + str(reduction) + "\n")
+    return ranking
+
+
+def export_single_motif(dataset, output_dir):
+    """
+    Writes the legacy outputs of find_single_motif.py from its dataset
+    :param dataset: Output of load_dataset or close_dataset
+    :param output_dir: Output directory of the run
+    """
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    motifs = dataset["motifs"]
+    export_single_motif_metrics(motifs, os.path.join(output_dir, "level_0_motif_metrics.txt"))
+    if dataset["metadata"]["prune"]:
+        export_pruned_motifs(motifs, os.path.join(output_dir, "level_0_pruned_motifs.txt"))
+    export_edges(dataset["edges"], os.path.join(output_dir, "level_0_best_motif.txt"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the legacy text outputs of a result dataset")
+    parser.add_argument("dataset", help="e.g. ../output_data_generated/multi_motif/results.npz")
+    parser.add_argument("--output-dir", help="Default: the directory of the dataset")
+    args = parser.parse_args()
+
+    loaded = load_dataset(args.dataset)
+    export_dir = args.output_dir or os.path.dirname(args.dataset) or "."
+    if loaded["metadata"]["script"] == "find_multi_motifs.py":
+        export_multi_motif(loaded, export_dir)
+    else:
+        export_single_motif(loaded, export_dir)
+    print("exported", args.dataset, "to", export_dir)
@@ -21,8 +21,16 @@
 # SOFTWARE.
 
 import math
+import numpy as np
 
-EARTH_RADIUS = 6371  # Kms
+try:
+    from . import geometry
+    from . import loader
+except (ImportError, SystemError):
+    import geometry
+    import loader
+
+EARTH_RADIUS = geometry.EARTH_RADIUS  # Kms
 
 
 def compute_isl_length(sat1, sat2, sat_positions):
@@ -34,16 +42,10 @@ def compute_isl_length(sat1, sat2, sat_positions):
     :param sat_positions: Collection of satellites along with their current position data
     :return: ISl length in km
     """
-    x1 = (EARTH_RADIUS + sat_positions[sat1]["alt_km"]) * math.cos(sat_positions[sat1]["lat_rad"]) * math.sin(
-        sat_positions[sat1]["long_rad"])
-    y1 = (EARTH_RADIUS + sat_positions[sat1]["alt_km"]) * math.sin(sat_positions[sat1]["lat_rad"])
-    z1 = (EARTH_RADIUS + sat_positions[sat1]["alt_km"]) * math.cos(sat_positions[sat1]["lat_rad"]) * math.cos(
-        sat_positions[sat1]["long_rad"])
-    x2 = (EARTH_RADIUS + sat_positions[sat2]["alt_km"]) * math.cos(sat_positions[sat2]["lat_rad"]) * math.sin(
-        sat_positions[sat2]["long_rad"])
-    y2 = (EARTH_RADIUS + sat_positions[sat2]["alt_km"]) * math.sin(sat_positions[sat2]["lat_rad"])
-    z2 = (EARTH_RADIUS + sat_positions[sat2]["alt_km"]) * math.cos(sat_positions[sat2]["lat_rad"]) * math.cos(
-        sat_positions[sat2]["long_rad"])
+    x1, y1, z1 = geometry.get_cartesian(sat_positions[sat1]["lat_rad"], sat_positions[sat1]["long_rad"],
+                                        sat_positions[sat1]["alt_km"])
+    x2, y2, z2 = geometry.get_cartesian(sat_positions[sat2]["lat_rad"], sat_positions[sat2]["long_rad"],
+                                        sat_positions[sat2]["alt_km"])
     dist = math.sqrt(math.pow((x2 - x1), 2) + math.pow((y2 - y1), 2) + math.pow((z2 - z1), 2))
     return dist
 
@@ -52,19 +54,18 @@ def read_city_positions(city_pos_file, graph):
     """
     eads city coordinates and population
     :param city_pos_file: file containing city coordinates and population
-    :param graph: The graph to populate
+    :param graph: The graph to populate (None to only read the cities)
     :return: collection of cities with coordinates and populations, updated graph
     """
     city_positions = {}
-    lines = [line.rstrip('\n') for line in open(city_pos_file)]
-    for i in range(len(lines)):
-        val = lines[i].split(",")
-        city_positions[int(val[0])] = {
-            "lat_deg": float(val[2]),
-            "long_deg": float(val[3]),
-            "pop": float(val[4])
+    for city, name, lat_deg, long_deg, pop in loader.load_city_positions(city_pos_file).tolist():
+        city_positions[city] = {
+            "lat_deg": lat_deg,
+            "long_deg": long_deg,
+            "pop": pop
         }
-        graph.add_node(int(val[0]))
+        if graph is not None:
+            graph.add_node(city)
     return city_positions, graph
 
 
@@ -75,13 +76,11 @@ def read_valid_isls(valid_isl_file):
     :return: Collection of valid ISLs
     """
     valid_isls = {}
-    lines = [line.rstrip('\n') for line in open(valid_isl_file)]
-    for i in range(len(lines)):
-        val = lines[i].split(",")
+    for i, (sat_1, sat_2, dist_km) in enumerate(loader.load_valid_isls(valid_isl_file).tolist()):
         valid_isls[i] = {
-            "sat_1": int(val[0]),
-            "sat_2": int(val[1]),
-            "dist_km": float(val[2])
+            "sat_1": sat_1,
+            "sat_2": sat_2,
+            "dist_km": dist_km
         }
     return valid_isls
 
@@ -93,13 +92,11 @@ def read_city_coverage(coverage_file):
     :return: Collection of city-satellite mappings
     """
     city_coverage = {}
-    lines = [line.rstrip('\n') for line in open(coverage_file)]
-    for i in range(len(lines)):
-        val = lines[i].split(",")
+    for i, (city, sat, dist) in enumerate(loader.load_city_coverage(coverage_file).tolist()):
         city_coverage[i] = {
-            "city": int(val[0]),
-            "sat": int(val[1]),
-            "dist": float(val[2])
+            "city": city,
+            "sat": sat,
+            "dist": dist
         }
     return city_coverage
 
@@ -111,18 +108,39 @@ def read_city_pair_file(city_pair_file):
     :return: Collection of city-city geodesic distances
     """
     city_pairs = {}
-    lines = [line.rstrip('\n') for line in open(city_pair_file)]
-    for i in range(len(lines)):
-        val = lines[i].split(",")
+    for i, (city_1, city_2, geo_dist) in enumerate(loader.load_city_pairs(city_pair_file).tolist()):
         city_pairs[i] = {
-            "city_1": int(val[0]),
-            "city_2": int(val[1]),
-            "geo_dist": float(val[2])
+            "city_1": city_1,
+            "city_2": city_2,
+            "geo_dist": geo_dist
         }
     return city_pairs
 
 
-def get_neighbor_satellite(sat1_orb, sat1_rel_id, sat2_orb, sat2_rel_id, sat_positions, num_orbits, num_sats_per_orbit):
+def build_orbit_slot_index(sat_positions, num_orbits, num_sats_per_orbit):
+    """
+    Builds the (orbit, slot) to satellite id lookup table once for a set of satellite positions
+    :param sat_positions: Collection of satellites with position data
+    :param num_orbits: Number of orbits in the constellation
+    :param num_sats_per_orbit: Number of satellites per orbit
+    :return: Index with per-satellite id, orbit and slot arrays (in sat_positions order) and the
+             num_orbits x num_sats_per_orbit lookup table (-1 where a slot is empty)
+    """
+    sat_ids = np.array(list(sat_positions.keys()), dtype=np.int32)
+    orb_ids = np.array([sat_positions[sat_id]["orb_id"] for sat_id in sat_positions], dtype=np.int32)
+    orb_sat_ids = np.array([sat_positions[sat_id]["orb_sat_id"] for sat_id in sat_positions], dtype=np.int32)
+    slot_to_sat = np.full((num_orbits, num_sats_per_orbit), -1, dtype=np.int32)
+    slot_to_sat[orb_ids, orb_sat_ids] = sat_ids
+    return {
+        "sat_id": sat_ids,
+        "orb_id": orb_ids,
+        "orb_sat_id": orb_sat_ids,
+        "slot_to_sat": slot_to_sat
+    }
+
+
+def get_neighbor_satellite(sat1_orb, sat1_rel_id, sat2_orb, sat2_rel_id, sat_positions, num_orbits, num_sats_per_orbit,
+                           orbit_slot_index=None):
     """
     Get the absolute id of the neighbor satellite from relative ids
     :param sat1_orb: orbit id of satellite 1
@@ -132,10 +150,13 @@ def get_neighbor_satellite(sat1_orb, sat1_rel_id, sat2_orb, sat2_rel_id, sat_pos
     :param sat_positions: Collection of satellites with position data
     :param num_orbits: Number of orbits in the constellation
     :param num_sats_per_orbit: Number of satellites per orbit
+    :param orbit_slot_index: Output of build_orbit_slot_index; when given the lookup is O(1)
     :return: absolute id of the neighbor satellite
     """
     neighbor_abs_orb = (sat1_orb + sat2_orb) % num_orbits
     neighbor_abs_pos = (sat1_rel_id + sat2_rel_id) % num_sats_per_orbit
+    if orbit_slot_index is not None:
+        return int(orbit_slot_index["slot_to_sat"][neighbor_abs_orb, neighbor_abs_pos])
     sel_sat_id = -1
     for sat_id in sat_positions:
         if sat_positions[sat_id]["orb_id"] == neighbor_abs_orb \
@@ -145,6 +166,141 @@ def get_neighbor_satellite(sat1_orb, sat1_rel_id, sat2_orb, sat2_rel_id, sat_pos
     return sel_sat_id
 
 
+def get_motif_neighbors(orbit_slot_index, orb_offset, sat_offset):
+    """
+    Applies one motif link (orbit and slot offsets) to the whole constellation at once
+    :param orbit_slot_index: Output of build_orbit_slot_index
+    :param orb_offset: Orbit offset of the motif link
+    :param sat_offset: Slot offset of the motif link
+    :return: Array with the neighbor satellite id of every satellite, aligned with orbit_slot_index["sat_id"]
+    """
+    num_orbits, num_sats_per_orbit = orbit_slot_index["slot_to_sat"].shape
+    return orbit_slot_index["slot_to_sat"][(orbit_slot_index["orb_id"] + orb_offset) % num_orbits,
+                                           (orbit_slot_index["orb_sat_id"] + sat_offset) % num_sats_per_orbit]
+
+
+def get_motif_neighbor_pairs(orbit_slot_index, motif):
+    """
+    Gets all ISLs induced by a two-link motif, ordered by satellite with the first motif link before the second
+    :param orbit_slot_index: Output of build_orbit_slot_index
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :return: Arrays of satellite 1 and satellite 2 ids
+    """
+    neighbors_1 = get_motif_neighbors(orbit_slot_index, motif["sat_1_orb_offset"], motif["sat_1_sat_offset"])
+    neighbors_2 = get_motif_neighbors(orbit_slot_index, motif["sat_2_orb_offset"], motif["sat_2_sat_offset"])
+    sat_1 = np.repeat(orbit_slot_index["sat_id"], 2)
+    sat_2 = np.stack((neighbors_1, neighbors_2), axis=1).reshape(-1)
+    return sat_1, sat_2
+
+
+def get_zone_candidates(orbit_slot_index, motif, sat_abs_lat_deg, lat_bottom=None, lat_top=None):
+    """
+    Lists the ISLs induced by a motif inside a latitude zone, in the order they are added to the graph.
+    Both end points have to be above the bottom latitude and not both above the top latitude
+    (see find_multi_motifs.get_motif_candidates and check_edge_range).
+    :param orbit_slot_index: Output of build_orbit_slot_index
+    :param motif: Motif containing the relative positions of the neighboring satellites
+    :param sat_abs_lat_deg: Absolute satellite latitudes indexed by satellite id
+    :param lat_bottom: Lower latitude of the zone (None for no bound)
+    :param lat_top: Upper latitude of the zone (None for no bound)
+    :return: List of (satellite, neighbor satellite) pairs
+    """
+    sat_1, sat_2 = get_motif_neighbor_pairs(orbit_slot_index, motif)
+    lat_1 = sat_abs_lat_deg[sat_1]
+    lat_2 = sat_abs_lat_deg[sat_2]
+    in_zone = np.ones(len(sat_1), dtype=bool)
+    if lat_bottom is not None:
+        in_zone &= (lat_1 > lat_bottom) & (lat_2 > lat_bottom)
+    if lat_top is not None:
+        in_zone &= ~((lat_1 > lat_top) & (lat_2 > lat_top))
+    return list(zip(sat_1[in_zone].tolist(), sat_2[in_zone].tolist()))
+
+
+def get_valid_motif_links(valid_isls, sat_positions, sat_id, num_orbits, num_sats_per_orbit):
+    """
+    Get all feasible north and right links for a specific satellite
+    :param valid_isls: Collection of valid ISLs
+    :param sat_positions: Collection of satellites with position data
+    :param sat_id: Satellite id
+    :param num_orbits: Number of orbits in the constellation
+    :param num_sats_per_orbit: Number of satellites per orbit
+    :return: Collection of links with neighbor satellite, orbit offset and relative id
+    """
+    orbit_offset = num_orbits / 4
+    valid_motif_links = {}
+    valid_link_cnt = 0
+    for i in range(len(valid_isls)):
+        if valid_isls[i]["sat_1"] == sat_id and valid_isls[i]["sat_2"] > sat_id and \
+                sat_positions[valid_isls[i]["sat_2"]]["orb_id"] < orbit_offset:
+            orb_id = math.floor(valid_isls[i]["sat_2"] / num_sats_per_orbit)
+            sat_rel_id = valid_isls[i]["sat_2"] - sat_id - orb_id * num_sats_per_orbit
+            if sat_rel_id - sat_id > num_sats_per_orbit / 4:
+                sat_rel_id = sat_rel_id - num_sats_per_orbit
+            if not (orb_id == 0 and sat_rel_id < 0):
+                valid_motif_links[valid_link_cnt] = {
+                    "sat_id": valid_isls[i]["sat_2"],
+                    "orb_id": orb_id,
+                    "sat_rel_id": sat_rel_id
+                }
+                valid_link_cnt += 1
+    return valid_motif_links
+
+
+def get_motif_possibilities(valid_motif_links):
+    """
+    Combines pairs of links into motifs; for same orbit, the other link is selected from a different orbit
+    :param valid_motif_links: Output of get_valid_motif_links
+    :return: Collection of motif possibilities (wStretch and wHop are -1 until the motif is evaluated)
+    """
+    motif_possibilities = {}
+    motif_cnt = 0
+    for i in range(len(valid_motif_links) - 1):
+        for j in range(i + 1, len(valid_motif_links)):
+            if not (valid_motif_links[i]["orb_id"] == 0 and valid_motif_links[j]["orb_id"] == 0) and not (
+                    valid_motif_links[i]["sat_id"] == valid_motif_links[j]["sat_id"]):
+                motif_possibilities[motif_cnt] = {
+                    "motif_cnt": motif_cnt,
+                    "sat_1_id": valid_motif_links[i]["sat_id"],
+                    "sat_1_orb_offset": valid_motif_links[i]["orb_id"],
+                    "sat_1_sat_offset": valid_motif_links[i]["sat_rel_id"],
+                    "sat_2_id": valid_motif_links[j]["sat_id"],
+                    "sat_2_orb_offset": valid_motif_links[j]["orb_id"],
+                    "sat_2_sat_offset": valid_motif_links[j]["sat_rel_id"],
+                    "wStretch": -1.0,
+                    "wHop": -1.0
+                }
+                motif_cnt += 1
+    return motif_possibilities
+
+
+def find_zone_motif_possibilities(valid_isls, sat_positions, orb_0_sat_positions, num_orbits, num_sats_per_orbit,
+                                  lat, next_lat):
+    """
+    Get all feasible motifs for a latitude zone, from the first quadrant satellite of orbit 0 in the zone with the
+    fewest motifs
+    :param valid_isls: Collection of valid ISLs
+    :param sat_positions: Collection of satellites with position data
+    :param orb_0_sat_positions: Collection of the first quadrant satellites of orbit 0
+    :param num_orbits: Number of orbits in the constellation
+    :param num_sats_per_orbit: Number of satellites per orbit
+    :param lat: The lower latitude
+    :param next_lat: The upper latitude
+    :return: Collection of motif possibilities for the latitude ring
+    """
+    lat_buffered = lat - 2
+    sat_id = -1
+    min_motifs = 9999999
+    for index in range(len(orb_0_sat_positions)):
+        if lat_buffered < orb_0_sat_positions[index]["lat_deg"] < next_lat:
+            num_motifs = len(get_motif_possibilities(get_valid_motif_links(valid_isls, sat_positions, index,
+                                                                           num_orbits, num_sats_per_orbit)))
+            if num_motifs < min_motifs:
+                min_motifs = num_motifs
+                sat_id = index
+    return get_motif_possibilities(get_valid_motif_links(valid_isls, sat_positions, sat_id, num_orbits,
+                                                         num_sats_per_orbit))
+
+
 def check_edge_availability(graph, node1, node2):
     """
     Checks if an edge between 2 satellites is possible considering each satellite can have at most 4 ISLs
@@ -161,28 +317,58 @@ def check_edge_availability(graph, node1, node2):
     return is_possible
 
 
-def add_coverage_for_city(graph, city, city_coverage):
+def build_city_coverage_index(city_coverage):
+    """
+    Groups city-satellite mappings per city so that coverage lookups do not scan the whole collection
+    :param city_coverage: Collection of city-satellite mappings
+    :return: Mapping from city to arrays of satellite ids ("sat") and up/down-link distances ("dist")
+    """
+    grouped = {}
+    for i in range(len(city_coverage)):
+        grouped.setdefault(city_coverage[i]["city"], []).append((city_coverage[i]["sat"], city_coverage[i]["dist"]))
+    coverage_index = {}
+    for city in grouped:
+        coverage_index[city] = {
+            "sat": np.array([link[0] for link in grouped[city]], dtype=np.int32),
+            "dist": np.array([link[1] for link in grouped[city]], dtype=np.float64)
+        }
+    return coverage_index
+
+
+def add_coverage_for_city(graph, city, city_coverage, coverage_index=None):
     """
     Adds city-satellite up/down-links to the graph
     :param graph: The graph under consideration with nodes being the satellites and/or cities
     :param city: The city for which coverage needs to be added
     :param city_coverage: Collection of city-satellite mappings
+    :param coverage_index: Output of build_city_coverage_index; when given city_coverage is not scanned
     :return: Updated graph
     """
+    if coverage_index is not None:
+        if city in coverage_index:
+            for sat, dist in zip(coverage_index[city]["sat"].tolist(), coverage_index[city]["dist"].tolist()):
+                graph.add_edge(city, sat, length=dist)
+        return graph
     for i in range(len(city_coverage)):
         if city_coverage[i]["city"] == city:
             graph.add_edge(city_coverage[i]["city"], city_coverage[i]["sat"], length=city_coverage[i]["dist"])
     return graph
 
 
-def remove_coverage_for_city(graph, city, city_coverage):
+def remove_coverage_for_city(graph, city, city_coverage, coverage_index=None):
     """
     Removes city-satellite up/down-links from the graph
     :param grph: The graph under consideration with nodes being the satellites and/or cities
     :param city: The city for which coverage needs to be removed
     :param city_coverage: Collection of city-satellite mappings
+    :param coverage_index: Output of build_city_coverage_index; when given city_coverage is not scanned
     :return: Updated graph
     """
+    if coverage_index is not None:
+        if city in coverage_index:
+            for sat in coverage_index[city]["sat"].tolist():
+                graph.remove_edge(city, sat)
+        return graph
     for i in range(len(city_coverage)):
         if city_coverage[i]["city"] == city:
             graph.remove_edge(city_coverage[i]["city"], city_coverage[i]["sat"])